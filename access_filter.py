@@ -0,0 +1,72 @@
+# access_filter.py
+# Filtro de acceso por país y LIMIT empujados a SQLite: el SQL generado se envuelve como subconsulta
+# `SELECT * FROM (<sql>) AS _q WHERE _q.<país> IN (...) LIMIT ...` con parámetros con nombre.
+import sqlite3
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from semantic_layer import derived_index
+
+PARAM_PREFIX = "_acl_"
+
+# Por prioridad: la primera que aparezca en las columnas del resultado es la que se filtra.
+COUNTRY_COLUMN_NAMES = ('country_code', 'country', 'pais')
+
+def _qi(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _strip(sql: str) -> str:
+    return (sql or '').strip().rstrip(';').strip()
+
+def country_columns(layer: Dict[str, Any]) -> List[str]:
+    """
+    Nombres de columna de país: COUNTRY_COLUMN_NAMES + las `*_country_code` del esquema (p. ej. billing_country_code).
+    Se calcula una vez por versión de la capa semántica.
+    """
+    def build(l: Dict[str, Any]) -> List[str]:
+        names = {c['name'].lower() for cols in l['schema']['columns'].values() for c in cols}
+        return list(COUNTRY_COLUMN_NAMES) + sorted(n for n in names if n.endswith('_country_code'))
+    return derived_index(layer, 'country_columns', build)
+
+def normalize_countries(countries: Optional[Sequence[str]]) -> Optional[List[str]]:
+    """None = usuario global (sin filtro). Códigos en mayúsculas y sin repetidos; [] no ve ninguna fila."""
+    if countries is None:
+        return None
+    out: List[str] = []
+    for c in countries:
+        c = (c or '').strip().upper()
+        if c and c not in out:
+            out.append(c)
+    return out
+
+def output_columns(conn: sqlite3.Connection, sql: str, params: Dict[str, Any]) -> List[str]:
+    """
+    Columnas del resultado sin ejecutar la consulta (LIMIT 0 sale antes del primer paso).
+    Sigue siendo SQL del usuario: quien llama lo ejecuta bajo el gobernador.
+    """
+    cur = conn.execute(f"SELECT * FROM (\n{_strip(sql)}\n) LIMIT 0", params or {})
+    return [d[0] for d in cur.description or []]
+
+def resolve_country_column(columns: Sequence[str], candidates: Sequence[str]) -> Optional[str]:
+    by_lower = {}
+    for c in columns:
+        by_lower.setdefault(c.lower(), c)
+    return next((by_lower[n] for n in candidates if n in by_lower), None)
+
+def scoped_sql(sql: str, params: Dict[str, Any], country_column: Optional[str],
+               allowed: Optional[List[str]], limit: Optional[int]) -> Tuple[str, Dict[str, Any]]:
+    """
+    SQL envuelto + params ampliados (prefijo _acl_ para no chocar con los del LLM).
+    Los saltos de línea evitan que un comentario `--` final del SQL generado se coma el paréntesis.
+    La comparación es COLLATE NOCASE: `allowed` va en mayúsculas y hay filas guardadas como 'es'.
+    """
+    p = dict(params or {})
+    where = ''
+    if country_column is not None and allowed is not None:
+        names = [f"{PARAM_PREFIX}country_{i}" for i in range(len(allowed))]
+        p.update(zip(names, allowed))
+        where = f"\nWHERE _q.{_qi(country_column)} COLLATE NOCASE IN ({', '.join(':' + n for n in names)})"
+    tail = ''
+    if limit is not None:
+        p[f"{PARAM_PREFIX}limit"] = int(limit)
+        tail = f"\nLIMIT :{PARAM_PREFIX}limit"
+    return f"SELECT * FROM (\n{_strip(sql)}\n) AS _q{where}{tail}", p
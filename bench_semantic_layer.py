@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la capa semántica sobre esquemas sintéticos grandes.
+
+    python bench_semantic_layer.py --sizes 500 2000
+    python bench_semantic_layer.py --introspect --sizes 500 2000
+"""
+
+import argparse, os, random, sqlite3, tempfile, time
+from typing import Any, Dict, List
+
+from semantic_layer import _pluralize, _singularize, infer_relationships, inspect_schema
+
+def synthetic_schema(n_tables: int, id_cols: int = 5, fk_cols: int = 2, seed: int = 42) -> Dict[str, Any]:
+    """Esquema en memoria con el formato de inspect_schema: n tablas `t<i>_items` con columnas `*_id` cruzadas."""
+    rnd = random.Random(seed)
+    tables = [f"t{i}_items" for i in range(n_tables)]
+    columns: Dict[str, List[Dict[str, Any]]] = {}
+    fks: Dict[str, List[Dict[str, Any]]] = {}
+    for t in tables:
+        refs = rnd.sample(tables, min(id_cols, n_tables))
+        columns[t] = [{'name': 'id'}, {'name': 'name'}] + [{'name': f"{_singularize(r)}_id"} for r in refs]
+        fks[t] = [{'table': r, 'from': f"{_singularize(r)}_id", 'to': 'id'} for r in refs[:fk_cols]]
+    return {'tables': tables, 'columns': columns, 'foreign_keys': fks}
+
+def legacy_infer_relationships(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Implementación previa (bucle tabla x tabla + dedupe lineal), solo para comparar."""
+    tables, columns, fks = schema['tables'], schema['columns'], schema['foreign_keys']
+    relationships: List[Dict[str, Any]] = []
+    for src, fk_list in fks.items():
+        for fk in fk_list:
+            dst = fk.get('table'); frm = fk.get('from'); to = fk.get('to') or 'id'
+            if dst: relationships.append({'type':'fk','from_table':src,'from_column':frm,'to_table':dst,'to_column':to})
+    for t in tables:
+        for col in columns[t]:
+            name = col['name']
+            if name.endswith('_id') and name != 'id':
+                cand = name[:-3]
+                cands = {cand, _pluralize(cand), _singularize(cand)}
+                for other in tables:
+                    if other in cands or _singularize(other) in cands or _pluralize(other) in cands:
+                        if not any(r for r in relationships if r['from_table']==t and r['to_table']==other and r['from_column']==name):
+                            relationships.append({'type':'heuristic_id','from_table':t,'from_column':name,'to_table':other,'to_column':'id'})
+    return {'relationships': relationships}
+
+def write_synthetic_db(db_path: str, schema: Dict[str, Any]) -> None:
+    """Materializa el esquema sintético como DDL real (FKs declaradas + un índice por FK)."""
+    conn = sqlite3.connect(db_path)
+    for t in schema['tables']:
+        cols = [f"{c['name']} INTEGER" for c in schema['columns'][t] if c['name'] not in ('id', 'name')]
+        refs = [f"FOREIGN KEY ({fk['from']}) REFERENCES {fk['table']}(id)" for fk in schema['foreign_keys'][t]]
+        conn.execute(f"CREATE TABLE {t} (id INTEGER PRIMARY KEY, name TEXT, {', '.join(cols + refs)})")
+        for fk in schema['foreign_keys'][t]:
+            conn.execute(f"CREATE INDEX idx_{t}_{fk['from']} ON {t}({fk['from']})")
+    conn.commit()
+    conn.close()
+
+def legacy_inspect_schema(db_path: str) -> Dict[str, Any]:
+    """Bucle de PRAGMAs desde Python con la misma salida que inspect_schema (vistas e índices incluidos), solo para comparar."""
+    conn = sqlite3.connect(db_path); conn.row_factory = sqlite3.Row; cur = conn.cursor()
+    cur.execute("SELECT type, name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    objects = [(r['type'], r['name']) for r in cur.fetchall()]
+    columns = {}; fks = {}; indexes = {}
+    for type_, t in objects:
+        cur.execute(f"PRAGMA table_info('{t}')"); columns[t] = [dict(r) for r in cur.fetchall()]
+        fks[t] = []; indexes[t] = []
+        if type_ != 'table':
+            continue
+        cur.execute(f"PRAGMA foreign_key_list('{t}')"); fks[t] = [dict(r) for r in cur.fetchall()]
+        cur.execute(f"PRAGMA index_list('{t}')")
+        for il in cur.fetchall():
+            info = conn.execute(f"PRAGMA index_info('{il['name']}')").fetchall()
+            indexes[t].append({'name': il['name'], 'unique': il['unique'], 'origin': il['origin'], 'partial': il['partial'],
+                               'columns': [r['name'] for r in info]})
+    conn.close()
+    return {'tables': [t for _, t in objects], 'views': [t for type_, t in objects if type_ == 'view'],
+            'columns': columns, 'foreign_keys': fks, 'indexes': indexes}
+
+def bench_introspection(sizes: List[int]) -> None:
+    print(f"{'tablas':>8} {'1 consulta (s)':>15} {'bucle de PRAGMAs (s)':>21}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            db_path = os.path.join(tmp, f"synthetic_{n}.sqlite")
+            write_synthetic_db(db_path, synthetic_schema(n))
+            single = min(_timed(inspect_schema, db_path) for _ in range(3))
+            legacy = min(_timed(legacy_inspect_schema, db_path) for _ in range(3))
+            print(f"{n:>8} {single:>15.4f} {legacy:>21.4f}")
+
+def _timed(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[500, 2000])
+    ap.add_argument("--legacy-max", type=int, default=500, help="no ejecutar la versión previa por encima de este tamaño")
+    ap.add_argument("--introspect", action="store_true", help="comparar inspect_schema (1 consulta) con el bucle de PRAGMAs equivalente")
+    args = ap.parse_args()
+
+    if args.introspect:
+        bench_introspection(args.sizes)
+        return
+
+    print(f"{'tablas':>8} {'relaciones':>11} {'infer (s)':>10} {'us/tabla':>9} {'legacy (s)':>11}")
+    for n in args.sizes:
+        schema = synthetic_schema(n)
+        elapsed = _timed(infer_relationships, schema)
+        n_rels = len(infer_relationships(schema)['relationships'])
+        legacy = f"{_timed(legacy_infer_relationships, schema):11.3f}" if n <= args.legacy_max else f"{'-':>11}"
+        print(f"{n:>8} {n_rels:>11} {elapsed:>10.4f} {elapsed / n * 1e6:>9.1f} {legacy}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# columnar.py
+# Formato columnar compacto para resultados: nombres de columna una vez + arrays por columna o matriz de filas.
+import json, re, sqlite3
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import orjson  # opcional: serialización más rápida si está instalado
+except ImportError:
+    orjson = None
+
+_STORAGE_CLASSES = ((bool, 'integer'), (int, 'integer'), (float, 'real'), (str, 'text'), (bytes, 'blob'))
+
+def _storage_class(value: Any) -> str:
+    for py_type, name in _STORAGE_CLASSES:
+        if isinstance(value, py_type):
+            return name
+    return 'text'
+
+# Literales, identificadores entre comillas y comentarios se conservan; solo los parámetros pasan a NULL.
+_PARAM_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?\*/)|[:@$][A-Za-z_]\w*|\?\d*",
+                       re.DOTALL)
+
+def declared_types(conn: sqlite3.Connection, sql: str) -> List[Optional[str]]:
+    """
+    Tipo declarado (en minúsculas) de cada columna del resultado; None para expresiones.
+    sqlite3 de Python no expone sqlite3_column_decltype, pero una vista sí (pragma_table_info): se crea una TEMP VIEW
+    con el SQL (parámetros como NULL: las vistas no los admiten) y se borra. conn tiene que poder escribir en temp
+    (no vale una conexión query_only). [] si el SQL no se puede convertir en vista.
+    """
+    body = _PARAM_RE.sub(lambda m: m.group(1) or 'NULL', (sql or '').strip().rstrip(';'))
+    try:
+        conn.execute(f"CREATE TEMP VIEW _columnar_types AS {body}")
+    except sqlite3.Error:
+        return []
+    try:
+        return [t.lower() if t else None for (t,) in conn.execute("SELECT type FROM pragma_table_info('_columnar_types', 'temp')")]
+    finally:
+        conn.execute("DROP VIEW temp._columnar_types")
+
+def column_types(rows: Sequence[Sequence[Any]], n_columns: int, declared: Optional[Sequence[Optional[str]]] = None) -> List[str]:
+    """
+    Tipo declarado de cada columna si lo hay (declared, de declared_types). Para expresiones, clase de almacenamiento
+    SQLite del primer valor no nulo ('null' si la columna está vacía; si mezcla clases gana la primera observada).
+    """
+    types: List[str] = ['null'] * n_columns
+    if declared is not None and len(declared) == n_columns:
+        for i, t in enumerate(declared):
+            if t:
+                types[i] = t
+    pending = {i for i in range(n_columns) if types[i] == 'null'}
+    for row in rows:
+        for i in list(pending):
+            if row[i] is not None:
+                types[i] = _storage_class(row[i])
+                pending.discard(i)
+        if not pending:
+            break
+    return types
+
+def to_columnar(columns: List[str], rows: Sequence[Sequence[Any]], orient: str = 'columns',
+                declared: Optional[Sequence[Optional[str]]] = None) -> Dict[str, Any]:
+    """orient='columns' -> data[i] es la columna i; orient='rows' -> data[j] es la fila j como lista."""
+    if orient == 'columns':
+        data = [list(col) for col in zip(*rows)] if rows else [[] for _ in columns]
+    else:
+        data = [list(r) for r in rows]
+    return {'columns': columns, 'types': column_types(rows, len(columns), declared), 'orient': orient, 'data': data}
+
+def rows_from_columnar(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Reconstruye filas dict (p. ej. para clientes que filtran por clave)."""
+    columns, data = payload['columns'], payload['data']
+    if payload.get('orient') == 'columns':
+        return [dict(zip(columns, values)) for values in zip(*data)] if data else []
+    return [dict(zip(columns, values)) for values in data]
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
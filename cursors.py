@@ -0,0 +1,267 @@
+# cursors.py
+# Cursores de servidor para paginar /query.
+#   keyset       -> la consulta lee una sola tabla y devuelve su clave única (PK o UNIQUE NOT NULL según la capa
+#                   semántica): cada página es `WHERE clave > :última ORDER BY clave LIMIT n`, coste O(página).
+#   materialized -> cualquier otra consulta: el resultado se guarda una vez y se sirve por posición durante un TTL.
+# El estado vive en un fichero SQLite compartido por los workers. El token es opaco: id de cursor + posición,
+# firmados con un secreto propio de cada cursor (el SQL nunca sale del servidor y la posición no se puede falsear).
+import base64, hashlib, hmac, json, re, secrets, sqlite3, threading, time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MODES = ('keyset', 'materialized')
+
+# Construcciones con las que una fila del resultado ya no es una fila de la tabla base (o el orden es otro).
+_NOT_KEYSET_RE = re.compile(
+    r"\b(join|group\s+by|distinct|union|intersect|except|having|limit|offset|over|with|natural)\b", re.IGNORECASE
+)
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_ORDER_TAIL_RE = re.compile(r"\border\s+by\s+(.+)$", re.IGNORECASE | re.DOTALL)
+_ORDER_ITEM_RE = re.compile(r"^\s*(?:\w+\.)?[\"`\[]?(\w+)[\"`\]]?(?:\s+(asc|desc))?\s*$", re.IGNORECASE)
+
+class CursorError(Exception):
+    """status 400 = token inválido; 410 = cursor caducado, desconocido o de otro esquema."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+def _qi(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _strip(sql: str) -> str:
+    return (sql or '').strip().rstrip(';').strip()
+
+def _tables_read(conn: sqlite3.Connection, sql: str, params: Dict[str, Any]) -> Tuple[List[str], set]:
+    """(columnas del resultado, tablas leídas) preparando la consulta con LIMIT 0 bajo un authorizer."""
+    read: set = set()
+
+    def authorizer(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and arg1 and not arg1.startswith('sqlite_'):
+            read.add(arg1)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        cur = conn.execute(f"SELECT * FROM (\n{_strip(sql)}\n) LIMIT 0", params or {})
+    finally:
+        conn.set_authorizer(None)
+    return [d[0] for d in cur.description or []], read
+
+def _unique_columns(layer: Dict[str, Any], table: str) -> List[str]:
+    """PK de una columna y columnas UNIQUE de una columna NOT NULL (un NULL rompería la comparación keyset)."""
+    schema = layer['schema']
+    cols = {c['name']: c for c in schema['columns'].get(table, [])}
+    pks = [c['name'] for c in cols.values() if c.get('pk')]
+    out = pks if len(pks) == 1 else []
+    for idx in schema.get('indexes', {}).get(table, []):
+        if idx.get('unique') and len(idx['columns']) == 1 and not idx.get('partial'):
+            name = idx['columns'][0]
+            if name in cols and cols[name].get('notnull') and name not in out:
+                out.append(name)
+    return out
+
+def detect_keyset_key(conn: sqlite3.Connection, sql: str, params: Dict[str, Any], layer: Dict[str, Any]) -> Optional[Tuple[str, bool]]:
+    """
+    (columna clave, descendente) si el SQL se puede paginar por keyset sin cambiar su resultado; None si no.
+    Si el SQL ya ordena, solo vale cuando ordena exactamente por esa clave.
+    """
+    text = _LITERAL_RE.sub("''", _strip(sql))
+    if _NOT_KEYSET_RE.search(text) or len(re.findall(r"\bselect\b", text, re.IGNORECASE)) != 1:
+        return None
+    columns, tables = _tables_read(conn, sql, params)
+    if len(tables) != 1:
+        return None
+    keys = [k for k in _unique_columns(layer, next(iter(tables))) if k in columns]
+    order = _ORDER_TAIL_RE.search(text)
+    if order:
+        m = _ORDER_ITEM_RE.match(order.group(1))
+        if not m or m.group(1) not in keys:
+            return None
+        key, desc = m.group(1), (m.group(2) or '').lower() == 'desc'
+    elif keys:
+        key, desc = keys[0], False
+    else:
+        return None
+    # `SELECT otra AS id`: la columna del resultado no sería la clave de la tabla.
+    if re.search(rf"\bas\s+[\"`\[]?{re.escape(key)}\b", text, re.IGNORECASE):
+        return None
+    return key, desc
+
+def keyset_sql(sql: str, key: str, descending: bool, after: bool) -> str:
+    """Página keyset sobre el SQL (ya con el filtro de acceso aplicado). Params: _cursor_limit [+ _cursor_after]."""
+    where = f"\nWHERE _k.{_qi(key)} {'<' if descending else '>'} :_cursor_after" if after else ''
+    return (f"SELECT * FROM (\n{_strip(sql)}\n) AS _k{where}\n"
+            f"ORDER BY _k.{_qi(key)} {'DESC' if descending else 'ASC'}\nLIMIT :_cursor_limit")
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+# Filas materializadas en JSON: los BLOB van como {"$blob": base64} (una fila SQLite nunca trae un objeto JSON).
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$blob': base64.b64encode(bytes(value)).decode('ascii')}
+    return str(value)
+
+def _decode_value(obj: Dict[str, Any]) -> Any:
+    return base64.b64decode(obj['$blob']) if obj.keys() == {'$blob'} else obj
+
+def _dump_row(row: Sequence[Any]) -> str:
+    return json.dumps(list(row), default=_encode_value)
+
+def _load_row(text: str) -> Tuple[Any, ...]:
+    return tuple(json.loads(text, object_hook=_decode_value))
+
+class CursorStore:
+    """
+    Cursores con caducidad deslizante (ttl_seconds desde la última página servida).
+    Los resultados materializados se limitan a max_rows filas; las entradas caducadas se purgan al crear cursores.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 300.0, max_rows: int = 100000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.stats = {'opened_keyset': 0, 'opened_materialized': 0, 'pages': 0, 'expired': 0, 'invalid': 0,
+                      'purged': 0, 'rows_materialized': 0}
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS cursors (
+                cursor_id       TEXT PRIMARY KEY,
+                secret          TEXT NOT NULL,
+                mode            TEXT NOT NULL,
+                question        TEXT NOT NULL,
+                sql             TEXT NOT NULL,
+                exec_sql        TEXT NOT NULL,
+                params          TEXT NOT NULL,
+                key_column      TEXT,
+                descending      INTEGER NOT NULL DEFAULT 0,
+                page_size       INTEGER NOT NULL,
+                columns         TEXT NOT NULL,
+                total_rows      INTEGER,
+                fingerprint     TEXT NOT NULL,
+                pages_served    INTEGER NOT NULL DEFAULT 1,
+                expires_at      REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cursors_expires ON cursors(expires_at);
+            CREATE TABLE IF NOT EXISTS cursor_rows (
+                cursor_id       TEXT NOT NULL,
+                seq             INTEGER NOT NULL,
+                row             TEXT NOT NULL,
+                PRIMARY KEY (cursor_id, seq)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._conn.commit()
+
+    def open(self, mode: str, question: str, sql: str, exec_sql: str, params: Dict[str, Any], page_size: int,
+             columns: List[str], fingerprint: str, key: Optional[str] = None, descending: bool = False,
+             rows: Optional[Sequence[Sequence[Any]]] = None) -> Dict[str, Any]:
+        """Crea un cursor. mode='materialized' guarda `rows` (hasta max_rows) para servirlas por posición."""
+        assert mode in MODES
+        cursor = {'cursor_id': secrets.token_urlsafe(12), 'secret': secrets.token_hex(16), 'mode': mode,
+                  'question': question, 'sql': sql, 'exec_sql': exec_sql, 'params': params, 'key_column': key,
+                  'descending': descending, 'page_size': page_size, 'columns': columns,
+                  'total_rows': len(rows) if rows is not None else None, 'fingerprint': fingerprint}
+        with self._lock:
+            self._purge()
+            self._conn.execute(
+                """
+                INSERT INTO cursors (cursor_id, secret, mode, question, sql, exec_sql, params, key_column, descending,
+                                     page_size, columns, total_rows, fingerprint, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (cursor['cursor_id'], cursor['secret'], mode, question, sql, exec_sql,
+                 json.dumps(params or {}, default=str), key, int(descending), page_size, json.dumps(columns),
+                 cursor['total_rows'], fingerprint, time.time() + self.ttl_seconds),
+            )
+            if rows is not None:
+                self._conn.executemany(
+                    "INSERT INTO cursor_rows (cursor_id, seq, row) VALUES (?, ?, ?)",
+                    ((cursor['cursor_id'], i, _dump_row(r)) for i, r in enumerate(rows)),
+                )
+                self.stats['rows_materialized'] += len(rows)
+            self._conn.commit()
+            self.stats[f'opened_{mode}'] += 1
+        return cursor
+
+    def token(self, cursor: Dict[str, Any], position: Dict[str, Any]) -> str:
+        """position = {'after': valor de la clave} (keyset) | {'offset': n} (materialized)."""
+        payload = _b64(json.dumps([cursor['cursor_id'], position], separators=(',', ':')).encode('utf-8'))
+        sig = hmac.new(cursor['secret'].encode('ascii'), payload.encode('ascii'), hashlib.sha256).hexdigest()[:32]
+        return f"{payload}.{sig}"
+
+    def resolve(self, token: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """(cursor, posición) y renueva la caducidad. Lanza CursorError."""
+        try:
+            payload, sig = token.split('.', 1)
+            cursor_id, position = json.loads(_unb64(payload))
+            assert isinstance(position, dict)
+        except Exception:
+            self._count('invalid')
+            raise CursorError(400, "Cursor inválido")
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT secret, mode, question, sql, exec_sql, params, key_column, descending, page_size, columns,
+                       total_rows, fingerprint, expires_at
+                FROM cursors WHERE cursor_id=?
+                """,
+                (cursor_id,),
+            ).fetchone()
+            if row is not None and row[12] >= time.time():
+                self._conn.execute(
+                    "UPDATE cursors SET expires_at=?, pages_served = pages_served + 1 WHERE cursor_id=?",
+                    (time.time() + self.ttl_seconds, cursor_id),
+                )
+                self._conn.commit()
+        if row is None or row[12] < time.time():
+            self._count('expired')
+            raise CursorError(410, "Cursor caducado o desconocido")
+        expected = hmac.new(row[0].encode('ascii'), payload.encode('ascii'), hashlib.sha256).hexdigest()[:32]
+        if not hmac.compare_digest(expected, sig):
+            self._count('invalid')
+            raise CursorError(400, "Cursor inválido")
+        self._count('pages')
+        cursor = {'cursor_id': cursor_id, 'secret': row[0], 'mode': row[1], 'question': row[2], 'sql': row[3],
+                  'exec_sql': row[4], 'params': json.loads(row[5]), 'key_column': row[6], 'descending': bool(row[7]),
+                  'page_size': row[8], 'columns': json.loads(row[9]), 'total_rows': row[10], 'fingerprint': row[11]}
+        return cursor, position
+
+    def rows(self, cursor_id: str, offset: int, n: int) -> List[Tuple[Any, ...]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row FROM cursor_rows WHERE cursor_id=? AND seq >= ? ORDER BY seq LIMIT ?", (cursor_id, offset, n)
+            ).fetchall()
+        return [_load_row(r[0]) for r in rows]
+
+    def _purge(self) -> None:
+        expired = [r[0] for r in self._conn.execute("SELECT cursor_id FROM cursors WHERE expires_at < ?", (time.time(),))]
+        for cid in expired:
+            self._conn.execute("DELETE FROM cursor_rows WHERE cursor_id=?", (cid,))
+            self._conn.execute("DELETE FROM cursors WHERE cursor_id=?", (cid,))
+        self.stats['purged'] += len(expired)
+
+    def purge(self) -> None:
+        with self._lock:
+            self._purge()
+            self._conn.commit()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            n, rows = self._conn.execute(
+                "SELECT COUNT(*), (SELECT COUNT(*) FROM cursor_rows) FROM cursors WHERE expires_at >= ?", (time.time(),)
+            ).fetchone()
+            return {**self.stats, 'open': n, 'stored_rows': rows, 'ttl_seconds': self.ttl_seconds,
+                    'max_rows': self.max_rows, 'path': self.path}
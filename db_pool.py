@@ -0,0 +1,160 @@
+# db_pool.py
+# Pools de conexiones SQLite: lectura (mode=ro + query_only) y escritura (una conexión, WAL) por fichero.
+import os, queue, sqlite3, threading, time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+from urllib.parse import quote
+
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "1"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_READ_CACHE_KIB = int(os.getenv("DB_READ_CACHE_KIB", "16384"))
+DB_MMAP_BYTES = int(os.getenv("DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+class PoolTimeout(RuntimeError):
+    """No quedó ninguna conexión libre dentro del plazo."""
+
+class SQLitePool:
+    """
+    Pool LIFO de tamaño fijo; las conexiones se abren bajo demanda y los PRAGMA se aplican una sola vez.
+    read_only=True abre `file:...?mode=ro` con query_only, caché de páginas y mmap ajustados.
+    """
+
+    def __init__(self, path: str, size: int, read_only: bool, timeout: float = DB_POOL_TIMEOUT_SECONDS):
+        self.path = os.path.abspath(path)
+        self.size = max(1, size)
+        self.read_only = read_only
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self.stats = {'checkouts': 0, 'opened': 0, 'discarded': 0, 'waits': 0, 'timeouts': 0,
+                      'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0, 'in_use': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            conn = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", uri=True, timeout=self.timeout, check_same_thread=False)
+            conn.execute("PRAGMA query_only=ON;")
+            conn.execute(f"PRAGMA cache_size=-{DB_READ_CACHE_KIB};")
+            conn.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES};")
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        t0 = time.perf_counter()
+        waited = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._created < self.size
+                if can_open:
+                    self._created += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+                with self._lock:
+                    self.stats['opened'] += 1
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.stats['timeouts'] += 1
+                    raise PoolTimeout(f"Sin conexiones libres en {self.path} tras {self.timeout}s")
+        wait = time.perf_counter() - t0
+        with self._lock:
+            self.stats['checkouts'] += 1
+            self.stats['in_use'] += 1
+            if waited:
+                self.stats['waits'] += 1
+                self.stats['wait_seconds_total'] += wait
+                self.stats['wait_seconds_max'] = max(self.stats['wait_seconds_max'], wait)
+        return conn
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self.stats['in_use'] -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+            self.stats['discarded'] += 1
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Presta una conexión; al devolverla se deshace cualquier transacción sin commit."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'size': self.size, 'open': self._created, 'idle': self._idle.qsize(),
+                    'read_only': self.read_only, 'path': self.path}
+
+_POOLS: Dict[tuple, SQLitePool] = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(path: str, read_only: bool) -> SQLitePool:
+    key = (os.path.abspath(path), read_only)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            size = DB_READ_POOL_SIZE if read_only else DB_WRITE_POOL_SIZE
+            pool = _POOLS[key] = SQLitePool(path, size, read_only)
+        return pool
+
+def read_connection(path: str):
+    return get_pool(path, read_only=True).connection()
+
+def write_connection(path: str):
+    return get_pool(path, read_only=False).connection()
+
+def pool_stats(path: str) -> Dict[str, Any]:
+    """{'read': {...}, 'write': {...}} para los pools ya abiertos sobre `path`."""
+    with _POOLS_LOCK:
+        pools = [p for (p_path, _), p in _POOLS.items() if p_path == os.path.abspath(path)]
+    return {('read' if p.read_only else 'write'): p.info() for p in pools}
+
+def close_pools() -> None:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for p in pools:
+        p.close()
@@ -1,17 +1,44 @@
 # fastapi_app.py
-import os, re, json, time, sqlite3, uuid
+import asyncio, csv, io, os, re, json, sqlite3, threading, time, uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
 
-from semantic_layer import build_semantic_layer
+from semantic_layer import get_semantic_layer, load_snapshot, schema_fingerprint, semantic_cache_stats
+from schema_retrieval import focused_summary, select_schema_context
+from join_planner import find_join_path, join_hints
+from text2sql_cache import Text2SQLCache, normalize_question
+from sql_templates import TemplateStore
+from single_flight import SingleFlight
+from db_pool import DB_READ_POOL_SIZE, PoolTimeout, close_pools, pool_stats, read_connection, write_connection
+from obs_writer import ObservabilityWriter
+import columnar
+import query_governor as qg
+from query_governor import OUTCOME_VALUES, QueryGovernor, QueryKilled
+from result_cache import ResultCache, execute_tracked, install_version_triggers, read_versions, result_key
+from hedging import LatencyWindow, hedged_call
+import index_advisor
+import access_filter
+import rollups
+import run_aggregates
+import run_traces
+from cursors import CursorError, CursorStore, detect_keyset_key, keyset_sql
+from sql_guard import SQLGuard, SQLRejected
+import metrics
+from metrics import CACHE_REQUESTS, GUARDRAIL_REJECTIONS, LLM_ATTEMPTS, STAGE_SECONDS
 
 def extract_json_object(text: str) -> Dict[str, Any]:
     # elimina fences ```json ... ```
@@ -37,24 +64,86 @@ def extract_json_object(text: str) -> Dict[str, Any]:
     raise ValueError("No se pudo extraer un JSON válido")
 
 # -------------------------
-# CLIENTE OPENAI
+# CLIENTE OPENAI (async, pool de conexiones acotado)
 # -------------------------
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    timeout=OPENAI_TIMEOUT_SECONDS,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS // 2),
+        timeout=OPENAI_TIMEOUT_SECONDS,
+    ),
+)
 HERE = Path(__file__).parent
 
 def get_db_path() -> str:
     return os.getenv("SQLITE_PATH") or os.getenv("DB_PATH") or str(HERE / "db.sqlite")
 
-def get_db_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(get_db_path(), timeout=10, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+def db_read():
+    """Conexión prestada del pool de solo lectura (mode=ro + query_only)."""
+    return read_connection(get_db_path())
+
+governor = QueryGovernor()
+
+def run_governed(sql: str, params: Optional[Dict[str, Any]] = None, track: bool = False) -> Dict[str, Any]:
+    """
+    Ejecuta un SELECT bajo el gobernador (plan, presupuesto, tope de filas) en el pool de lectura.
+    track=True recoge además las versiones de las tablas leídas (caché de resultados).
+    Devuelve {'columns', 'rows' (tuplas), 'versions', 'governor'}; lanza QueryKilled si se bloquea o aborta.
+    """
+    try:
+        with db_read() as conn, STAGE_SECONDS.time(stage="sql_execute"):
+            with governor.guard(conn, sql, params or {}, get_db_path()) as report:
+                limit = qg.GOVERNOR_MAX_ROWS + 1
+                if track:
+                    columns, rows, versions = execute_tracked(conn, sql, params or {}, max_rows=limit)
+                else:
+                    cur = conn.execute(sql, params or {})
+                    cur.row_factory = None
+                    rows, versions = cur.fetchmany(limit), None
+                    columns = [d[0] for d in cur.description or []]
+    except QueryKilled as e:
+        GUARDRAIL_REJECTIONS.inc(reason=f"governor_{e.reason}")
+        raise
+    rows = governor.finish(rows, report)
+    return {"columns": columns, "rows": rows, "versions": versions, "governor": report}
 
-    # Recomendado para cloud
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA busy_timeout=5000;")
+def governor_summary(report: Dict[str, Any]) -> Dict[str, Any]:
+    keys = ("outcome", "reason", "estimated_rows", "flagged", "truncated", "budget_seconds", "vm_steps", "cached")
+    out = {k: report[k] for k in keys if k in report}
+    if report.get("large_scans"):
+        out["large_scans"] = [f"{s['table']}({s['rows']})" for s in report["large_scans"]]
+    return out
 
-    return conn
+def scope_query(req: "QueryRequest") -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    """
+    Filtro de países (allowed_countries) y LIMIT empujados al SQL: SQLite descarta las filas, no el cliente.
+    La columna de país se elige entre las del resultado con los nombres conocidos por la capa semántica.
+    -> (sql, params, access) con access = {'applied', 'note', 'column', 'limit'}. Lanza QueryKilled como run_governed.
+    """
+    allowed = access_filter.normalize_countries(req.allowed_countries)
+    access: Dict[str, Any] = {"applied": False, "note": "GLOBAL_USER", "column": None, "limit": req.limit}
+    if allowed is None and req.limit is None:
+        return req.sql, req.params or {}, access
+    column = None
+    if allowed is not None:
+        # La sonda de columnas ejecuta SQL del usuario: mismo plan y presupuesto que la consulta.
+        try:
+            with db_read() as conn, governor.guard(conn, req.sql, req.params or {}, get_db_path()):
+                columns = access_filter.output_columns(conn, req.sql, req.params or {})
+        except QueryKilled as e:
+            GUARDRAIL_REJECTIONS.inc(reason=f"governor_{e.reason}")
+            raise
+        column = access_filter.resolve_country_column(columns, access_filter.country_columns(get_semantic_layer(get_db_path())))
+        if column is None:
+            access["note"] = "NO_COUNTRY_COLUMN"
+        else:
+            access.update(applied=True, column=column, note=f"filtered_by={column} allowed={allowed}")
+    sql, params = access_filter.scoped_sql(req.sql, req.params or {}, column, allowed, req.limit)
+    return sql, params, access
 
 # -------------------------
 # Helpers observabilidad oficial
@@ -68,6 +157,50 @@ def jdump(obj: Any) -> str:
     except Exception:
         return "{}"
 
+# daily_run_aggregates se actualiza en la misma transacción que cada lote de observabilidad (solo las filas nuevas).
+# Se hace desde el hilo escritor: abrir una conexión de escritura en la petición puede esperar a lectores abiertos.
+RUN_AGGREGATES_ENABLED = os.getenv("RUN_AGGREGATES", "1") != "0"
+
+_obs_writers: Dict[str, ObservabilityWriter] = {}
+_traced_dbs: set = set()
+
+def ensure_trace_columns() -> None:
+    """
+    Migra llm_runs (columnas generadas parent_run_uuid/stage + índices) si hace falta; se comprueba una vez por BD.
+    Se llama al arrancar; /runs lo repite por si la API arrancó antes de que existieran las tablas de observabilidad.
+    Las columnas son VIRTUAL: cubren también las filas escritas antes de migrar.
+    """
+    path = get_db_path()
+    if path in _traced_dbs:
+        return
+    try:
+        with db_read() as conn:
+            migrated = run_traces.is_migrated(conn)
+        if not migrated:
+            with write_connection(path) as conn:
+                run_traces.migrate(conn)
+                conn.commit()
+    except sqlite3.Error:
+        return
+    _traced_dbs.add(path)
+
+def _after_obs_write(conn: sqlite3.Connection) -> None:
+    """Trabajo en la transacción de cada lote del escritor (su hilo): agregados diarios. Sin DDL por lote."""
+    if RUN_AGGREGATES_ENABLED:
+        run_aggregates.refresh(conn)
+
+def get_obs_writer() -> ObservabilityWriter:
+    """Escritor en segundo plano por BD: las inserciones de observabilidad no esperan al disco."""
+    path = get_db_path()
+    writer = _obs_writers.get(path)
+    if writer is None:
+        writer = _obs_writers.setdefault(path, ObservabilityWriter(path, after_write=_after_obs_write))
+    return writer
+
+def flush_observability() -> None:
+    for writer in list(_obs_writers.values()):
+        writer.flush()
+
 def insert_llm_run(
     *,
     run_uuid: str,
@@ -90,40 +223,17 @@ def insert_llm_run(
     country_code: Optional[str] = None,
     context_json: Optional[dict] = None,
 ) -> None:
-    conn = get_db_conn()
-    try:
-        conn.execute(
-            """
-            INSERT INTO llm_runs
-            (run_uuid, experiment_variant_id, prompt_id, dataset_item_id, user_id, model_id, customer_id,
-             question, answer, elapsed_seconds, prompt_tokens, completion_tokens, total_tokens, cost_usd,
-             temperature, top_p, max_tokens, country_code, context_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                run_uuid, experiment_variant_id, prompt_id, dataset_item_id, user_id, model_id, customer_id,
-                question, answer, float(elapsed_seconds),
-                prompt_tokens, completion_tokens, total_tokens, cost_usd,
-                temperature, top_p, max_tokens, country_code, jdump(context_json or {})
-            ),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    get_obs_writer().run({
+        "run_uuid": run_uuid, "experiment_variant_id": experiment_variant_id, "prompt_id": prompt_id,
+        "dataset_item_id": dataset_item_id, "user_id": user_id, "model_id": model_id, "customer_id": customer_id,
+        "question": question, "answer": answer, "elapsed_seconds": float(elapsed_seconds),
+        "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": total_tokens,
+        "cost_usd": cost_usd, "temperature": temperature, "top_p": top_p, "max_tokens": max_tokens,
+        "country_code": country_code, "context_json": jdump(context_json or {}),
+    })
 
 def add_quality_metric(run_uuid: str, metric_name: str, metric_value: float, metric_json: Optional[dict] = None) -> None:
-    conn = get_db_conn()
-    try:
-        conn.execute(
-            """
-            INSERT INTO quality_metrics (llm_run_id, metric_name, metric_value, metric_json)
-            VALUES ((SELECT id FROM llm_runs WHERE run_uuid=?), ?, ?, ?)
-            """,
-            (run_uuid, metric_name, float(metric_value), jdump(metric_json or {})),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    get_obs_writer().metric(run_uuid, metric_name, float(metric_value), jdump(metric_json or {}))
 
 def add_hallucination_eval(
     run_uuid: str,
@@ -134,40 +244,34 @@ def add_hallucination_eval(
     explanation: Optional[str],
     raw_json: Optional[dict] = None,
 ) -> None:
-    conn = get_db_conn()
-    try:
-        conn.execute(
-            """
-            INSERT INTO hallucination_evaluations
-            (llm_run_id, evaluator_name, score, is_hallucination, method, explanation, raw_json)
-            VALUES ((SELECT id FROM llm_runs WHERE run_uuid=?), ?, ?, ?, ?, ?, ?)
-            """,
-            (run_uuid, evaluator_name, score, is_hallucination, method, explanation, jdump(raw_json or {})),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    get_obs_writer().hallucination(run_uuid, evaluator_name, score, is_hallucination, method, explanation, jdump(raw_json or {}))
 
 # -------------------------
 # Guardrails SQL
 # -------------------------
-SQL_MULTI_STMT_RE = re.compile(r";\s*\S", re.MULTILINE)
-FORBIDDEN_SQL_RE = re.compile(r"\b(drop|delete|truncate|alter|update|insert|attach|detach|pragma|vacuum)\b", re.IGNORECASE)
+SQL_GUARD_CACHE_SIZE = int(os.getenv("SQL_GUARD_CACHE_SIZE", "1024"))
+sql_guard = SQLGuard(SQL_GUARD_CACHE_SIZE)
+
+def check_sql(sql: str) -> Dict[str, Any]:
+    """Validación con SQLite (ver sql_guard): lanza SQLRejected; veredicto memorizado por SQL + huella de esquema."""
+    try:
+        return sql_guard.check(sql, schema_fingerprint(get_db_path()), db_read)
+    except SQLRejected as e:
+        GUARDRAIL_REJECTIONS.inc(reason=e.reason)
+        raise
 
 def assert_sql_safe(sql: str) -> None:
-    s = (sql or "").strip()
-    if not s:
-        raise HTTPException(status_code=400, detail="SQL vacío")
-    if not (s.lower().startswith("select") or s.lower().startswith("with")):
-        raise HTTPException(status_code=400, detail="Solo SELECT/CTE")
-    if SQL_MULTI_STMT_RE.search(s):
-        raise HTTPException(status_code=400, detail="Múltiples sentencias (bloqueado)")
-    if FORBIDDEN_SQL_RE.search(s):
-        raise HTTPException(status_code=400, detail="Keyword prohibida (bloqueado)")
+    try:
+        check_sql(sql)
+    except SQLRejected as e:
+        raise HTTPException(status_code=400, detail=e.detail)
 
 # -------------------------
 # API models
 # -------------------------
+QUERY_MAX_PAGE_SIZE = int(os.getenv("QUERY_MAX_PAGE_SIZE", "10000"))
+QUERY_BATCH_MAX_ITEMS = int(os.getenv("QUERY_BATCH_MAX_ITEMS", "32"))
+
 class SQLRequest(BaseModel):
     sql: str
     params: Dict[str, Any] = Field(default_factory=dict)
@@ -178,12 +282,18 @@ class SQLResponse(BaseModel):
     rows: List[Dict[str, Any]]
     rowcount: int
     elapsed_seconds: float
+    truncated: bool = False
 
 class QueryRequest(BaseModel):
     parent_run_uuid: Optional[str] = None
     question: str
     sql: str
     params: Dict[str, Any] = Field(default_factory=dict)
+    # None = usuario global. Se filtra en SQLite por la columna de país del resultado.
+    allowed_countries: Optional[List[str]] = None
+    limit: Optional[int] = Field(None, ge=1)
+    # Paginación: primera página + next_cursor (ignorado en /query/stream).
+    page_size: Optional[int] = Field(None, ge=1, le=QUERY_MAX_PAGE_SIZE)
 
 class QueryResponse(BaseModel):
     run_uuid: str
@@ -194,6 +304,55 @@ class QueryResponse(BaseModel):
     rows: List[Dict[str, Any]]
     rowcount: int
     elapsed_seconds: float
+    truncated: bool = False
+    access_filter_applied: bool = False
+    access_note: Optional[str] = None
+    next_cursor: Optional[str] = None
+    cursor_mode: Optional[str] = None
+
+class QueryNextRequest(BaseModel):
+    cursor: str
+    parent_run_uuid: Optional[str] = None
+
+class QueryBatchItem(BaseModel):
+    question: str
+    sql: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+    allowed_countries: Optional[List[str]] = None
+    limit: Optional[int] = Field(None, ge=1)
+
+class QueryBatchRequest(BaseModel):
+    parent_run_uuid: Optional[str] = None
+    # El filtro de países de la petición se aplica a las sentencias que no traen el suyo.
+    allowed_countries: Optional[List[str]] = None
+    items: List[QueryBatchItem] = Field(..., min_length=1, max_length=QUERY_BATCH_MAX_ITEMS)
+
+class QueryBatchResult(BaseModel):
+    index: int
+    ok: bool
+    status: int = 200
+    run_uuid: Optional[str] = None
+    question: str
+    rows: List[Dict[str, Any]] = Field(default_factory=list)
+    rowcount: int = 0
+    elapsed_seconds: float
+    truncated: bool = False
+    access_filter_applied: bool = False
+    access_note: Optional[str] = None
+    cache: Optional[str] = None
+    governor: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+class QueryBatchResponse(BaseModel):
+    batch_uuid: str
+    parent_run_uuid: Optional[str]
+    elapsed_seconds: float
+    slowest_seconds: float
+    sum_seconds: float
+    results: List[QueryBatchResult]
+
+class QueryStreamRequest(QueryRequest):
+    format: str = Field("ndjson", pattern="^(ndjson|csv)$")
 
 class Text2SQLReq(BaseModel):
     parent_run_uuid: Optional[str] = None
@@ -210,81 +369,780 @@ class Text2SQLResp(BaseModel):
 # -------------------------
 # FastAPI
 # -------------------------
-api = FastAPI(title="Semantic Governance Data API", version="1.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prepare_database()
+    yield
+    # Apagado limpio: primero se drenan las colas de observabilidad, luego se cierran las conexiones.
+    for writer in list(_obs_writers.values()):
+        writer.close()
+    close_pools()
+    close_types_connections()
+
+def prepare_database() -> None:
+    """DDL de arranque (tablas resumen, columnas de traza, triggers de versión) y después el snapshot de la capa semántica."""
+    ensure_rollups()
+    ensure_trace_columns()
+    install_result_cache_triggers()
+    # Arranque en frío: snapshot de la capa semántica (se valida contra el esquema en la primera petición)
+    load_snapshot(get_db_path())
+
+api = FastAPI(title="Semantic Governance Data API", version="1.1.0", lifespan=lifespan)
+api.add_middleware(metrics.MetricsMiddleware)
 
 @api.get("/health")
 def health() -> Dict[str, str]:
     return {"status": "ok", "db": get_db_path()}
 
+# -------------------------
+# Métricas Prometheus (metrics.py): histogramas por endpoint y etapa, contadores de caché/reintentos/guardrails.
+# Son de este proceso: con varios workers, Prometheus suma las series de cada uno.
+# -------------------------
+def _obs_stat(key: str):
+    return lambda: {(path,): w.info()[key] for path, w in list(_obs_writers.items())}
+
+metrics.REGISTRY.gauge("obs_queue_depth", "Filas de observabilidad en cola por BD.", ("db",), _obs_stat("queued"))
+metrics.REGISTRY.counter_func("obs_rows_dropped", "Filas de observabilidad descartadas (cola llena) por BD.", ("db",), _obs_stat("dropped"))
+
+@api.get("/metrics", include_in_schema=False)
+def prometheus_metrics() -> Response:
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 @api.get("/semantic")
 def semantic() -> Dict[str, Any]:
     db_path = get_db_path()
     if not Path(db_path).exists():
         raise HTTPException(status_code=404, detail=f"No existe DB_PATH={db_path}")
-    return build_semantic_layer(db_path)
+    layer = get_semantic_layer(db_path)
+    return {**layer, "preferred_sources": rollups.rollup_hints(layer, layer["schema"]["tables"])}
+
+@api.get("/semantic/join-path")
+def semantic_join_path(
+    from_table: str = Query(..., alias="from"),
+    to_table: str = Query(..., alias="to"),
+) -> Dict[str, Any]:
+    db_path = get_db_path()
+    if not Path(db_path).exists():
+        raise HTTPException(status_code=404, detail=f"No existe DB_PATH={db_path}")
+    semantic = get_semantic_layer(db_path)
+    tables = semantic["schema"]["tables"]
+    for t in (from_table, to_table):
+        if t not in tables:
+            raise HTTPException(status_code=404, detail=f"Tabla desconocida: {t}")
+    path = find_join_path(semantic, from_table, to_table)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Sin ruta de join entre {from_table} y {to_table}")
+    return path
+
+@api.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@api.exception_handler(QueryKilled)
+async def query_killed_handler(request: Request, exc: QueryKilled) -> JSONResponse:
+    return JSONResponse(
+        status_code=400,
+        content={"detail": f"Consulta bloqueada por el gobernador: {exc.reason}", "governor": governor_summary(exc.report)},
+        headers={"X-Governor": "killed"},
+    )
+
+@api.get("/query/governor")
+def query_governor_info() -> Dict[str, Any]:
+    return governor.info()
+
+@api.get("/db/pool")
+def db_pool_info() -> Dict[str, Any]:
+    writer = _obs_writers.get(get_db_path())
+    return {**pool_stats(get_db_path()), "obs_writer": writer.info() if writer else None}
+
+@api.get("/db/index-advice")
+def db_index_advice(
+    top: int = Query(10, ge=1, le=100),
+    limit: Optional[int] = Query(None, ge=1, description="máximo de consultas distintas del histórico"),
+    runs: int = Query(index_advisor.INDEX_ADVISOR_MAX_RUNS, ge=1, description="ejecuciones más recientes que se leen de llm_runs"),
+) -> Dict[str, Any]:
+    # Solo recomienda (índices hipotéticos sobre una copia del esquema en memoria); la BD no se modifica.
+    with db_read() as conn:
+        return index_advisor.advise(conn, index_advisor.load_workload(conn, limit, runs), top=top)
+
+@api.get("/metrics/daily")
+def metrics_daily(
+    date_from: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    date_to: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    experiment_variant_id: Optional[int] = None,
+    model_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Agregados diarios de runs: lee solo daily_run_aggregates (nunca llm_runs). `lag` = filas aún sin agregar."""
+    try:
+        with db_read() as conn:
+            rows = run_aggregates.read_daily(conn, date_from, date_to, experiment_variant_id, model_id)
+            return {"rows": rows, "watermarks": run_aggregates.watermarks(conn), "lag": run_aggregates.lag(conn)}
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=404, detail=f"Sin tablas de observabilidad: {e}")
+
+@api.get("/runs/{parent_run_uuid}")
+def run_trace(parent_run_uuid: str) -> Dict[str, Any]:
+    """Traza completa de una pregunta (text2sql, query, ...) con tiempos por etapa: búsqueda por índice, sin json_extract."""
+    ensure_trace_columns()
+    with db_read() as conn:
+        trace = run_traces.load_trace(conn, parent_run_uuid)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Sin runs para parent_run_uuid={parent_run_uuid}")
+    return trace
+
+@api.get("/semantic/cache")
+def semantic_cache() -> Dict[str, Any]:
+    return semantic_cache_stats()
 
 @api.post("/sql", response_model=SQLResponse)
 def run_sql(req: SQLRequest) -> SQLResponse:
     assert_sql_safe(req.sql)
     t0 = time.perf_counter()
-    conn = get_db_conn()
-    try:
-        cur = conn.cursor()
-        cur.execute(req.sql, req.params or {})
-        rows = [dict(r) for r in cur.fetchall()]
-    finally:
-        conn.close()
+    res = run_governed(req.sql, req.params)
+    rows = [dict(zip(res["columns"], r)) for r in res["rows"]]
     elapsed = time.perf_counter() - t0
-    return SQLResponse(sql=req.sql, params=req.params or {}, rows=rows, rowcount=len(rows), elapsed_seconds=elapsed)
+    return SQLResponse(sql=req.sql, params=req.params or {}, rows=rows, rowcount=len(rows), elapsed_seconds=elapsed,
+                       truncated=res["governor"].get("truncated", False))
 
-@api.post("/query", response_model=QueryResponse)
-def query(req: QueryRequest) -> QueryResponse:
-    q = (req.question or "").strip()
-    if not q:
-        raise HTTPException(status_code=400, detail="question required")
-    assert_sql_safe(req.sql)
+# -------------------------
+# Caché de resultados (compartida entre workers, invalidada por versión de tabla)
+# -------------------------
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1") != "0"
+RESULT_CACHE_MAX_BYTES = int(float(os.getenv("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "5000"))
 
-    t0 = time.perf_counter()
-    conn = get_db_conn()
+# Tablas que se escriben en cada petición (observabilidad) o por triggers (tablas resumen): sin versión,
+# las consultas que las leen no se cachean.
+RESULT_CACHE_UNVERSIONED = ("llm_runs", "quality_metrics", "hallucination_evaluations", "daily_run_aggregates",
+                            rollups.ROLLUP_TABLE)
+
+_result_caches: Dict[str, ResultCache] = {}
+
+def install_result_cache_triggers() -> Optional[List[str]]:
+    """
+    Triggers de versión para la caché de resultados. Solo al arrancar: es DDL (cambia la huella de esquema).
+    Tablas creadas después quedan sin versión (sus consultas no se cachean) hasta el siguiente arranque.
+    """
+    db_path = get_db_path()
+    if not RESULT_CACHE_ENABLED or not Path(db_path).exists():
+        return None
     try:
-        cur = conn.cursor()
-        cur.execute(req.sql, req.params or {})
-        rows = [dict(r) for r in cur.fetchall()]
-    finally:
-        conn.close()
-    elapsed = time.perf_counter() - t0
+        with write_connection(db_path) as conn:
+            return install_version_triggers(conn, exclude=RESULT_CACHE_UNVERSIONED)
+    except sqlite3.Error:
+        return None  # BD de solo lectura: ninguna tabla versionada, todo BYPASS
 
-    run_uuid = new_run_uuid()
+def get_result_cache() -> Optional[ResultCache]:
+    if not RESULT_CACHE_ENABLED:
+        return None
+    db_path = get_db_path()
+    path = os.getenv("RESULT_CACHE_PATH") or f"{db_path}.result-cache.sqlite"
+    cache = _result_caches.get(path)
+    if cache is None:
+        cache = _result_caches[path] = ResultCache(path, max_bytes=RESULT_CACHE_MAX_BYTES, max_rows=RESULT_CACHE_MAX_ROWS)
+    return cache
+
+def current_table_versions(tables) -> Dict[str, Optional[int]]:
+    with db_read() as conn:
+        return read_versions(conn, tables)
+
+def fetch_table_cached(sql: str, params: Optional[Dict[str, Any]]) -> Tuple[List[str], List[Tuple[Any, ...]], str, Dict[str, Any]]:
+    """(columnas, filas, X-Cache, informe del gobernador) con X-Cache = HIT | MISS | BYPASS."""
+    cache = get_result_cache()
+    if cache is None:
+        res = run_governed(sql, params)
+        CACHE_REQUESTS.inc(cache="result", result="bypass")
+        return res["columns"], res["rows"], "BYPASS", res["governor"]
+    key = result_key(sql, params or {}, schema_fingerprint(get_db_path()))
+    hit = cache.get(key, current_table_versions)
+    if hit is not None:
+        CACHE_REQUESTS.inc(cache="result", result="hit")
+        return hit["columns"], hit["rows"], "HIT", {"outcome": "allowed", "cached": True}
+    res = run_governed(sql, params, track=True)
+    # Un resultado truncado por el gobernador no se cachea.
+    stored = not res["governor"].get("truncated") and cache.put(key, sql, res["columns"], res["rows"], res["versions"])
+    CACHE_REQUESTS.inc(cache="result", result="miss" if stored else "bypass")
+    return res["columns"], res["rows"], "MISS" if stored else "BYPASS", res["governor"]
+
+@api.get("/query/cache")
+def query_cache_info() -> Dict[str, Any]:
+    cache = get_result_cache()
+    return cache.info() if cache else {"enabled": False}
+
+# -------------------------
+# Tablas resumen (rollups.py): mantenidas por triggers, fuentes preferidas para agregados en text2sql
+# -------------------------
+ROLLUPS_ENABLED = os.getenv("ROLLUPS", "1") != "0"
 
-    # Insert run de ejecución SQL (NO es invocación LLM, pero se registra en el mismo modelo)
+def ensure_rollups() -> Optional[Dict[str, Any]]:
+    """
+    Instala tabla resumen + triggers (idempotente; sin efecto en BD de solo lectura). Solo al arrancar:
+    es DDL, puede recargar la tabla entera y cambia la huella de esquema. Los endpoints solo leen.
+    """
+    db_path = get_db_path()
+    if not ROLLUPS_ENABLED or not Path(db_path).exists():
+        return None
+    try:
+        with write_connection(db_path) as conn:
+            res = rollups.install(conn)
+            conn.commit()
+            return res
+    except sqlite3.Error:
+        return None
+
+@api.get("/db/rollups")
+def db_rollups(verify: bool = Query(False, description="compara con el agregado completo (recorre las facturas)")) -> Dict[str, Any]:
+    with db_read() as conn:
+        info = rollups.info(conn)
+        if info is None:
+            return {"enabled": ROLLUPS_ENABLED, "installed": False}
+        out = {"enabled": ROLLUPS_ENABLED, "installed": True, **info}
+        if verify:
+            out["verify"] = rollups.verify(conn)
+    return out
+
+# -------------------------
+# Cursores (paginación de /query)
+# -------------------------
+CURSOR_TTL_SECONDS = float(os.getenv("CURSOR_TTL_SECONDS", "300"))
+CURSOR_MAX_ROWS = int(os.getenv("CURSOR_MAX_ROWS", "100000"))
+
+_cursor_stores: Dict[str, CursorStore] = {}
+
+def get_cursor_store() -> CursorStore:
+    path = os.getenv("CURSOR_STORE_PATH") or f"{get_db_path()}.cursors.sqlite"
+    store = _cursor_stores.get(path)
+    if store is None:
+        store = _cursor_stores.setdefault(path, CursorStore(path, ttl_seconds=CURSOR_TTL_SECONDS, max_rows=CURSOR_MAX_ROWS))
+    return store
+
+def _keyset_page(cursor_key: str, columns: List[str], rows: List[Tuple[Any, ...]], size: int) -> Tuple[List[Tuple[Any, ...]], Optional[Any]]:
+    """(filas de la página, último valor de la clave si hay más páginas)."""
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, rows[-1][columns.index(cursor_key)]
+
+def open_query_cursor(req: QueryRequest, question: str, sql: str, params: Dict[str, Any]) -> Tuple[List[str], List[Tuple[Any, ...]], str, Dict[str, Any], Dict[str, Any]]:
+    """
+    Primera página de un resultado paginado: keyset si la capa semántica da una clave única segura;
+    si no (joins, agregados, `limit` de acceso...), el resultado se materializa en el CursorStore.
+    -> (columnas, filas, X-Cache, informe del gobernador, página).
+    """
+    store = get_cursor_store()
+    size = req.page_size
+    key = None
+    if req.limit is None:
+        with db_read() as conn:
+            key = detect_keyset_key(conn, req.sql, req.params or {}, get_semantic_layer(get_db_path()))
+    if key is not None:
+        ksql = keyset_sql(sql, key[0], key[1], after=False)
+        kparams = {**params, "_cursor_limit": size + 1}
+        columns, rows, x_cache, gov = fetch_table_cached(ksql, kparams)
+        rows, last = _keyset_page(key[0], columns, rows, size)
+        # La huella se toma después de ejecutar: la caché de resultados puede instalar sus triggers en la 1ª consulta.
+        fingerprint = schema_fingerprint(get_db_path())
+        page = {"mode": "keyset", "key": key[0], "page_size": size, "next_cursor": None,
+                "executed_sql": ksql, "executed_params": kparams}
+        if last is not None:
+            cursor = store.open("keyset", question, req.sql, sql, params, size, columns, fingerprint,
+                                key=key[0], descending=key[1])
+            page["next_cursor"] = store.token(cursor, {"after": last})
+        return columns, rows, x_cache, gov, page
+
+    columns, rows, x_cache, gov = fetch_table_cached(sql, params)
+    fingerprint = schema_fingerprint(get_db_path())
+    page = {"mode": "materialized", "page_size": size, "next_cursor": None, "total_rows": len(rows)}
+    if len(rows) > store.max_rows:
+        rows = rows[:store.max_rows]
+        page.update(total_rows=len(rows), truncated=True)
+    if len(rows) > size:
+        cursor = store.open("materialized", question, req.sql, sql, params, size, columns, fingerprint, rows=rows)
+        page["next_cursor"] = store.token(cursor, {"offset": size})
+    return columns, rows[:size], x_cache, gov, page
+
+def _page_log(page: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos de paginación para context_json (el SQL ejecutado va aparte, para el asesor de índices)."""
+    out: Dict[str, Any] = {}
+    if page:
+        out["cursor"] = {k: v for k, v in page.items() if k not in ("executed_sql", "executed_params", "next_cursor")}
+        out["cursor"]["has_more"] = page.get("next_cursor") is not None
+    if "executed_sql" in page:
+        out.update(executed_sql=page["executed_sql"], executed_params=page["executed_params"])
+    return out
+
+def _log_query_run(run_uuid: str, endpoint: str, parent_run_uuid: Optional[str], question: str, sql: str,
+                   params: Dict[str, Any], elapsed: float, rowcount: int, format: str, x_cache: str,
+                   gov: Dict[str, Any], extra: Dict[str, Any]) -> None:
+    # Insert run de ejecución SQL (NO es invocación LLM, pero se registra en el mismo modelo).
+    # También en los aciertos de caché, para que las métricas reflejen todo el tráfico.
     insert_llm_run(
         run_uuid=run_uuid,
-        question=q,
-        answer=f"OK: {len(rows)} filas",
+        question=question,
+        answer=f"OK: {rowcount} filas",
         elapsed_seconds=elapsed,
         context_json={
             "stage": "query_exec",
-            "endpoint": "/query",
-            "parent_run_uuid": req.parent_run_uuid,
-            "sql": req.sql,
-            "params": req.params,
-            "rowcount": len(rows),
+            "endpoint": endpoint,
+            "parent_run_uuid": parent_run_uuid,
+            "sql": sql,
+            "params": params,
+            **extra,
+            "rowcount": rowcount,
+            "format": format,
+            "result_cache": x_cache.lower(),
+            "governor": governor_summary(gov),
         },
     )
     add_quality_metric(run_uuid, "sql_valid", 1)
-    add_quality_metric(run_uuid, "rows_returned", len(rows))
+    add_quality_metric(run_uuid, "rows_returned", rowcount)
     add_quality_metric(run_uuid, "latency_seconds", elapsed)
+    add_quality_metric(run_uuid, "result_cache_hit", 1 if x_cache == "HIT" else 0)
+    add_quality_metric(run_uuid, "governor", OUTCOME_VALUES[gov["outcome"]], governor_summary(gov))
 
-    return QueryResponse(
+def _log_killed_run(run_uuid: str, endpoint: str, parent_run_uuid: Optional[str], question: str, sql: str,
+                    params: Dict[str, Any], elapsed: float, e: QueryKilled, extra: Dict[str, Any]) -> None:
+    insert_llm_run(
         run_uuid=run_uuid,
-        parent_run_uuid=req.parent_run_uuid,
-        question=q,
-        sql=req.sql,
-        params=req.params or {},
-        rows=rows,
-        rowcount=len(rows),
+        question=question,
+        answer=f"KILLED: {e.reason}",
         elapsed_seconds=elapsed,
+        context_json={
+            "stage": "query_exec",
+            "endpoint": endpoint,
+            "parent_run_uuid": parent_run_uuid,
+            "sql": sql,
+            "params": params,
+            **extra,
+            "governor": governor_summary(e.report),
+        },
     )
+    add_quality_metric(run_uuid, "governor", OUTCOME_VALUES["killed"], governor_summary(e.report))
+    add_quality_metric(run_uuid, "latency_seconds", elapsed)
+
+# Tipos declarados para format=columnar (columnar.declared_types): la vista temporal no se puede crear en las
+# conexiones query_only del pool, así que se usa una conexión en memoria con la BD adjunta en solo lectura.
+COLUMNAR_TYPES_CACHE_SIZE = int(os.getenv("COLUMNAR_TYPES_CACHE_SIZE", "256"))
+_types_conns: Dict[str, sqlite3.Connection] = {}
+_types_cache: "OrderedDict[Tuple[str, str], List[Optional[str]]]" = OrderedDict()
+_types_lock = threading.Lock()
+
+def declared_column_types(sql: str) -> List[Optional[str]]:
+    """Tipo declarado por columna del resultado de sql (None en expresiones), memorizado por SQL + huella de esquema."""
+    db_path = get_db_path()
+    key = (schema_fingerprint(db_path), sql)
+    with _types_lock:
+        types = _types_cache.get(key)
+        if types is not None:
+            _types_cache.move_to_end(key)
+            return types
+        conn = _types_conns.get(db_path)
+        if conn is None:
+            conn = sqlite3.connect("file::memory:", uri=True, check_same_thread=False)
+            conn.execute("ATTACH DATABASE ? AS db", (f"file:{quote(db_path)}?mode=ro",))
+            _types_conns[db_path] = conn
+        types = _types_cache[key] = columnar.declared_types(conn, sql)
+        while len(_types_cache) > COLUMNAR_TYPES_CACHE_SIZE:
+            _types_cache.popitem(last=False)
+        return types
+
+def close_types_connections() -> None:
+    with _types_lock:
+        for conn in _types_conns.values():
+            conn.close()
+        _types_conns.clear()
+        _types_cache.clear()
+
+def _render_query(response: Response, format: str, orient: str, headers: Dict[str, str], body: Dict[str, Any],
+                  columns: List[str], table: List[Tuple[Any, ...]], sql: str):
+    # serialize: en format=rows mide la construcción del modelo; el volcado a JSON lo hace FastAPI después.
+    with STAGE_SECONDS.time(stage="serialize"):
+        if format == "columnar":
+            # Sin validación Pydantic por fila: se serializa directamente (orjson si está disponible).
+            declared = declared_column_types(sql)
+            payload = {**body, "format": "columnar", **columnar.to_columnar(columns, table, orient, declared)}
+            return Response(content=columnar.dumps(payload), media_type="application/json", headers=headers)
+        response.headers.update(headers)
+        return QueryResponse(**body, rows=[dict(zip(columns, r)) for r in table])
+
+@api.post("/query", response_model=QueryResponse)
+def query(
+    req: QueryRequest,
+    response: Response,
+    format: str = Query("rows", pattern="^(rows|columnar)$"),
+    orient: str = Query("columns", pattern="^(columns|rows)$"),
+):
+    """
+    format=columnar: nombres de columna una vez + arrays por columna (orient=columns) o matriz (orient=rows).
+    page_size: devuelve la primera página y `next_cursor` para pedir las siguientes en /query/next.
+    """
+    q = (req.question or "").strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="question required")
+    assert_sql_safe(req.sql)
+
+    t0 = time.perf_counter()
+    run_uuid = new_run_uuid()
+    scoped: Dict[str, Any] = {}
+    page: Dict[str, Any] = {}
+    try:
+        sql, params, access = scope_query(req)
+        scoped = {"executed_sql": sql, "executed_params": params, "access": access} if sql != req.sql else {}
+        if req.page_size:
+            columns, table, x_cache, gov, page = open_query_cursor(req, q, sql, params)
+        else:
+            columns, table, x_cache, gov = fetch_table_cached(sql, params)
+    except QueryKilled as e:
+        _log_killed_run(run_uuid, "/query", req.parent_run_uuid, q, req.sql, req.params,
+                        time.perf_counter() - t0, e, scoped)
+        raise
+    rowcount = len(table)
+    elapsed = time.perf_counter() - t0
+    _log_query_run(run_uuid, "/query", req.parent_run_uuid, q, req.sql, req.params, elapsed, rowcount, format,
+                   x_cache, gov, {**scoped, **_page_log(page)})
+
+    body = {
+        "run_uuid": run_uuid,
+        "parent_run_uuid": req.parent_run_uuid,
+        "question": q,
+        "sql": req.sql,
+        "params": req.params or {},
+        "rowcount": rowcount,
+        "elapsed_seconds": elapsed,
+        "truncated": bool(gov.get("truncated") or page.get("truncated")),
+        "access_filter_applied": access["applied"],
+        "access_note": access["note"],
+        "next_cursor": page.get("next_cursor"),
+        "cursor_mode": page.get("mode"),
+    }
+    headers = {"X-Cache": x_cache, "X-Governor": gov["outcome"]}
+    return _render_query(response, format, orient, headers, body, columns, table, sql)
+
+@api.post("/query/next", response_model=QueryResponse)
+def query_next(
+    req: QueryNextRequest,
+    response: Response,
+    format: str = Query("rows", pattern="^(rows|columnar)$"),
+    orient: str = Query("columns", pattern="^(columns|rows)$"),
+):
+    """Siguiente página de un cursor de /query. 410 si caducó (CURSOR_TTL_SECONDS) o cambió el esquema."""
+    store = get_cursor_store()
+    try:
+        cursor, position = store.resolve(req.cursor)
+    except CursorError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    if cursor["fingerprint"] != schema_fingerprint(get_db_path()):
+        raise HTTPException(status_code=410, detail="El esquema cambió: vuelve a lanzar la consulta")
+
+    t0 = time.perf_counter()
+    run_uuid = new_run_uuid()
+    size = cursor["page_size"]
+    page: Dict[str, Any] = {"mode": cursor["mode"], "page_size": size, "next_cursor": None}
+    if cursor["mode"] == "keyset":
+        key = cursor["key_column"]
+        ksql = keyset_sql(cursor["exec_sql"], key, cursor["descending"], after=True)
+        kparams = {**cursor["params"], "_cursor_after": position.get("after"), "_cursor_limit": size + 1}
+        columns, table, x_cache, gov = fetch_table_cached(ksql, kparams)
+        table, last = _keyset_page(key, columns, table, size)
+        page.update(key=key, executed_sql=ksql, executed_params=kparams)
+        if last is not None:
+            page["next_cursor"] = store.token(cursor, {"after": last})
+    else:
+        offset = int(position.get("offset", 0))
+        columns, x_cache, gov = cursor["columns"], "BYPASS", {"outcome": "allowed"}
+        table = store.rows(cursor["cursor_id"], offset, size + 1)
+        page.update(offset=offset, total_rows=cursor["total_rows"])
+        if len(table) > size:
+            table = table[:size]
+            page["next_cursor"] = store.token(cursor, {"offset": offset + size})
+    rowcount = len(table)
+    elapsed = time.perf_counter() - t0
+    # Se registran los params del SQL generado, sin los del filtro de acceso.
+    params = {k: v for k, v in cursor["params"].items() if not k.startswith(access_filter.PARAM_PREFIX)}
+    _log_query_run(run_uuid, "/query/next", req.parent_run_uuid, cursor["question"], cursor["sql"], params, elapsed,
+                   rowcount, format, x_cache, gov, _page_log(page))
+
+    body = {
+        "run_uuid": run_uuid,
+        "parent_run_uuid": req.parent_run_uuid,
+        "question": cursor["question"],
+        "sql": cursor["sql"],
+        "params": params,
+        "rowcount": rowcount,
+        "elapsed_seconds": elapsed,
+        "truncated": bool(gov.get("truncated")),
+        "next_cursor": page["next_cursor"],
+        "cursor_mode": cursor["mode"],
+    }
+    headers = {"X-Cache": x_cache, "X-Governor": gov["outcome"]}
+    return _render_query(response, format, orient, headers, body, columns, table, cursor["exec_sql"])
+
+# -------------------------
+# Lotes de consultas (/query/batch)
+# -------------------------
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", str(DB_READ_POOL_SIZE)))
+
+def _run_batch_item(item: QueryBatchItem) -> Dict[str, Any]:
+    """
+    Una sentencia del lote, en su propia conexión del pool de lectura: guardrails, filtro de acceso,
+    caché de resultados y gobernador como en /query. Los errores se devuelven en el resultado, no se lanzan.
+    """
+    t0 = time.perf_counter()
+    out: Dict[str, Any] = {"question": (item.question or "").strip(), "run_uuid": None}
+    try:
+        if not out["question"]:
+            raise HTTPException(status_code=400, detail="question required")
+        check_sql(item.sql)
+        sql, params, access = scope_query(item)
+        out["access"], out["sql"] = access, sql
+        out["scoped"] = {"executed_sql": sql, "executed_params": params, "access": access} if sql != item.sql else {}
+        out["columns"], out["table"], out["cache"], out["governor"] = fetch_table_cached(sql, params)
+        out["status"] = 200
+    except HTTPException as e:
+        out.update(status=e.status_code, error=e.detail)
+    except SQLRejected as e:
+        out.update(status=400, error=e.detail)
+    except QueryKilled as e:
+        out.update(status=400, error=f"Consulta bloqueada por el gobernador: {e.reason}", killed=e)
+    except PoolTimeout as e:
+        out.update(status=503, error=str(e))
+    except sqlite3.Error as e:
+        out.update(status=400, error=f"SQL inválido: {e}")
+    out["elapsed"] = time.perf_counter() - t0
+    return out
+
+def _log_batch(parent_run_uuid: Optional[str], batch_uuid: str, items: List["QueryBatchItem"],
+               outs: List[Dict[str, Any]], format: str) -> None:
+    """Runs del lote en una sola transacción de observabilidad; asigna out['run_uuid']."""
+    with get_obs_writer().group():
+        for i, (item, out) in enumerate(zip(items, outs)):
+            extra = {"batch": {"batch_uuid": batch_uuid, "index": i, "size": len(items)}, **out.get("scoped", {})}
+            if out["status"] == 200:
+                out["run_uuid"] = new_run_uuid()
+                _log_query_run(out["run_uuid"], "/query/batch", parent_run_uuid, out["question"], item.sql,
+                               item.params, out["elapsed"], len(out["table"]), format, out["cache"], out["governor"], extra)
+            elif "killed" in out:
+                out["run_uuid"] = new_run_uuid()
+                _log_killed_run(out["run_uuid"], "/query/batch", parent_run_uuid, out["question"], item.sql,
+                                item.params, out["elapsed"], out["killed"], extra)
+
+@api.post("/query/batch", response_model=QueryBatchResponse)
+async def query_batch(
+    req: QueryBatchRequest,
+    format: str = Query("rows", pattern="^(rows|columnar)$"),
+    orient: str = Query("columns", pattern="^(columns|rows)$"),
+):
+    """
+    Varias SELECT independientes en una sola petición: se ejecutan a la vez (hasta QUERY_BATCH_CONCURRENCY),
+    cada una con su conexión de solo lectura (WAL admite lectores en paralelo), así que el lote tarda
+    lo que la más lenta y no la suma. Un fallo en una sentencia no tumba el resto: cada resultado lleva su status.
+    Los runs del lote se escriben en una sola transacción de observabilidad.
+    """
+    t0 = time.perf_counter()
+    items = [it if it.allowed_countries is not None or req.allowed_countries is None
+             else it.model_copy(update={"allowed_countries": req.allowed_countries}) for it in req.items]
+    sem = asyncio.Semaphore(max(1, QUERY_BATCH_CONCURRENCY))
+
+    async def run(item: QueryBatchItem) -> Dict[str, Any]:
+        async with sem:
+            return await run_in_threadpool(_run_batch_item, item)
+
+    outs = await asyncio.gather(*(run(it) for it in items))
+    elapsed = time.perf_counter() - t0
+
+    batch_uuid = new_run_uuid()
+    # En el threadpool: encolar el grupo puede esperar por contrapresión del escritor.
+    await run_in_threadpool(_log_batch, req.parent_run_uuid, batch_uuid, items, outs, format)
+
+    results: List[Dict[str, Any]] = []
+    for i, out in enumerate(outs):
+        res: Dict[str, Any] = {"index": i, "ok": out["status"] == 200, "status": out["status"], "run_uuid": out["run_uuid"],
+                               "question": out["question"], "elapsed_seconds": out["elapsed"]}
+        if "killed" in out:
+            res["governor"] = governor_summary(out["killed"].report)
+        if res["ok"]:
+            gov, access = out["governor"], out["access"]
+            res.update(rowcount=len(out["table"]), truncated=bool(gov.get("truncated")), cache=out["cache"],
+                       governor=governor_summary(gov), access_filter_applied=access["applied"], access_note=access["note"])
+            if format == "columnar":
+                res.update(columnar.to_columnar(out["columns"], out["table"], orient, declared_column_types(out["sql"])))
+            else:
+                res["rows"] = [dict(zip(out["columns"], r)) for r in out["table"]]
+        else:
+            res["error"] = out["error"]
+        results.append(res)
+    body = {
+        "batch_uuid": batch_uuid,
+        "parent_run_uuid": req.parent_run_uuid,
+        "elapsed_seconds": elapsed,
+        "slowest_seconds": max(o["elapsed"] for o in outs),
+        "sum_seconds": sum(o["elapsed"] for o in outs),
+    }
+    if format == "columnar":
+        payload = {**body, "format": "columnar", "results": results}
+        return Response(content=columnar.dumps(payload), media_type="application/json")
+    return QueryBatchResponse(**body, results=[QueryBatchResult(**r) for r in results])
+
+@api.get("/query/cursors")
+def query_cursors_info() -> Dict[str, Any]:
+    return get_cursor_store().info()
+
+# -------------------------
+# Streaming (NDJSON / CSV)
+# -------------------------
+STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", "1000"))
+_STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+def _encode_page(rows: List[Any], columns: List[str], fmt: str) -> str:
+    if fmt == "csv":
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue()
+    return "".join(json.dumps(dict(zip(columns, r)), ensure_ascii=False, default=str) + "\n" for r in rows)
+
+def _exit_guard(guard: Any, exc: Optional[BaseException]) -> Optional[BaseException]:
+    """Cierra un guard del gobernador abierto a mano. -> excepción a propagar (QueryKilled si agotó el presupuesto)."""
+    try:
+        guard.__exit__(type(exc) if exc else None, exc, exc.__traceback__ if exc else None)
+    except BaseException as e:
+        return e
+    return exc
+
+def _timed_fetch(clock: "qg.ExecClock", fn: Any, *args: Any) -> Any:
+    with clock.running():
+        return fn(*args)
+
+@api.post("/query/stream")
+async def query_stream(req: QueryStreamRequest, request: Request) -> StreamingResponse:
+    """
+    Como /query pero sin materializar el resultado: páginas de STREAM_FETCH_SIZE filas con fetchmany.
+    Si el cliente se desconecta se interrumpe la consulta SQLite; el run se registra al terminar el stream.
+    Pasa por el gobernador (plan, carril pesado, presupuesto) sin tope de filas. El presupuesto solo corre
+    dentro de SQLite: un cliente lento no lo agota, pero una consulta desbocada sí, aunque el cliente siga leyendo.
+    Todo lo que puede esperar (guardrails con el pool de lectura, contrapresión del escritor) va al threadpool:
+    si los streams llenan el pool, el bucle de eventos sigue libre para los que lo van a devolver.
+    """
+    q = (req.question or "").strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="question required")
+    await run_in_threadpool(assert_sql_safe, req.sql)
+
+    t0 = time.perf_counter()
+    run_uuid = new_run_uuid()
+    try:
+        sql, params, access = await run_in_threadpool(scope_query, req)
+    except QueryKilled as e:
+        await run_in_threadpool(_log_killed_run, run_uuid, "/query/stream", req.parent_run_uuid, q, req.sql, req.params,
+                                time.perf_counter() - t0, e, {})
+        raise
+    scoped = {"executed_sql": sql, "executed_params": params, "access": access} if sql != req.sql else {}
+    lease = db_read()
+    conn = await run_in_threadpool(lease.__enter__)
+    clock = qg.ExecClock()
+    guard = governor.guard(conn, sql, params, get_db_path(), clock=clock)
+    try:
+        report = await run_in_threadpool(guard.__enter__)
+        try:
+            # Se ejecuta antes de responder para que un SQL inválido devuelva error HTTP y no un stream roto.
+            cur = await run_in_threadpool(_timed_fetch, clock, conn.execute, sql, params)
+        except BaseException as e:
+            raise _exit_guard(guard, e)
+    except QueryKilled as e:
+        lease.__exit__(None, None, None)
+        GUARDRAIL_REJECTIONS.inc(reason=f"governor_{e.reason}")
+        await run_in_threadpool(_log_killed_run, run_uuid, "/query/stream", req.parent_run_uuid, q, req.sql, req.params,
+                                time.perf_counter() - t0, e, scoped)
+        raise
+    except BaseException:
+        lease.__exit__(None, None, None)
+        raise
+    columns = [d[0] for d in cur.description or []]
+
+    async def body():
+        rowcount = 0
+        status = "completed"
+        first_byte: Optional[float] = None
+        pending: Optional[asyncio.Future] = None
+        guard_open = True
+        gov = report
+        try:
+            if req.format == "csv":
+                yield _encode_page([columns], columns, "csv")
+            while True:
+                if await request.is_disconnected():
+                    status = "client_disconnected"
+                    break
+                pending = asyncio.ensure_future(run_in_threadpool(_timed_fetch, clock, cur.fetchmany, STREAM_FETCH_SIZE))
+                page = await asyncio.shield(pending)
+                pending = None
+                if not page:
+                    break
+                rowcount += len(page)
+                if first_byte is None:
+                    first_byte = time.perf_counter() - t0
+                yield _encode_page(page, columns, req.format)
+        except (asyncio.CancelledError, GeneratorExit):
+            status = "client_disconnected"
+            raise
+        except Exception as e:
+            guard_open = False
+            error = _exit_guard(guard, e)
+            if isinstance(error, QueryKilled):
+                status, gov = "killed", error.report
+                GUARDRAIL_REJECTIONS.inc(reason=f"governor_{error.reason}")
+            else:
+                status = "error"
+            raise error
+        finally:
+            def release(*_):
+                if guard_open:
+                    _exit_guard(guard, None)
+                lease.__exit__(None, None, None)
+
+            if pending is not None and not pending.done():
+                # fetchmany sigue en un hilo: se interrumpe y la conexión vuelve al pool cuando termine.
+                conn.interrupt()
+                pending.add_done_callback(lambda f: (f.cancelled() or f.exception(), release()))
+            else:
+                release()
+            if status != "killed":
+                governor.finish([], gov)  # sin tope de filas: solo cuenta el resultado
+            elapsed = time.perf_counter() - t0
+
+            def log_run() -> None:
+                insert_llm_run(
+                    run_uuid=run_uuid,
+                    question=q,
+                    answer=f"{'OK' if status == 'completed' else status.upper()}: {rowcount} filas",
+                    elapsed_seconds=elapsed,
+                    context_json={
+                        "stage": "query_exec",
+                        "endpoint": "/query/stream",
+                        "parent_run_uuid": req.parent_run_uuid,
+                        "sql": req.sql,
+                        "params": req.params,
+                        **scoped,
+                        "rowcount": rowcount,
+                        "format": req.format,
+                        "status": status,
+                        "first_page_seconds": first_byte,
+                        "governor": governor_summary(gov),
+                    },
+                )
+                add_quality_metric(run_uuid, "sql_valid", 1)
+                add_quality_metric(run_uuid, "rows_returned", rowcount)
+                add_quality_metric(run_uuid, "latency_seconds", elapsed)
+                add_quality_metric(run_uuid, "governor", OUTCOME_VALUES[gov["outcome"]], governor_summary(gov))
+                if status != "completed":
+                    add_quality_metric(run_uuid, "stream_aborted", 1, {"status": status})
+
+            # shield: si el stream se está cancelando (desconexión) el registro termina igualmente.
+            await asyncio.shield(asyncio.ensure_future(run_in_threadpool(log_run)))
+
+    headers = {"X-Run-UUID": run_uuid, "X-Access-Filter": access["note"], "X-Governor": report["outcome"]}
+    if req.format == "csv":
+        headers["Content-Disposition"] = 'attachment; filename="query.csv"'
+    return StreamingResponse(body(), media_type=_STREAM_MEDIA_TYPES[req.format], headers=headers)
 
 SQL_SYSTEM = """Eres un asistente de analítica de datos que genera SQL SOLO de lectura para SQLite.
 
@@ -294,39 +1152,203 @@ REGLAS OBLIGATORIAS:
 - sql debe ser una consulta SELECT (o WITH + SELECT). Prohibido: INSERT, UPDATE, DELETE, DROP, ALTER, CREATE, PRAGMA.
 - params debe ser un objeto JSON (puede ser {}).
 - notes debe ser una frase breve.
+- Si SEMANTIC_MODEL incluye join_paths, úsalos tal cual para unir esas tablas.
+- Si SEMANTIC_MODEL incluye preferred_sources, úsalas para totales y agregados (por día, mes, país, categoría o moneda)
+  en lugar de agregar las tablas que indica `replaces`; usa las de detalle solo si faltan columnas en el resumen.
 
 FORMATO DE SALIDA (ejemplo):
 {"sql":"SELECT 1","params":{},"notes":"ok"}
 """
 
 
-def safe_json(obj, max_chars=6000):
-    s = json.dumps(obj, ensure_ascii=False)
-    return s[:max_chars] + ("…" if len(s) > max_chars else "")
+TEXT2SQL_TOP_K = int(os.getenv("TEXT2SQL_TOP_K", "5"))
+TEXT2SQL_MAX_TABLES = int(os.getenv("TEXT2SQL_MAX_TABLES", "12"))
+TEXT2SQL_CACHE_ENABLED = os.getenv("TEXT2SQL_CACHE", "1") != "0"
+TEXT2SQL_TEMPLATES_ENABLED = os.getenv("TEXT2SQL_TEMPLATES", "1") != "0"
 
-@api.post("/text2sql", response_model=Text2SQLResp)
-def text2sql(req: Text2SQLReq) -> Text2SQLResp:
-    t0 = time.perf_counter()
+_text2sql_caches: Dict[str, Text2SQLCache] = {}
+_template_stores: Dict[str, TemplateStore] = {}
 
-    semantic = build_semantic_layer(get_db_path())
-    semantic_context = {
-        "summary": semantic.get("summary", ""),
-        "tables": semantic.get("schema", {}).get("tables", []),
+def _text2sql_store_path() -> str:
+    return os.getenv("TEXT2SQL_CACHE_PATH") or f"{get_db_path()}.text2sql-cache.sqlite"
+
+def get_template_store() -> Optional[TemplateStore]:
+    if not TEXT2SQL_TEMPLATES_ENABLED:
+        return None
+    path = _text2sql_store_path()
+    store = _template_stores.get(path)
+    if store is None:
+        store = _template_stores[path] = TemplateStore(path)
+    return store
+
+def get_text2sql_cache() -> Optional[Text2SQLCache]:
+    if not TEXT2SQL_CACHE_ENABLED:
+        return None
+    path = _text2sql_store_path()
+    cache = _text2sql_caches.get(path)
+    if cache is None:
+        cache = _text2sql_caches[path] = Text2SQLCache(path, max_entries=int(os.getenv("TEXT2SQL_CACHE_MAX_ENTRIES", "1024")))
+    return cache
+
+def get_llm_model() -> str:
+    return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+_llm_flights = SingleFlight()
+
+# Hedging: plazo = percentil de la latencia reciente del LLM (valor fijo hasta tener muestras suficientes).
+TEXT2SQL_HEDGE_ENABLED = os.getenv("TEXT2SQL_HEDGE", "1") != "0"
+TEXT2SQL_HEDGE_PERCENTILE = float(os.getenv("TEXT2SQL_HEDGE_PERCENTILE", "0.95"))
+TEXT2SQL_HEDGE_MIN_SAMPLES = int(os.getenv("TEXT2SQL_HEDGE_MIN_SAMPLES", "20"))
+TEXT2SQL_HEDGE_DEFAULT_SECONDS = float(os.getenv("TEXT2SQL_HEDGE_DEFAULT_SECONDS", "8"))
+
+_llm_latency = LatencyWindow(maxlen=int(os.getenv("TEXT2SQL_HEDGE_WINDOW", "200")))
+
+def hedge_deadline() -> Optional[float]:
+    if not TEXT2SQL_HEDGE_ENABLED:
+        return None
+    if len(_llm_latency) < TEXT2SQL_HEDGE_MIN_SAMPLES:
+        return TEXT2SQL_HEDGE_DEFAULT_SECONDS
+    return _llm_latency.percentile(TEXT2SQL_HEDGE_PERCENTILE)
+
+@api.get("/text2sql/cache")
+def text2sql_cache_info() -> Dict[str, Any]:
+    cache = get_text2sql_cache()
+    store = get_template_store()
+    return {
+        "cache": cache.info() if cache else {"enabled": False},
+        "templates": store.info() if store else {"enabled": False},
+        "inflight": _llm_flights.info(),
+        "hedging": {"enabled": TEXT2SQL_HEDGE_ENABLED, "deadline_seconds": hedge_deadline(), "samples": len(_llm_latency)},
     }
 
+def _serve_cached_sql(req: Text2SQLReq, model: str, semantic: Dict[str, Any], t0: float) -> Optional[Text2SQLResp]:
+    # 1) Caché pregunta normalizada + modelo + huella de esquema; 2) plantilla parametrizada.
+    # En ambos casos no hay llamada al LLM.
+    cache = get_text2sql_cache()
+    templates = get_template_store()
+    cached = cache.get(req.question, model, semantic["fingerprint"]) if cache else None
+    source = {"cache": "hit", "cache_level": cached["level"]} if cached else None
+    if cached is None and templates is not None:
+        cached = templates.match(req.question, semantic["fingerprint"])
+        if cached is not None:
+            source = {"cache": "template", "template_id": cached["template_id"], "similarity": cached["similarity"]}
+    if cache is not None:
+        CACHE_REQUESTS.inc(cache="text2sql", result=source["cache"] if source else "miss")
+    if cached is None:
+        return None
+
+    elapsed = time.perf_counter() - t0
+    run_uuid = new_run_uuid()
+    insert_llm_run(
+        run_uuid=run_uuid,
+        question=req.question,
+        answer=cached["sql"],
+        elapsed_seconds=elapsed,
+        context_json={
+            "stage": "text2sql",
+            "endpoint": "/text2sql",
+            "parent_run_uuid": req.parent_run_uuid,
+            "notes": cached["notes"],
+            "params": cached["params"],
+            "model": model,
+            **source,
+        },
+    )
+    add_quality_metric(run_uuid, "sql_valid", 1)
+    if source["cache"] == "hit":
+        add_quality_metric(run_uuid, "cache_hit", 1, {"level": cached["level"]})
+    else:
+        add_quality_metric(run_uuid, "template_hit", 1, {"template_id": cached["template_id"], "similarity": cached["similarity"]})
+        if cache:
+            cache.put(req.question, model, semantic["fingerprint"], cached["sql"], cached["params"], cached["notes"])
+    add_quality_metric(run_uuid, "latency_seconds", elapsed)
+    return Text2SQLResp(
+        run_uuid=run_uuid,
+        parent_run_uuid=req.parent_run_uuid,
+        sql=cached["sql"],
+        params=cached["params"],
+        notes=cached["notes"],
+        elapsed_seconds=elapsed,
+    )
+
+async def _complete_sql(question: str, semantic_context: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """
+    Llamada al LLM + intento "ULTIMO AVISO". Con hedging el segundo arranca al vencer el percentil de latencia
+    (o si el primero no devuelve JSON) y gana el primer JSON válido. No escribe nada: el registro lo hace cada petición.
+    """
     messages = [
         {"role": "system", "content": SQL_SYSTEM},
-        {"role": "user", "content": f"SEMANTIC_MODEL:\n{safe_json(semantic_context)}\n\nQUESTION:\n{req.question}"},
+        {"role": "user", "content": f"SEMANTIC_MODEL:\n{jdump(semantic_context)}\n\nQUESTION:\n{question}"},
+    ]
+    messages_retry = [
+        {
+            "role": "system",
+            "content": SQL_SYSTEM
+            + "\nULTIMO AVISO: Responde SOLO JSON válido. Sin texto extra. Sin Markdown.\n",
+        },
+        {
+            "role": "user",
+            "content": f"SEMANTIC_MODEL:\n{jdump(semantic_context)}\n\nQUESTION:\n{question}\n\nRESPUESTA (solo JSON):",
+        },
     ]
 
-    resp = client.chat.completions.create(
-        model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-        messages=messages,
-        temperature=0.1,
+    usages: List[Any] = []
+
+    async def attempt(msgs: List[Dict[str, str]], temperature: float) -> Dict[str, Any]:
+        t_start = time.perf_counter()
+        try:
+            resp = await client.chat.completions.create(model=model, messages=msgs, temperature=temperature)
+        except asyncio.CancelledError:
+            # El intento lento que pierde también cuenta (con lo que llevaba, una cota inferior): sin él la
+            # ventana solo ve los rápidos, el percentil baja y la cobertura salta cada vez más.
+            _llm_latency.add(time.perf_counter() - t_start)
+            raise
+        _llm_latency.add(time.perf_counter() - t_start)
+        usages.append(getattr(resp, "usage", None))
+        STAGE_SECONDS.observe(time.perf_counter() - t_start, stage="llm_call")
+        text = (resp.choices[0].message.content or "").strip()
+        with STAGE_SECONDS.time(stage="json_parse"):
+            try:
+                pack = extract_json_object(text)
+            except Exception:
+                pack = None
+        return {"pack": pack, "resp": resp, "raw": text}
+
+    gen, attempts = await hedged_call(
+        [("primary", lambda: attempt(messages, 0.1)), ("retry", lambda: attempt(messages_retry, 0.0))],
+        deadline=hedge_deadline(),
+        accept=lambda g: g["pack"] is not None,
     )
-    elapsed = time.perf_counter() - t0
+    for a in attempts:
+        LLM_ATTEMPTS.inc(attempt=a["attempt"], outcome=a["outcome"])
+    return {**gen, "attempts": attempts, "usages": usages}
 
-    text = (resp.choices[0].message.content or "").strip()
+def _usage_totals(gen: Dict[str, Any], coalesced: bool) -> Dict[str, Optional[int]]:
+    """
+    Tokens de todos los intentos que respondieron (también el rechazado por JSON inválido); un intento cancelado
+    no devuelve usage. Se imputan solo a la petición que hizo la llamada: las coalescidas no gastan.
+    """
+    totals: Dict[str, Optional[int]] = {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None}
+    if coalesced:
+        return totals
+    for usage in gen["usages"]:
+        for k in totals:
+            v = getattr(usage, k, None)
+            if v is not None:
+                totals[k] = (totals[k] or 0) + v
+    return totals
+
+def _record_generated_sql(
+    req: Text2SQLReq,
+    model: str,
+    semantic: Dict[str, Any],
+    gen: Dict[str, Any],
+    coalesced: bool,
+    retrieval_info: Dict[str, Any],
+    elapsed: float,
+) -> Text2SQLResp:
+    cache = get_text2sql_cache()
+    templates = get_template_store()
 
     def log_json_fail(raw_text: str, reason: str):
         run_uuid_fail = new_run_uuid()
@@ -336,48 +1358,28 @@ def text2sql(req: Text2SQLReq) -> Text2SQLResp:
             answer=f"ERROR: {reason}",
             elapsed_seconds=elapsed,
             temperature=0.1,
+            **_usage_totals(gen, coalesced),
             context_json={
                 "stage": "text2sql",
                 "endpoint": "/text2sql",
                 "parent_run_uuid": req.parent_run_uuid,
                 "reason": reason,
                 "raw": raw_text[:1000],
+                "schema_retrieval": retrieval_info,
+                "coalesced": coalesced,
+                "attempts": gen["attempts"],
             },
         )
         add_quality_metric(run_uuid_fail, "ok", 0, {"reason": reason})
         add_quality_metric(run_uuid_fail, "latency_seconds", elapsed)
 
-    try:
-        pack = extract_json_object(text)
-        used_resp = resp
-    except Exception:
-        messages_retry = [
-            {
-                "role": "system",
-                "content": SQL_SYSTEM
-                + "\nULTIMO AVISO: Responde SOLO JSON válido. Sin texto extra. Sin Markdown.\n",
-            },
-            {
-                "role": "user",
-                "content": f"SEMANTIC_MODEL:\n{safe_json(semantic_context)}\n\nQUESTION:\n{req.question}\n\nRESPUESTA (solo JSON):",
-            },
-        ]
-        resp2 = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=messages_retry,
-            temperature=0.0,
+    pack = gen["pack"]
+    if pack is None:
+        log_json_fail(gen["raw"], "json_decode_retry_failed")
+        raise HTTPException(
+            status_code=500,
+            detail="El modelo no devolvió JSON válido (tras reintento).",
         )
-        text2 = (resp2.choices[0].message.content or "").strip()
-
-        try:
-            pack = extract_json_object(text2)
-            used_resp = resp2
-        except Exception:
-            log_json_fail(text2, "json_decode_retry_failed")
-            raise HTTPException(
-                status_code=500,
-                detail="El modelo no devolvió JSON válido (tras reintento).",
-            )
 
     if "sql" not in pack or "params" not in pack:
         log_json_fail(json.dumps(pack)[:1000], "json_missing_keys")
@@ -387,30 +1389,32 @@ def text2sql(req: Text2SQLReq) -> Text2SQLResp:
     params = pack.get("params") or {}
     notes = pack.get("notes") or ""
 
-    forbidden = ("insert", "update", "delete", "drop", "alter", "create", "pragma")
-    if any(tok in sql_out.lower() for tok in forbidden):
+    # SQL vacío: 200 con "(empty sql)" y sql_valid=0, como siempre; el guardrail solo mira sentencias reales.
+    try:
+        if sql_out:
+            check_sql(sql_out)
+    except SQLRejected as e:
+        forbidden = e.reason in ("not_read_only", "multiple_statements")
         run_uuid_fail = new_run_uuid()
         insert_llm_run(
             run_uuid=run_uuid_fail,
             question=req.question,
-            answer="ERROR: SQL no permitido",
+            answer="ERROR: SQL no permitido" if forbidden else f"ERROR: {e.detail}",
             elapsed_seconds=elapsed,
             temperature=0.1,
+            **_usage_totals(gen, coalesced),
             context_json={
                 "stage": "text2sql",
                 "endpoint": "/text2sql",
                 "parent_run_uuid": req.parent_run_uuid,
                 "sql": sql_out[:500],
+                "guard": {"reason": e.reason, "detail": e.detail},
             },
         )
-        add_quality_metric(run_uuid_fail, "ok", 0, {"reason": "forbidden_sql"})
+        add_quality_metric(run_uuid_fail, "ok", 0, {"reason": "forbidden_sql" if forbidden else e.reason})
         add_quality_metric(run_uuid_fail, "latency_seconds", elapsed)
-        raise HTTPException(status_code=400, detail="SQL generado no permitido (solo lectura).")
-
-    usage = getattr(used_resp, "usage", None)
-    pt = getattr(usage, "prompt_tokens", None)
-    ct = getattr(usage, "completion_tokens", None)
-    tt = getattr(usage, "total_tokens", None)
+        detail = "SQL generado no permitido (solo lectura)." if forbidden else f"SQL generado no válido: {e.detail}"
+        raise HTTPException(status_code=400, detail=detail)
 
     run_uuid = new_run_uuid()
     insert_llm_run(
@@ -418,19 +1422,27 @@ def text2sql(req: Text2SQLReq) -> Text2SQLResp:
         question=req.question,
         answer=sql_out if sql_out else "(empty sql)",
         elapsed_seconds=elapsed,
-        prompt_tokens=pt,
-        completion_tokens=ct,
-        total_tokens=tt,
+        **_usage_totals(gen, coalesced),
         temperature=0.1,
         context_json={
             "stage": "text2sql",
             "endpoint": "/text2sql",
             "parent_run_uuid": req.parent_run_uuid,
             "notes": notes,
+            "params": params,
+            "schema_retrieval": retrieval_info,
+            "cache": "miss" if cache else "disabled",
+            "coalesced": coalesced,
+            "attempts": gen["attempts"],
+            "model": model,
         },
     )
     add_quality_metric(run_uuid, "sql_valid", 1 if sql_out else 0)
     add_quality_metric(run_uuid, "latency_seconds", elapsed)
+    if cache and sql_out and not coalesced:
+        cache.put(req.question, model, semantic["fingerprint"], sql_out, params, notes)
+    if templates and sql_out and isinstance(params, dict) and not coalesced:
+        templates.learn(req.question, sql_out, params, notes, semantic["fingerprint"], run_uuid)
 
     return Text2SQLResp(
         run_uuid=run_uuid,
@@ -440,3 +1452,47 @@ def text2sql(req: Text2SQLReq) -> Text2SQLResp:
         notes=notes,
         elapsed_seconds=elapsed,
     )
+
+def _build_sql_context(semantic: Dict[str, Any], question: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    (contexto semántico para el prompt, info de retrieval). Síncrono: BM25 y los derived_index (que pueden
+    escribir el snapshot) van al threadpool, no al event loop.
+    """
+    # Solo las tablas relevantes para la pregunta (sin truncar el JSON)
+    selection = select_schema_context(semantic, question, k=TEXT2SQL_TOP_K, max_tables=TEXT2SQL_MAX_TABLES)
+    semantic_context = {
+        "summary": selection["summary"],
+        "tables": selection["tables"],
+    }
+    joins = join_hints(semantic, selection["tables"]) if not selection["fallback"] else []
+    if joins:
+        semantic_context["join_paths"] = joins
+    preferred = rollups.rollup_hints(semantic, selection["tables"])
+    if preferred:
+        # La tabla resumen entra en el contexto aunque BM25 no la haya elegido.
+        tables = selection["tables"] + [h["table"] for h in preferred if h["table"] not in selection["tables"]]
+        semantic_context.update(summary=focused_summary(semantic, tables), tables=tables, preferred_sources=preferred)
+    retrieval_info = {"tables": selection["tables"], "scores": selection["scores"], "fallback": selection["fallback"]}
+    return semantic_context, retrieval_info
+
+@api.post("/text2sql", response_model=Text2SQLResp)
+async def text2sql(req: Text2SQLReq) -> Text2SQLResp:
+    # async: la espera al LLM no ocupa un worker del threadpool; SQLite sigue yendo al threadpool.
+    t0 = time.perf_counter()
+
+    with STAGE_SECONDS.time(stage="semantic_build"):
+        semantic = await run_in_threadpool(get_semantic_layer, get_db_path())
+    model = get_llm_model()
+
+    cached = await run_in_threadpool(_serve_cached_sql, req, model, semantic, t0)
+    if cached is not None:
+        return cached
+
+    semantic_context, retrieval_info = await run_in_threadpool(_build_sql_context, semantic, req.question)
+
+    # Preguntas idénticas (normalizadas) en vuelo comparten una única llamada al LLM.
+    flight_key = (normalize_question(req.question), model, semantic["fingerprint"])
+    gen, coalesced = await _llm_flights.do(flight_key, lambda: _complete_sql(req.question, semantic_context, model))
+    elapsed = time.perf_counter() - t0
+
+    return await run_in_threadpool(_record_generated_sql, req, model, semantic, gen, coalesced, retrieval_info, elapsed)
@@ -0,0 +1,85 @@
+# hedging.py
+# Peticiones con cobertura (hedging): si la primera no responde a tiempo o no vale, la siguiente ya está en vuelo.
+import asyncio, threading, time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+class LatencyWindow:
+    """Ventana deslizante de latencias (segundos) para fijar el plazo de cobertura por percentil."""
+
+    def __init__(self, maxlen: int = 200):
+        self._samples: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+async def hedged_call(
+    attempts: Sequence[Tuple[str, Callable[[], Awaitable[Any]]]],
+    deadline: Optional[float],
+    accept: Callable[[Any], bool],
+) -> Tuple[Any, List[Dict[str, Any]]]:
+    """
+    Lanza attempts[0]; el siguiente arranca cuando vence `deadline` sin respuesta aceptable
+    o cuando todos los que están en vuelo han terminado sin ella. Gana el primer resultado aceptable
+    y el resto se cancela. deadline=None equivale a reintentos secuenciales.
+    Devuelve (resultado, registros por intento); si ninguno es aceptable, el último resultado rechazado
+    (o la última excepción si todos fallaron).
+    """
+    t0 = time.perf_counter()
+    queue = list(attempts)
+    running: Dict["asyncio.Future[Any]", Dict[str, Any]] = {}
+    records: List[Dict[str, Any]] = []
+    rejected: List[Any] = []
+    last_error: Optional[BaseException] = None
+
+    def launch() -> None:
+        name, factory = queue.pop(0)
+        rec = {'attempt': name, 'started_s': round(time.perf_counter() - t0, 4), 'elapsed_s': None, 'outcome': 'running'}
+        records.append(rec)
+        running[asyncio.ensure_future(factory())] = rec
+
+    def finish(rec: Dict[str, Any], outcome: str) -> None:
+        rec['outcome'] = outcome
+        rec['elapsed_s'] = round(time.perf_counter() - t0 - rec['started_s'], 4)
+
+    launch()
+    try:
+        while running:
+            done, _ = await asyncio.wait(set(running), timeout=deadline if queue else None, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for task in done:
+                rec = running.pop(task)
+                if task.exception() is not None:
+                    finish(rec, 'error')
+                    last_error = task.exception()
+                elif accept(task.result()):
+                    finish(rec, 'ok')
+                    return task.result(), records
+                else:
+                    finish(rec, 'rejected')
+                    rejected.append(task.result())
+            if not running and queue:
+                launch()
+    finally:
+        for task, rec in running.items():
+            task.cancel()
+            finish(rec, 'cancelled')
+
+    if rejected:
+        return rejected[-1], records
+    assert last_error is not None
+    raise last_error
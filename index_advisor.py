@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asesor de índices a partir de la carga real: el SQL ejecutado que ya queda en llm_runs (stage = query_exec).
+
+1) Agrupa el SQL por texto normalizado (nº de ejecuciones, params de la última).
+2) EXPLAIN QUERY PLAN sobre una copia del esquema en memoria: SCAN completos y TEMP B-TREE (ORDER/GROUP BY, DISTINCT).
+3) Candidatos por tabla recorrida: columnas de igualdad, la primera de rango y las de ORDER/GROUP BY.
+4) Cada candidato se crea hipotéticamente (BEGIN ... ROLLBACK en la copia) y se vuelve a planificar.
+   Beneficio = ejecuciones x (coste del plan antes - después), con coste = filas de cada SCAN + filas ordenadas
+   en TEMP B-TREE (SEARCH cuenta 1). Es una estimación en filas, no en tiempo.
+5) Opcional: crea los índices en una copia de la BD y mide el antes/después de cada consulta.
+
+    python index_advisor.py --db db.sqlite --top 10
+    python index_advisor.py --db db.sqlite --apply-copy
+"""
+
+import argparse, json, os, re, shutil, sqlite3, tempfile, time
+from typing import Any, Dict, List, Optional, Tuple
+
+from query_governor import QueryGovernor
+from result_cache import normalize_sql
+from run_traces import stage_expr
+from sql_guard import NullParams
+
+_EQ_OPS = {'=', '==', 'in', 'is'}
+_OP = r"(==|=|<=|>=|<|>|\bin\b|\bis\b|\bbetween\b)"
+_COL_OP_RE = re.compile(rf"(?:\b(\w+)\.)?\b([A-Za-z_]\w*)\s*{_OP}", re.IGNORECASE)
+_OP_COL_RE = re.compile(r"(=|<=|>=|<|>)\s*(?:\b(\w+)\.)?\b([A-Za-z_]\w*)\b(?!\s*[(.])", re.IGNORECASE)
+_FROM_RE = re.compile(
+    r"(?:\bfrom\b|\bjoin\b|,)\s*[\"`\[]?(\w+)[\"`\]]?"
+    r"(?:\s+(?:as\s+)?(?!(?:on|where|join|left|right|inner|outer|cross|natural|group|order|limit|using|union|having)\b)(\w+))?",
+    re.IGNORECASE,
+)
+_ORDER_RE = re.compile(r"\b(?:order|group)\s+by\s+(.+?)(?=\blimit\b|\bhaving\b|\border\s+by\b|\)|;|$)", re.IGNORECASE | re.DOTALL)
+_ORDER_ITEM_RE = re.compile(r"^\s*(?:(\w+)\.)?(\w+)(?:\s+(?:asc|desc))?\s*$", re.IGNORECASE)
+_SCAN_RE = re.compile(r"^SCAN (\S+)")
+_SEARCH_RE = re.compile(r"^SEARCH (\S+)")
+_MAX_INDEX_COLUMNS = 3
+INDEX_ADVISOR_MAX_RUNS = int(os.getenv("INDEX_ADVISOR_MAX_RUNS", "5000"))
+
+# ---- carga de trabajo ----
+def load_workload(conn: sqlite3.Connection, limit: Optional[int] = None,
+                  max_runs: Optional[int] = INDEX_ADVISOR_MAX_RUNS) -> List[Dict[str, Any]]:
+    """
+    [{sql, params, executions, avg_seconds}] del SQL ejecutado (stage query_exec), más frecuente primero.
+    Solo lee las max_runs ejecuciones más recientes (None = todo el histórico): con la columna `stage` migrada
+    es una búsqueda por índice que para en max_runs filas, no un recorrido de llm_runs con json_extract.
+    limit acota las consultas distintas devueltas.
+    """
+    rows = conn.execute(
+        f"""
+        SELECT context_json, elapsed_seconds
+        FROM llm_runs
+        WHERE {stage_expr(conn)} = 'query_exec'
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (-1 if max_runs is None else max_runs,),
+    ).fetchall()
+    groups: Dict[str, Dict[str, Any]] = {}
+    for context_json, elapsed in reversed(rows):
+        try:
+            ctx = json.loads(context_json or '{}')
+        except ValueError:
+            continue
+        # executed_sql: el SQL realmente ejecutado (con filtro de países / LIMIT empujados) si difiere del generado.
+        executed = 'executed_sql' in ctx
+        sql = normalize_sql(ctx.get('executed_sql' if executed else 'sql') or '')
+        if not sql:
+            continue
+        g = groups.setdefault(sql, {'sql': sql, 'params': {}, 'executions': 0, 'total_seconds': 0.0})
+        g['executions'] += 1
+        g['total_seconds'] += float(elapsed or 0.0)
+        params = ctx.get('executed_params' if executed else 'params')
+        if isinstance(params, dict):
+            g['params'] = params
+    workload = sorted(groups.values(), key=lambda g: -g['executions'])
+    for g in workload:
+        g['avg_seconds'] = round(g.pop('total_seconds') / g['executions'], 6)
+    return workload[:limit] if limit else workload
+
+# ---- esquema en memoria ----
+def schema_copy(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Copia sin datos (tablas, índices y vistas) + sqlite_stat1 si existe: el planificador decide igual que en la BD."""
+    mem = sqlite3.connect(":memory:", isolation_level=None)
+    ddl = conn.execute(
+        """
+        SELECT type, sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND type IN ('table', 'index', 'view') AND name NOT LIKE 'sqlite_%'
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END, rowid
+        """
+    ).fetchall()
+    for _type, sql in ddl:
+        try:
+            mem.execute(sql)
+        except sqlite3.Error:  # p. ej. tablas sombra de tablas virtuales
+            continue
+    try:
+        stats = conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1").fetchall()
+    except sqlite3.OperationalError:
+        stats = []
+    if stats:
+        mem.execute("ANALYZE")  # crea sqlite_stat1 vacía
+        mem.execute("DELETE FROM sqlite_stat1")
+        mem.executemany("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)", stats)
+        mem.execute("ANALYZE sqlite_schema")  # recarga las estadísticas
+    return mem
+
+def _table_columns(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    rows = conn.execute(
+        """
+        SELECT m.name, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p
+        WHERE m.type IN ('table', 'view') AND m.name NOT LIKE 'sqlite_%'
+        ORDER BY m.name, p.cid
+        """
+    ).fetchall()
+    cols: Dict[str, List[str]] = {}
+    for t, c in rows:
+        cols.setdefault(t, []).append(c)
+    return cols
+
+def _existing_indexes(conn: sqlite3.Connection) -> Dict[str, List[Tuple[str, ...]]]:
+    rows = conn.execute(
+        """
+        SELECT m.tbl_name, m.name, i.name FROM sqlite_master m JOIN pragma_index_info(m.name) i
+        WHERE m.type = 'index' ORDER BY m.name, i.seqno
+        """
+    ).fetchall()
+    by_index: Dict[Tuple[str, str], List[str]] = {}
+    for tbl, idx, col in rows:
+        by_index.setdefault((tbl, idx), []).append(col)
+    out: Dict[str, List[Tuple[str, ...]]] = {}
+    for (tbl, _idx), cols in by_index.items():
+        out.setdefault(tbl, []).append(tuple(cols))
+    return out
+
+# ---- planes ----
+def _plan(conn: sqlite3.Connection, sql: str, params: Dict[str, Any]) -> List[str]:
+    return [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", NullParams(params or {})).fetchall()]
+
+def _aliases(sql: str, columns: Dict[str, List[str]]) -> Dict[str, str]:
+    """alias -> tabla (y tabla -> tabla) para las tablas de FROM/JOIN conocidas."""
+    out: Dict[str, str] = {}
+    for m in _FROM_RE.finditer(sql):
+        table, alias = m.group(1), m.group(2)
+        if table in columns:
+            out[table] = table
+            if alias:
+                out[alias] = table
+    return out
+
+def plan_issues(plan: List[str], aliases: Dict[str, str], sizes: Dict[str, int]) -> Dict[str, Any]:
+    """{'scans': [tabla], 'temp_btrees': [detalle], 'cost': filas estimadas} de un plan."""
+    scans: List[str] = []
+    temp: List[str] = []
+    cost = 0.0
+    for detail in plan:
+        m = _SCAN_RE.match(detail)
+        if m and not detail.startswith('SCAN CONSTANT'):
+            table = aliases.get(m.group(1), m.group(1))
+            scans.append(table)
+            cost += max(sizes.get(table, 0), 1)
+        elif _SEARCH_RE.match(detail):
+            cost += 1
+        elif 'TEMP B-TREE' in detail:
+            temp.append(detail)
+    # Ordenar cuesta al menos tantas filas como la mayor tabla recorrida.
+    cost += len(temp) * max([max(sizes.get(t, 0), 1) for t in scans] or [1])
+    return {'scans': scans, 'temp_btrees': temp, 'cost': cost}
+
+def _predicate_columns(sql: str, aliases: Dict[str, str], columns: Dict[str, List[str]]) -> Dict[str, Dict[str, List[str]]]:
+    """tabla -> {'eq': [...], 'range': [...], 'order': [...]} (orden de aparición, sin repetidos)."""
+    tables = sorted(set(aliases.values()))
+    found: Dict[str, Dict[str, List[str]]] = {t: {'eq': [], 'range': [], 'order': []} for t in tables}
+
+    def owner(qualifier: Optional[str], col: str) -> Optional[str]:
+        if qualifier:
+            t = aliases.get(qualifier)
+            return t if t and col in columns.get(t, []) else None
+        owners = [t for t in tables if col in columns.get(t, [])]
+        return owners[0] if len(owners) == 1 else None
+
+    def add(kind: str, qualifier: Optional[str], col: str) -> None:
+        t = owner(qualifier, col)
+        if t and col not in found[t][kind]:
+            found[t][kind].append(col)
+
+    for m in _COL_OP_RE.finditer(sql):
+        op = m.group(3).lower()
+        add('eq' if op in _EQ_OPS else 'range', m.group(1), m.group(2))
+    for m in _OP_COL_RE.finditer(sql):
+        op = m.group(1).lower()
+        add('eq' if op in _EQ_OPS else 'range', m.group(2), m.group(3))
+    for m in _ORDER_RE.finditer(sql):
+        for item in m.group(1).split(','):
+            im = _ORDER_ITEM_RE.match(item)
+            if im:
+                add('order', im.group(1), im.group(2))
+    for t in tables:
+        found[t]['range'] = [c for c in found[t]['range'] if c not in found[t]['eq']]
+    return found
+
+def _candidates_for(preds: Dict[str, List[str]]) -> List[Tuple[str, ...]]:
+    eq, rng, order = preds['eq'], preds['range'], preds['order']
+    out: List[Tuple[str, ...]] = [(c,) for c in eq + rng + order]
+    if eq and rng:
+        out.append(tuple(eq + rng[:1]))
+    if len(eq) > 1:
+        out.append(tuple(eq))
+    if eq and order:
+        out.append(tuple(eq + [c for c in order if c not in eq]))
+    seen, uniq = set(), []
+    for cand in out:
+        cand = cand[:_MAX_INDEX_COLUMNS]
+        if cand not in seen:
+            seen.add(cand)
+            uniq.append(cand)
+    return uniq
+
+def index_name(table: str, cols: Tuple[str, ...]) -> str:
+    return f"idx_advisor_{table}_{'_'.join(cols)}"
+
+def index_ddl(table: str, cols: Tuple[str, ...]) -> str:
+    return f'CREATE INDEX IF NOT EXISTS "{index_name(table, cols)}" ON "{table}" ({", ".join(chr(34) + c + chr(34) for c in cols)})'
+
+def advise(conn: sqlite3.Connection, workload: Optional[List[Dict[str, Any]]] = None, top: int = 10) -> Dict[str, Any]:
+    """
+    Recomendaciones ordenadas por beneficio estimado. `conn` es la BD real (solo lectura: esquema, tamaños y
+    llm_runs); los índices hipotéticos se crean en una copia del esquema en memoria.
+    """
+    workload = load_workload(conn) if workload is None else workload
+    sizes = QueryGovernor().table_rows(conn, 'index_advisor')
+    columns = _table_columns(conn)
+    existing = _existing_indexes(conn)
+    mem = schema_copy(conn)
+    analyzed: List[Dict[str, Any]] = []
+    skipped = 0
+    candidates: Dict[Tuple[str, Tuple[str, ...]], List[int]] = {}
+    try:
+        for q in workload:
+            aliases = _aliases(q['sql'], columns)
+            try:
+                before = plan_issues(_plan(mem, q['sql'], q['params']), aliases, sizes)
+            except sqlite3.Error:
+                skipped += 1
+                continue
+            if not before['scans'] and not before['temp_btrees']:
+                continue
+            i = len(analyzed)
+            analyzed.append({**q, 'aliases': aliases, 'before': before})
+            preds = _predicate_columns(q['sql'], aliases, columns)
+            for table in set(before['scans']):
+                for cols in _candidates_for(preds.get(table, {'eq': [], 'range': [], 'order': []})):
+                    if any(idx[:len(cols)] == cols for idx in existing.get(table, [])):
+                        continue  # ya lo cubre un índice existente
+                    candidates.setdefault((table, cols), []).append(i)
+
+        recommendations: List[Dict[str, Any]] = []
+        for (table, cols), query_ids in candidates.items():
+            mem.execute("BEGIN")
+            try:
+                mem.execute(index_ddl(table, cols))
+                benefit, helped = 0.0, []
+                for i in query_ids:
+                    q = analyzed[i]
+                    after = plan_issues(_plan(mem, q['sql'], q['params']), q['aliases'], sizes)
+                    saved = q['before']['cost'] - after['cost']
+                    if saved > 0:
+                        benefit += q['executions'] * saved
+                        helped.append({'sql': q['sql'], 'executions': q['executions'],
+                                       'plan_before': _plan_summary(q['before']), 'plan_after': _plan_summary(after)})
+            finally:
+                mem.execute("ROLLBACK")
+            if benefit > 0:
+                recommendations.append({
+                    'table': table, 'columns': list(cols), 'ddl': index_ddl(table, cols),
+                    'estimated_benefit_rows': benefit, 'table_rows': sizes.get(table, 0),
+                    'executions': sum(h['executions'] for h in helped), 'queries': helped,
+                })
+    finally:
+        mem.close()
+    recommendations.sort(key=lambda r: (-r['estimated_benefit_rows'], len(r['columns'])))
+    return {
+        'workload_queries': len(workload),
+        'workload_executions': sum(q['executions'] for q in workload),
+        'queries_with_issues': len(analyzed),
+        'skipped': skipped,
+        'recommendations': recommendations[:top],
+    }
+
+def _plan_summary(issues: Dict[str, Any]) -> Dict[str, Any]:
+    return {'scans': issues['scans'], 'temp_btrees': len(issues['temp_btrees']), 'cost': issues['cost']}
+
+# ---- validación en una copia ----
+def _time_query(conn: sqlite3.Connection, sql: str, params: Dict[str, Any], repeats: int) -> float:
+    best = float('inf')
+    for _ in range(max(1, repeats)):
+        t0 = time.perf_counter()
+        conn.execute(sql, NullParams(params or {})).fetchall()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def apply_on_copy(db_path: str, recommendations: List[Dict[str, Any]], workload: List[Dict[str, Any]],
+                  repeats: int = 3, keep_copy: bool = False) -> Dict[str, Any]:
+    """
+    Copia la BD (API de backup), mide cada consulta del workload (mejor de `repeats`), crea los índices
+    recomendados + ANALYZE y vuelve a medir. La BD original no se toca.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="index-advisor-")
+    copy_path = os.path.join(tmp_dir, os.path.basename(db_path))
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(copy_path)
+    try:
+        src.backup(dst)
+        src.close()
+        timings: List[Dict[str, Any]] = []
+        for q in workload:
+            try:
+                timings.append({'sql': q['sql'], 'executions': q['executions'],
+                                'before_seconds': _time_query(dst, q['sql'], q['params'], repeats)})
+            except sqlite3.Error as e:
+                timings.append({'sql': q['sql'], 'executions': q['executions'], 'error': str(e)})
+        t0 = time.perf_counter()
+        for r in recommendations:
+            dst.execute(r['ddl'])
+        dst.execute("ANALYZE")
+        dst.commit()
+        build_seconds = time.perf_counter() - t0
+        for t in timings:
+            if 'error' not in t:
+                q = next(q for q in workload if q['sql'] == t['sql'])
+                t['after_seconds'] = _time_query(dst, q['sql'], q['params'], repeats)
+                t['speedup'] = round(t['before_seconds'] / t['after_seconds'], 2) if t['after_seconds'] else None
+        ok = [t for t in timings if 'after_seconds' in t]
+        return {
+            'copy_path': copy_path if keep_copy else None,
+            'indexes': [r['ddl'] for r in recommendations],
+            'index_build_seconds': round(build_seconds, 6),
+            # Ponderado por ejecuciones: el tiempo que se habría ahorrado sobre el histórico registrado.
+            'weighted_before_seconds': sum(t['executions'] * t['before_seconds'] for t in ok),
+            'weighted_after_seconds': sum(t['executions'] * t['after_seconds'] for t in ok),
+            'queries': timings,
+        }
+    finally:
+        dst.close()
+        if not keep_copy:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Asesor de índices a partir del SQL registrado en llm_runs")
+    ap.add_argument("--db", default=os.getenv("DB_PATH", "db.sqlite"))
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--limit", type=int, default=None, help="máximo de consultas distintas del workload")
+    ap.add_argument("--max-runs", type=int, default=INDEX_ADVISOR_MAX_RUNS, help="ejecuciones más recientes a leer (0 = todas)")
+    ap.add_argument("--apply-copy", action="store_true", help="crear los índices en una copia y medir antes/después")
+    ap.add_argument("--repeats", type=int, default=3)
+    ap.add_argument("--keep-copy", action="store_true")
+    args = ap.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        workload = load_workload(conn, args.limit, args.max_runs or None)
+        report = advise(conn, workload, top=args.top)
+    finally:
+        conn.close()
+    if args.apply_copy and report['recommendations']:
+        report['validation'] = apply_on_copy(db_path, report['recommendations'], workload, args.repeats, args.keep_copy)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
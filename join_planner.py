@@ -0,0 +1,65 @@
+# join_planner.py
+# Rutas de JOIN más cortas sobre el grafo de relaciones de la capa semántica.
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from semantic_layer import derived_index
+
+# Preferimos FKs declaradas frente a heurísticas `*_id` cuando hay empate en número de saltos.
+_EDGE_PRIORITY = {'fk': 0, 'heuristic_id': 1}
+
+def _bfs_tree(graph: Dict[str, List[Dict[str, Any]]], src: str) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Árbol BFS desde src: tabla -> arista por la que se llegó (None para el origen)."""
+    parents: Dict[str, Optional[Dict[str, Any]]] = {src: None}
+    queue = deque([src])
+    while queue:
+        t = queue.popleft()
+        for edge in sorted(graph.get(t, []), key=lambda e: (_EDGE_PRIORITY.get(e['type'], 9), e['table'])):
+            nxt = edge['table']
+            if nxt not in parents:
+                parents[nxt] = {'from_table': t, **edge}
+                queue.append(nxt)
+    return parents
+
+def find_join_path(layer: Dict[str, Any], src: str, dst: str) -> Optional[Dict[str, Any]]:
+    """
+    Ruta de JOIN más corta entre dos tablas, o None si no están conectadas.
+    Los árboles BFS se memorizan por tabla origen junto a la capa cacheada.
+    """
+    graph = layer['relationships'].get('graph', {})
+    if src not in graph or dst not in graph:
+        return None
+    trees = derived_index(layer, 'join_trees', lambda _: {})
+    parents = trees.get(src)
+    if parents is None:
+        parents = trees[src] = _bfs_tree(graph, src)
+    if dst not in parents:
+        return None
+
+    hops: List[Dict[str, Any]] = []
+    t = dst
+    while parents[t] is not None:
+        e = parents[t]
+        hops.append({'from_table': e['from_table'], 'from_column': e['column'], 'to_table': t, 'to_column': e['ref_column'], 'type': e['type']})
+        t = e['from_table']
+    hops.reverse()
+    return {'from': src, 'to': dst, 'hops': hops, 'join_sql': join_sql(src, hops)}
+
+def join_sql(src: str, hops: List[Dict[str, Any]]) -> str:
+    parts = [f"FROM {src}"]
+    for h in hops:
+        parts.append(f"JOIN {h['to_table']} ON {h['to_table']}.{h['to_column']} = {h['from_table']}.{h['from_column']}")
+    return '\n'.join(parts)
+
+def join_hints(layer: Dict[str, Any], tables: List[str], max_hints: int = 6) -> List[str]:
+    """JOINs listos para usar desde la primera tabla seleccionada hacia las demás (solo rutas multi-salto)."""
+    if not tables:
+        return []
+    hints: List[str] = []
+    for dst in tables[1:]:
+        path = find_join_path(layer, tables[0], dst)
+        if path and len(path['hops']) > 1:
+            hints.append(path['join_sql'])
+        if len(hints) >= max_hints:
+            break
+    return hints
@@ -6,14 +6,14 @@ from typing import Any, Dict, Optional, List
 
 import requests
 from mcp.server.fastmcp import FastMCP
-from semantic_layer import build_semantic_layer
+from semantic_layer import get_semantic_layer as load_semantic_layer, load_snapshot
+from join_planner import find_join_path
+from columnar import rows_from_columnar, to_columnar
 
 mcp = FastMCP("semantic-rag-sql")
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
 
-_COUNTRY_KEYS = ("country", "country_code", "pais")
-
 def _new_parent_run_uuid() -> str:
     return f"parent-{uuid.uuid4()}"
 
@@ -32,37 +32,33 @@ def _parse_countries(user_countries: Optional[str]) -> Optional[List[str]]:
     items = [c.strip().upper() for c in user_countries.split(",") if c.strip()]
     return items or None
 
-def _filter_rows_by_country(rows: List[Dict[str, Any]], allowed: Optional[List[str]]) -> Dict[str, Any]:
-    if allowed is None:
-        return {"rows": rows, "rowcount": len(rows), "access_filter_applied": False, "access_note": "GLOBAL_USER"}
-    country_key_present = None
-    for key in _COUNTRY_KEYS:
-        if any(key in r for r in rows):
-            country_key_present = key
-            break
-    if not country_key_present:
-        return {"rows": rows, "rowcount": len(rows), "access_filter_applied": False, "access_note": "NO_COUNTRY_COLUMN"}
-    filtered = [r for r in rows if isinstance(r.get(country_key_present), str) and r.get(country_key_present).upper() in allowed]
-    return {"rows": filtered, "rowcount": len(filtered), "access_filter_applied": True, "access_note": f"filtered_by={country_key_present} allowed={allowed}"}
+def _compact_rows(columns: List[str], rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return to_columnar(columns, [[r.get(c) for c in columns] for r in rows], orient="rows")
 
 @mcp.tool()
 async def get_semantic_layer(db_path: Optional[str] = None) -> Dict[str, Any]:
     p = _resolve_db(db_path)
-    return build_semantic_layer(str(p))
+    return load_semantic_layer(str(p))
+
+@mcp.tool()
+async def get_join_path(from_table: str, to_table: str, db_path: Optional[str] = None) -> Dict[str, Any]:
+    """Ruta de JOIN más corta entre dos tablas según las relaciones inferidas (con el SQL listo)."""
+    p = _resolve_db(db_path)
+    path = find_join_path(load_semantic_layer(str(p)), from_table, to_table)
+    if path is None:
+        return {"error": f"Sin ruta de join entre {from_table} y {to_table}"}
+    return path
 
 @mcp.tool()
-async def ask_teams_with_metrics(question: str, user_countries: Optional[str] = None, limit: int = 200) -> Dict[str, Any]:
+async def ask_teams_with_metrics(question: str, user_countries: Optional[str] = None, limit: int = 200, compact: bool = False) -> Dict[str, Any]:
     """
     Flujo gobernado end-to-end:
     Claude Desktop -> MCP tool -> /text2sql (gpt-4o-mini) -> /query (SQL) -> respuesta.
     Inserta métricas en db.sqlite en las tablas oficiales vía FastAPI.
+    compact=True devuelve columns/types/data (matriz) en lugar de una lista de dicts: menos tokens en resultados anchos.
     """
     parent_run_uuid = _new_parent_run_uuid()
     t0 = time.perf_counter()
-   
-   # NEW: construir semantic layer en MCP (mismo db.sqlite)
-    db_path = _resolve_db(None)  # o si tienes parámetro db_path, úsalo
-    semantic = build_semantic_layer(str(db_path))
 
     # 1) text2sql
     t_text2sql = time.perf_counter()
@@ -76,11 +72,15 @@ async def ask_teams_with_metrics(question: str, user_countries: Optional[str] =
     notes = pack.get("notes") or ""
     elapsed_text2sql = time.perf_counter() - t_text2sql
 
-    # 2) query execution
+    # 2) query execution: el filtro por país y el límite se aplican dentro de SQLite (/query envuelve el SQL)
     t_query = time.perf_counter()
     r2 = requests.post(
         f"{API_BASE_URL}/query",
-        json={"parent_run_uuid": parent_run_uuid, "question": question, "sql": sql, "params": params},
+        params={"format": "columnar", "orient": "rows"},
+        json={
+            "parent_run_uuid": parent_run_uuid, "question": question, "sql": sql, "params": params,
+            "allowed_countries": _parse_countries(user_countries), "limit": max(1, int(limit)),
+        },
         timeout=60
     )
     if r2.status_code != 200:
@@ -93,14 +93,9 @@ async def ask_teams_with_metrics(question: str, user_countries: Optional[str] =
         }
     out = r2.json()
     query_run_uuid = out.get("run_uuid")
-    rows = out.get("rows") or []
+    final_rows = rows_from_columnar(out)
     elapsed_query = time.perf_counter() - t_query
 
-    # 3) filtrado por país (si quieres mantenerlo en MCP)
-    allowed = _parse_countries(user_countries)
-    filtered_info = _filter_rows_by_country(rows, allowed)
-    final_rows = filtered_info["rows"][: max(1, int(limit))]
-
     elapsed_total = time.perf_counter() - t0
 
     return {
@@ -110,16 +105,17 @@ async def ask_teams_with_metrics(question: str, user_countries: Optional[str] =
         "notes": notes,
         "sql": sql,
         "rowcount": len(final_rows),
-        "rows": final_rows,
+        **(_compact_rows(out["columns"], final_rows) if compact else {"rows": final_rows}),
         "timing": {
             "text2sql_seconds": elapsed_text2sql,
             "query_seconds": elapsed_query,
             "total_seconds": elapsed_total,
         },
-        "access_filter_applied": filtered_info["access_filter_applied"],
-        "access_note": filtered_info["access_note"],
+        "access_filter_applied": out.get("access_filter_applied", False),
+        "access_note": out.get("access_note"),
     }
 
 if __name__ == "__main__":
     logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    load_snapshot(str(_resolve_db(None)))
     mcp.run(transport="stdio")
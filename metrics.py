@@ -0,0 +1,218 @@
+# metrics.py
+# Métricas en proceso (histogramas y contadores) expuestas en formato de texto de Prometheus (0.0.4).
+# Registrar cuesta un bisect y una suma bajo un lock por serie (sin contención entre series distintas);
+# los acumulados por bucket se calculan solo al hacer scrape. Con varios workers, cada proceso expone los suyos.
+import bisect, threading, time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Segundos: de 1 ms (caché, guardrails) a 30 s (LLM lento).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _num(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def _child(self, key: Tuple[str, ...]) -> Any:
+        child = self._series.get(key)
+        if child is None:
+            with self._lock:
+                child = self._series.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self) -> List[Any]:
+        return [threading.Lock(), 0.0]
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        child = self._child(self._key(labels))
+        with child[0]:
+            child[1] += amount
+
+    def value(self, **labels: Any) -> float:
+        child = self._series.get(self._key(labels))
+        return child[1] if child else 0.0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, child in sorted(self._series.items()):
+            lines.append(f"{self.name}_total{_labels(self.labelnames, key)} {_num(child[1])}")
+        return lines
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> List[Any]:
+        # [lock, cuentas por bucket (no acumuladas; la última es +Inf), suma, n]
+        return [threading.Lock(), [0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value: float, **labels: Any) -> None:
+        child = self._child(self._key(labels))
+        i = bisect.bisect_left(self.buckets, value)
+        with child[0]:
+            child[1][i] += 1
+            child[2] += value
+            child[3] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def snapshot(self, **labels: Any) -> Optional[Dict[str, Any]]:
+        child = self._series.get(self._key(labels))
+        if child is None:
+            return None
+        with child[0]:
+            return {'counts': list(child[1]), 'sum': child[2], 'count': child[3]}
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, child in sorted(self._series.items()):
+            with child[0]:
+                counts, total, n = list(child[1]), child[2], child[3]
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                cumulative += c
+                le = 'le="' + _num(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+class Gauge(_Metric):
+    """Valor leído en el scrape: fn() -> {tupla de etiquetas: valor} (colas, conexiones en uso...)."""
+    kind = 'gauge'
+    suffix = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], fn: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self.fn().items()):
+            lines.append(f"{self.name}{self.suffix}{_labels(self.labelnames, key)} {_num(value)}")
+        return lines
+
+class CounterFunc(Gauge):
+    """Contador leído en el scrape: fn() devuelve totales que solo crecen y que ya lleva otro objeto (stats del escritor)."""
+    kind = 'counter'
+    suffix = '_total'
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _replace(self, metric: Gauge) -> Any:
+        with self._lock:
+            self._metrics[metric.name] = metric  # la función se sustituye (recarga del módulo)
+            return metric
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str], fn: Callable[[], Dict[Tuple[str, ...], float]]) -> Gauge:
+        return self._replace(Gauge(name, help, labelnames, fn))
+
+    def counter_func(self, name: str, help: str, labelnames: Sequence[str], fn: Callable[[], Dict[Tuple[str, ...], float]]) -> CounterFunc:
+        return self._replace(CounterFunc(name, help, labelnames, fn))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+HTTP_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP (hasta el último byte).", ("method", "route", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds",
+    "Duración por etapa: semantic_build, llm_call, json_parse, sql_execute, serialize, obs_write.", ("stage",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests", "Consultas a cachés por resultado (hit | miss | bypass | template).", ("cache", "result"))
+LLM_ATTEMPTS = REGISTRY.counter(
+    "llm_attempts", "Intentos de text2sql por tipo (primary | retry) y resultado.", ("attempt", "outcome"))
+GUARDRAIL_REJECTIONS = REGISTRY.counter(
+    "guardrail_rejections", "SQL rechazado por los guardrails o el gobernador, por motivo.", ("reason",))
+
+class MetricsMiddleware:
+    """
+    ASGI puro (sin BaseHTTPMiddleware): mide hasta que se envía el último trozo del cuerpo, también en streams.
+    La etiqueta route es la plantilla de la ruta (/runs/{parent_run_uuid}), no la URL, para acotar la cardinalidad.
+    """
+
+    def __init__(self, app: Any, histogram: Histogram = HTTP_SECONDS):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            self.histogram.observe(time.perf_counter() - t0, method=scope.get("method", ""),
+                                   route=getattr(route, "path", None) or "unmatched", status=status[0])
@@ -0,0 +1,209 @@
+# obs_writer.py
+# Escritor en segundo plano para la observabilidad: cola acotada + un hilo que agrupa filas en una transacción.
+import logging, os, queue, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from db_pool import write_connection
+from metrics import STAGE_SECONDS
+
+log = logging.getLogger("obs_writer")
+
+OBS_QUEUE_MAX = int(os.getenv("OBS_QUEUE_MAX", "10000"))
+OBS_BATCH_SIZE = int(os.getenv("OBS_BATCH_SIZE", "500"))
+OBS_FLUSH_INTERVAL_SECONDS = float(os.getenv("OBS_FLUSH_INTERVAL_SECONDS", "0.05"))
+OBS_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("OBS_ENQUEUE_TIMEOUT_SECONDS", "0.5"))
+
+_LLM_RUN_COLUMNS = (
+    "run_uuid", "experiment_variant_id", "prompt_id", "dataset_item_id", "user_id", "model_id", "customer_id",
+    "question", "answer", "elapsed_seconds", "prompt_tokens", "completion_tokens", "total_tokens", "cost_usd",
+    "temperature", "top_p", "max_tokens", "country_code", "context_json",
+)
+_INSERT_RUN = f"INSERT INTO llm_runs ({', '.join(_LLM_RUN_COLUMNS)}) VALUES ({', '.join('?' * len(_LLM_RUN_COLUMNS))})"
+_INSERT_METRIC = "INSERT INTO quality_metrics (llm_run_id, metric_name, metric_value, metric_json) VALUES (?, ?, ?, ?)"
+_INSERT_HALLUCINATION = """
+    INSERT INTO hallucination_evaluations
+    (llm_run_id, evaluator_name, score, is_hallucination, method, explanation, raw_json)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_STOP = object()
+# (escritor, filas) del bloque group() activo en este contexto
+_GROUP: ContextVar[Optional[Tuple[Any, List[Tuple[Any, ...]]]]] = ContextVar("obs_group", default=None)
+
+class ObservabilityWriter:
+    """
+    Los endpoints encolan filas ('run' | 'metric' | 'hallucination') y vuelven sin esperar al disco.
+    El hilo escritor agrupa hasta OBS_BATCH_SIZE filas u OBS_FLUSH_INTERVAL_SECONDS en una sola transacción
+    y resuelve run_uuid -> llm_runs.id una vez por lote (no una subconsulta por métrica).
+    Cola llena: el productor espera hasta OBS_ENQUEUE_TIMEOUT_SECONDS (contrapresión) y después descarta y lo cuenta.
+    after_write(conn) corre en la transacción de cada lote (bajo un SAVEPOINT: si falla, el lote se escribe igual).
+    Métricas/evaluaciones cuyo run no existe (descartado o perdido en un lote fallido) se omiten y se cuentan
+    en 'orphaned': llm_run_id es NOT NULL y una sola fila así tiraría el lote entero (y el siguiente, en cascada).
+    """
+
+    def __init__(self, db_path: str, max_queue: int = OBS_QUEUE_MAX, batch_size: int = OBS_BATCH_SIZE,
+                 flush_interval: float = OBS_FLUSH_INTERVAL_SECONDS, enqueue_timeout: float = OBS_ENQUEUE_TIMEOUT_SECONDS,
+                 after_write: Optional[Callable[[Any], Any]] = None):
+        self.db_path = db_path
+        self.after_write = after_write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self.stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0, 'groups': 0,
+                      'backpressure_waits': 0, 'max_batch': 0, 'last_batch_seconds': 0.0, 'after_write_failed': 0,
+                      'orphaned': 0}
+        self._thread = threading.Thread(target=self._run, name=f"obs-writer:{os.path.basename(db_path)}", daemon=True)
+        self._thread.start()
+
+    # ---- productores ----
+    def _put(self, item: Tuple[Any, ...]) -> bool:
+        group = _GROUP.get()
+        if group is not None and group[0] is self:
+            group[1].append(item)
+            return True
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.stats['backpressure_waits'] += 1
+            try:
+                self._q.put(item, timeout=self.enqueue_timeout)
+            except queue.Full:
+                with self._lock:
+                    self.stats['dropped'] += 1
+                log.warning("Cola de observabilidad llena; se descarta %s", item[0])
+                return False
+        with self._lock:
+            self.stats['enqueued'] += 1
+        return True
+
+    def run(self, values: Dict[str, Any]) -> bool:
+        return self._put(('run', tuple(values.get(c) for c in _LLM_RUN_COLUMNS)))
+
+    def metric(self, run_uuid: str, name: str, value: float, metric_json: str) -> bool:
+        return self._put(('metric', run_uuid, name, value, metric_json))
+
+    def hallucination(self, run_uuid: str, evaluator_name: str, score: Optional[float], is_hallucination: Optional[int],
+                      method: Optional[str], explanation: Optional[str], raw_json: str) -> bool:
+        return self._put(('hallucination', run_uuid, evaluator_name, score, is_hallucination, method, explanation, raw_json))
+
+    @contextmanager
+    def group(self) -> Iterator[List[Tuple[Any, ...]]]:
+        """
+        Las filas registradas dentro del bloque (en este contexto) se encolan juntas al salir
+        y el hilo escritor las inserta en la misma transacción.
+        """
+        items: List[Tuple[Any, ...]] = []
+        token = _GROUP.set((self, items))
+        try:
+            yield items
+        finally:
+            _GROUP.reset(token)
+            if items:
+                self._put(('group', tuple(items)))
+
+    def flush(self) -> None:
+        """Bloquea hasta que todo lo encolado hasta ahora está escrito (o descartado por error)."""
+        self._q.join()
+
+    def close(self) -> None:
+        """Drena la cola y para el hilo (apagado limpio)."""
+        if self._thread.is_alive():
+            self._q.put(_STOP)
+            self._thread.join()
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'queued': self._q.qsize(), 'max_queue': self._q.maxsize, 'alive': self._thread.is_alive()}
+
+    # ---- hilo escritor ----
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._q.get()
+            batch: List[Tuple[Any, ...]] = []
+            if item is _STOP:
+                stop = True
+            else:
+                batch.append(item)
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if stop:
+                # Drena lo que quede antes de salir.
+                while True:
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+                    else:
+                        self._q.task_done()
+            if batch:
+                self._write(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._q.task_done()
+
+    def _write(self, batch: List[Tuple[Any, ...]]) -> None:
+        t0 = time.perf_counter()
+        groups = sum(1 for b in batch if b[0] == 'group')
+        batch = [row for b in batch for row in (b[1] if b[0] == 'group' else (b,))]
+        runs = [b[1] for b in batch if b[0] == 'run']
+        others = [b for b in batch if b[0] != 'run']
+        try:
+            with write_connection(self.db_path) as conn:
+                ids: Dict[str, int] = {}
+                for values in runs:
+                    ids[values[0]] = conn.execute(_INSERT_RUN, values).lastrowid
+                missing = sorted({b[1] for b in others} - ids.keys())
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    rows = conn.execute(
+                        f"SELECT run_uuid, id FROM llm_runs WHERE run_uuid IN ({', '.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    ids.update((r[0], r[1]) for r in rows)
+                resolved = [b for b in others if b[1] in ids]
+                orphaned = len(others) - len(resolved)
+                if orphaned:
+                    log.warning("Se omiten %d filas de observabilidad sin llm_run (run descartado o perdido)", orphaned)
+                conn.executemany(_INSERT_METRIC, [(ids[b[1]], *b[2:]) for b in resolved if b[0] == 'metric'])
+                conn.executemany(_INSERT_HALLUCINATION, [(ids[b[1]], *b[2:]) for b in resolved if b[0] == 'hallucination'])
+                if self.after_write is not None:
+                    self._after_write(conn)
+                conn.commit()
+        except Exception:
+            log.exception("No se pudo escribir un lote de observabilidad (%d filas)", len(batch))
+            with self._lock:
+                self.stats['failed'] += len(batch)
+            return
+        with self._lock:
+            self.stats['written'] += len(batch) - orphaned
+            self.stats['orphaned'] += orphaned
+            self.stats['batches'] += 1
+            self.stats['groups'] += groups
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+            self.stats['last_batch_seconds'] = time.perf_counter() - t0
+        STAGE_SECONDS.observe(self.stats['last_batch_seconds'], stage='obs_write')
+
+    def _after_write(self, conn) -> None:
+        conn.execute("SAVEPOINT obs_after_write")
+        try:
+            self.after_write(conn)
+        except Exception:
+            log.exception("after_write falló; el lote se escribe sin él")
+            conn.execute("ROLLBACK TO obs_after_write")
+            with self._lock:
+                self.stats['after_write_failed'] += 1
+        conn.execute("RELEASE obs_after_write")
@@ -0,0 +1,190 @@
+# query_governor.py
+# Gobernador de coste para SELECTs: EXPLAIN QUERY PLAN antes de ejecutar, presupuesto de tiempo/pasos con
+# set_progress_handler y tope de filas. Resultado: allowed | throttled | killed.
+#   allowed   -> plan barato, terminó dentro del presupuesto y del tope de filas
+#   throttled -> se ejecutó con restricciones: plan marcado (carril pesado + presupuesto reducido) o filas truncadas
+#   killed    -> no se ejecutó o se abortó: plan demasiado caro, carril pesado lleno o presupuesto agotado
+import os, re, sqlite3, threading, time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+GOVERNOR_ENABLED = os.getenv("GOVERNOR", "1") != "0"
+GOVERNOR_LARGE_TABLE_ROWS = int(os.getenv("GOVERNOR_LARGE_TABLE_ROWS", "100000"))
+GOVERNOR_MAX_PLAN_ROWS = float(os.getenv("GOVERNOR_MAX_PLAN_ROWS", "1e9"))
+GOVERNOR_TIME_BUDGET_SECONDS = float(os.getenv("GOVERNOR_TIME_BUDGET_SECONDS", "15"))
+GOVERNOR_FLAGGED_BUDGET_SECONDS = float(os.getenv("GOVERNOR_FLAGGED_BUDGET_SECONDS", "5"))
+GOVERNOR_MAX_VM_STEPS = int(os.getenv("GOVERNOR_MAX_VM_STEPS", "0"))  # 0 = sin límite de pasos
+GOVERNOR_MAX_ROWS = int(os.getenv("GOVERNOR_MAX_ROWS", "50000"))
+GOVERNOR_HEAVY_CONCURRENCY = int(os.getenv("GOVERNOR_HEAVY_CONCURRENCY", "2"))
+GOVERNOR_HEAVY_WAIT_SECONDS = float(os.getenv("GOVERNOR_HEAVY_WAIT_SECONDS", "2"))
+GOVERNOR_TABLE_STATS_TTL_SECONDS = float(os.getenv("GOVERNOR_TABLE_STATS_TTL_SECONDS", "60"))
+
+_PROGRESS_STEPS = 10000  # opcodes de la VM entre comprobaciones
+OUTCOME_VALUES = {'allowed': 0, 'throttled': 1, 'killed': 2}
+
+class QueryKilled(Exception):
+    """La consulta no se ejecutó o se abortó. report lleva el motivo y el plan."""
+
+    def __init__(self, reason: str, report: Dict[str, Any]):
+        super().__init__(reason)
+        self.reason = reason
+        self.report = {**report, 'outcome': 'killed', 'reason': reason}
+
+_SCAN_RE = re.compile(r"^SCAN (\S+)")
+_FROM_ALIAS_RE = r"(?:\bfrom\b|\bjoin\b|,)\s*[\"`\[]?(\w+)[\"`\]]?\s+(?:as\s+)?[\"`\[]?{alias}[\"`\]]?(?![\w.])"
+
+def _resolve_alias(sql: str, name: str, known: Dict[str, int]) -> Optional[str]:
+    if name in known:
+        return name
+    m = re.search(_FROM_ALIAS_RE.format(alias=re.escape(name)), sql, re.IGNORECASE)
+    return m.group(1) if m and m.group(1) in known else None
+
+class ExecClock:
+    """
+    Reloj que solo avanza mientras SQLite trabaja (dentro de running()). Para streams: el presupuesto se gasta
+    ejecutando, no esperando a que el cliente lea la página anterior.
+    """
+
+    def __init__(self):
+        self._spent = 0.0
+        self._since: Optional[float] = None
+
+    def __call__(self) -> float:
+        since = self._since
+        return self._spent + (time.perf_counter() - since if since is not None else 0.0)
+
+    @contextmanager
+    def running(self) -> Iterator[None]:
+        self._since = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._spent += time.perf_counter() - self._since
+            self._since = None
+
+class QueryGovernor:
+    def __init__(self):
+        self._heavy = threading.BoundedSemaphore(max(1, GOVERNOR_HEAVY_CONCURRENCY))
+        self._sizes: Dict[str, Tuple[float, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'allowed': 0, 'throttled': 0, 'killed': 0}
+
+    # ---- tamaños de tabla (sqlite_stat1 si hay ANALYZE; si no, MAX(rowid)) ----
+    def table_rows(self, conn: sqlite3.Connection, db_key: str) -> Dict[str, int]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._sizes.get(db_key)
+        if cached and now - cached[0] < GOVERNOR_TABLE_STATS_TTL_SECONDS:
+            return cached[1]
+        sizes: Dict[str, int] = {}
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        try:
+            for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+                sizes[tbl] = max(sizes.get(tbl, 0), int(str(stat).split()[0]))
+        except sqlite3.OperationalError:
+            pass
+        for t in tables:
+            if t not in sizes:
+                try:
+                    sizes[t] = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{t}"').fetchone()[0]
+                except sqlite3.OperationalError:  # WITHOUT ROWID
+                    sizes[t] = 0
+        with self._lock:
+            self._sizes[db_key] = (now, sizes)
+        return sizes
+
+    def check_plan(self, conn: sqlite3.Connection, sql: str, params: Dict[str, Any], db_key: str) -> Dict[str, Any]:
+        """
+        EXPLAIN QUERY PLAN: los SCAN hermanos (mismo padre) son bucles anidados, así que su coste es el producto
+        de las filas de cada tabla recorrida. SEARCH cuenta como 1. Lanza QueryKilled si supera GOVERNOR_MAX_PLAN_ROWS.
+        """
+        sizes = self.table_rows(conn, db_key)
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or {}).fetchall()
+        scans: List[Dict[str, Any]] = []
+        per_parent: Dict[int, float] = {}
+        for _id, parent, _unused, detail in plan:
+            m = _SCAN_RE.match(detail)
+            if not m or detail.startswith('SCAN CONSTANT'):
+                continue
+            table = _resolve_alias(sql, m.group(1), sizes)
+            rows = sizes.get(table, 0) if table else 0
+            scans.append({'table': table or m.group(1), 'rows': rows, 'detail': detail})
+            per_parent[parent] = per_parent.get(parent, 1.0) * max(rows, 1)
+        large = [s for s in scans if s['rows'] >= GOVERNOR_LARGE_TABLE_ROWS]
+        report = {
+            'plan': [p[3] for p in plan],
+            'large_scans': large,
+            'estimated_rows': max(per_parent.values(), default=0.0),
+            'flagged': bool(large),
+        }
+        if report['estimated_rows'] > GOVERNOR_MAX_PLAN_ROWS:
+            raise QueryKilled('plan_too_expensive', report)
+        return report
+
+    @contextmanager
+    def guard(self, conn: sqlite3.Connection, sql: str, params: Dict[str, Any], db_key: str,
+              clock: Callable[[], float] = time.perf_counter) -> Iterator[Dict[str, Any]]:
+        """
+        Plan + presupuesto durante la ejecución. Las consultas marcadas pasan por un carril pesado
+        de GOVERNOR_HEAVY_CONCURRENCY plazas con presupuesto reducido: una consulta desbocada no acapara los workers.
+        clock mide el presupuesto (por defecto, tiempo de pared; ExecClock para streams).
+        """
+        if not GOVERNOR_ENABLED:
+            yield {'outcome': 'allowed', 'flagged': False, 'governor': 'disabled'}
+            return
+        try:
+            report = self.check_plan(conn, sql, params, db_key)
+        except QueryKilled:
+            self._count('killed')
+            raise
+        heavy = report['flagged']
+        if heavy and not self._heavy.acquire(timeout=GOVERNOR_HEAVY_WAIT_SECONDS):
+            self._count('killed')
+            raise QueryKilled('heavy_lane_full', report)
+        budget = GOVERNOR_FLAGGED_BUDGET_SECONDS if heavy else GOVERNOR_TIME_BUDGET_SECONDS
+        deadline = clock() + budget
+        state = {'steps': 0, 'why': None}
+
+        def progress() -> int:
+            state['steps'] += _PROGRESS_STEPS
+            if clock() > deadline:
+                state['why'] = 'time_budget_exceeded'
+            elif GOVERNOR_MAX_VM_STEPS and state['steps'] > GOVERNOR_MAX_VM_STEPS:
+                state['why'] = 'vm_step_budget_exceeded'
+            return 1 if state['why'] else 0
+
+        report.update({'budget_seconds': budget, 'outcome': 'throttled' if heavy else 'allowed'})
+        conn.set_progress_handler(progress, _PROGRESS_STEPS)
+        t0 = time.perf_counter()
+        try:
+            yield report
+        except sqlite3.OperationalError as e:
+            if state['why'] and 'interrupt' in str(e).lower():
+                self._count('killed')
+                raise QueryKilled(state['why'], {**report, 'vm_steps': state['steps']}) from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+            if heavy:
+                self._heavy.release()
+            report['vm_steps'] = state['steps']
+            report['exec_seconds'] = round(time.perf_counter() - t0, 6)
+
+    def finish(self, rows: List[Any], report: Dict[str, Any]) -> List[Any]:
+        """Aplica el tope de filas (se piden GOVERNOR_MAX_ROWS + 1 para detectar el exceso) y cuenta el resultado."""
+        report['truncated'] = len(rows) > GOVERNOR_MAX_ROWS
+        if report['truncated']:
+            report['outcome'] = 'throttled'
+            rows = rows[:GOVERNOR_MAX_ROWS]
+        self._count(report['outcome'])
+        return rows
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'enabled': GOVERNOR_ENABLED, 'max_rows': GOVERNOR_MAX_ROWS,
+                    'large_table_rows': GOVERNOR_LARGE_TABLE_ROWS, 'max_plan_rows': GOVERNOR_MAX_PLAN_ROWS,
+                    'time_budget_seconds': GOVERNOR_TIME_BUDGET_SECONDS, 'flagged_budget_seconds': GOVERNOR_FLAGGED_BUDGET_SECONDS}
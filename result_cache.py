@@ -0,0 +1,234 @@
+# result_cache.py
+# Caché de resultados SQL compartida entre procesos (fichero SQLite) e invalidada por versión de tabla.
+import hashlib, json, re, sqlite3, threading, time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Versión por tabla mantenida con triggers. PRAGMA data_version / el contador de cambios del fichero no sirven aquí:
+# las inserciones de observabilidad van a la misma BD y cambiarían la versión global en cada petición.
+VERSIONS_TABLE = "_table_versions"
+
+# Resultados que dependen del momento o del estado de la conexión, no de las tablas: no se cachean.
+_VOLATILE_FUNCS = {'random', 'randomblob', 'changes', 'total_changes', 'last_insert_rowid',
+                   'current_date', 'current_time', 'current_timestamp'}
+_DATE_FUNCS = {'date', 'time', 'datetime', 'julianday', 'strftime', 'unixepoch'}
+_CURRENT_RE = re.compile(r"\bcurrent_(?:date|time|timestamp)\b", re.IGNORECASE)
+# 'now' explícito o sin fecha: date(), julianday(), strftime('%Y')
+_NOW_RE = re.compile(r"'now'|\b(?:date|time|datetime|julianday|unixepoch)\s*\(\s*\)|\bstrftime\s*\(\s*'(?:[^']|'')*'\s*\)",
+                     re.IGNORECASE)
+
+def is_volatile(sql: str, params: Any, functions: Iterable[str]) -> bool:
+    """
+    functions: nombres que el authorizer vio como SQLITE_FUNCTION. Las de fecha solo son volátiles con 'now'
+    (que el authorizer no ve: se busca en el SQL y en los parámetros) o sin argumento de fecha.
+    """
+    funcs = {f.lower() for f in functions}
+    if funcs & _VOLATILE_FUNCS or _CURRENT_RE.search(sql or ''):
+        return True
+    if not funcs & _DATE_FUNCS:
+        return False
+    values = params.values() if isinstance(params, dict) else (params or ())
+    return bool(_NOW_RE.search(sql or '')) or any(isinstance(v, str) and v.strip().lower() == 'now' for v in values)
+
+_QUOTED_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_SPACES_RE = re.compile(r"\s+")
+
+def normalize_sql(sql: str) -> str:
+    """Colapsa espacios y quita el ';' final, sin tocar los literales entre comillas."""
+    parts = _QUOTED_RE.split((sql or '').strip().rstrip(';').strip())
+    return ''.join(p if i % 2 else _SPACES_RE.sub(' ', p) for i, p in enumerate(parts)).strip()
+
+def result_key(sql: str, params: Dict[str, Any], fingerprint: str) -> str:
+    raw = '\x1f'.join((normalize_sql(sql), json.dumps(params or {}, sort_keys=True, default=str), fingerprint))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _qi(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def install_version_triggers(conn: sqlite3.Connection, exclude: Iterable[str] = ()) -> List[str]:
+    """
+    Crea _table_versions y triggers AFTER INSERT/UPDATE/DELETE en cada tabla de usuario (idempotente).
+    Es DDL sobre la BD de producción y cambia la huella de esquema: se ejecuta una vez (arranque o CLI), no por petición.
+    Las tablas con prefijo '_' son internas y no se versionan; las de `exclude` (observabilidad, tablas resumen)
+    tampoco: se escriben en cada petición y pagarían el UPDATE de versión sin servir consultas cacheadas.
+    Los triggers que quedaran de una instalación anterior en tablas excluidas se borran. Devuelve las tablas versionadas.
+    """
+    skip = set(exclude)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    tables = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\'"
+    ) if r[0] not in skip]
+    stale = [(name, tbl) for name, tbl in conn.execute(
+        "SELECT name, tbl_name FROM sqlite_master WHERE type='trigger' AND name LIKE '\\_tv\\_%' ESCAPE '\\'"
+    ) if tbl in skip]
+    for name, tbl in stale:
+        conn.execute(f"DROP TRIGGER {_qi(name)}")
+        conn.execute(f"DELETE FROM {VERSIONS_TABLE} WHERE name = ?", (tbl,))
+    for t in tables:
+        conn.execute(f"INSERT OR IGNORE INTO {VERSIONS_TABLE} (name) VALUES (?)", (t,))
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {_qi(f'_tv_{t}_{op.lower()}')} AFTER {op} ON {_qi(t)} "
+                f"BEGIN UPDATE {VERSIONS_TABLE} SET version = version + 1 WHERE name = {_quote_literal(t)}; END"
+            )
+    conn.commit()
+    return tables
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def execute_tracked(conn: sqlite3.Connection, sql: str, params: Dict[str, Any], max_rows: Optional[int] = None) -> Tuple[List[str], List[Tuple[Any, ...]], Optional[Dict[str, Optional[int]]]]:
+    """
+    Ejecuta la consulta y devuelve (columnas, filas, versiones de las tablas leídas).
+    Las tablas se recogen con un authorizer (SQLITE_READ, incluye las tablas base de las vistas) y las versiones
+    se leen en la misma transacción de lectura que el resultado: no hay carrera con escrituras concurrentes.
+    Versión None = tabla sin versionar (resultado no cacheable). versiones None = consulta no determinista
+    (date('now'), CURRENT_DATE, random()...): las versiones no dicen nada de si el resultado sigue valiendo.
+    """
+    read: set = set()
+    functions: set = set()
+
+    def authorizer(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and arg1:
+            read.add(arg1)
+        elif action == sqlite3.SQLITE_FUNCTION and arg2:
+            functions.add(arg2)
+        return sqlite3.SQLITE_OK
+
+    conn.execute("BEGIN")
+    try:
+        conn.set_authorizer(authorizer)
+        try:
+            cur = conn.execute(sql, params or {})
+            cur.row_factory = None
+            rows = cur.fetchall() if max_rows is None else cur.fetchmany(max_rows)
+        finally:
+            conn.set_authorizer(None)
+        columns = [d[0] for d in cur.description or []]
+        versions = None if is_volatile(sql, params, functions) else read_versions(conn, read)
+    finally:
+        conn.rollback()
+    return columns, rows, versions
+
+def read_versions(conn: sqlite3.Connection, tables: Iterable[str]) -> Dict[str, Optional[int]]:
+    names = sorted(t for t in tables if not t.startswith('sqlite_'))
+    if not names:
+        return {}
+    try:
+        found = dict(conn.execute(
+            f"SELECT name, version FROM {VERSIONS_TABLE} WHERE name IN ({', '.join('?' * len(names))})", names
+        ).fetchall())
+    except sqlite3.OperationalError:
+        found = {}
+    return {t: found.get(t) for t in names}
+
+class ResultCache:
+    """
+    Entradas en un fichero SQLite (WAL) para que todos los workers de uvicorn compartan aciertos.
+    Cada entrada guarda las versiones de las tablas leídas; si alguna cambió, la entrada se descarta al leerla.
+    Tamaño acotado por bytes con desalojo LRU (last_used_ns); resultados con más de max_rows filas no se guardan.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, max_rows: int = 5000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'stores': 0, 'bypass': 0, 'evictions': 0}
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS result_cache (
+                cache_key       TEXT PRIMARY KEY,
+                sql_norm        TEXT NOT NULL,
+                versions        TEXT NOT NULL,
+                payload         TEXT NOT NULL,
+                rowcount        INTEGER NOT NULL,
+                bytes           INTEGER NOT NULL,
+                hits            INTEGER NOT NULL DEFAULT 0,
+                created_at      DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_used_ns    INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_lru ON result_cache(last_used_ns)")
+        self._conn.commit()
+
+    def get(self, key: str, current_versions) -> Optional[Dict[str, Any]]:
+        """
+        {'columns', 'rows', 'versions'} o None. current_versions(tablas) -> versiones actuales en la BD de datos.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT versions, payload FROM result_cache WHERE cache_key=?", (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        versions = json.loads(row[0])
+        if current_versions(versions.keys()) != versions:
+            with self._lock:
+                self._conn.execute("DELETE FROM result_cache WHERE cache_key=?", (key,))
+                self._conn.commit()
+            self._count('stale')
+            return None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE result_cache SET hits = hits + 1, last_used_ns = ? WHERE cache_key=?", (time.time_ns(), key)
+            )
+            self._conn.commit()
+        self._count('hits')
+        payload = json.loads(row[1])
+        return {'columns': payload['columns'], 'rows': [tuple(r) for r in payload['rows']], 'versions': versions}
+
+    def put(self, key: str, sql: str, columns: List[str], rows: Sequence[Sequence[Any]],
+            versions: Optional[Dict[str, Optional[int]]]) -> bool:
+        """
+        Guarda si el resultado es cacheable: determinista (versions no None), lee al menos una tabla (sin tablas
+        no hay nada que invalide la entrada), todas versionadas y <= max_rows filas.
+        """
+        if not versions or len(rows) > self.max_rows or any(v is None for v in versions.values()):
+            self._count('bypass')
+            return False
+        try:
+            payload = json.dumps({'columns': columns, 'rows': [list(r) for r in rows]}, ensure_ascii=False)
+        except TypeError:  # BLOBs: no se cachean
+            self._count('bypass')
+            return False
+        if len(payload) > self.max_bytes:
+            self._count('bypass')
+            return False
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO result_cache (cache_key, sql_norm, versions, payload, rowcount, bytes, last_used_ns)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET versions=excluded.versions, payload=excluded.payload,
+                    rowcount=excluded.rowcount, bytes=excluded.bytes, last_used_ns=excluded.last_used_ns
+                """,
+                (key, normalize_sql(sql), json.dumps(versions, sort_keys=True), payload, len(rows), len(payload), time.time_ns()),
+            )
+            self._evict()
+            self._conn.commit()
+            self.stats['stores'] += 1
+        return True
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM result_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT cache_key, bytes FROM result_cache ORDER BY last_used_ns").fetchall():
+            self._conn.execute("DELETE FROM result_cache WHERE cache_key=?", (key,))
+            self.stats['evictions'] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM result_cache").fetchone()
+            return {**self.stats, 'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes,
+                    'max_rows': self.max_rows, 'path': self.path}
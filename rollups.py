@@ -0,0 +1,191 @@
+# rollups.py
+# Tablas resumen de ventas mantenidas por triggers: cada INSERT/UPDATE/DELETE en las tablas de origen
+# resta la aportación de la imagen OLD y suma la de NEW (upsert por clave), así que el coste de mantenerlas
+# es por fila modificada y una consulta agregada lee la tabla resumen, no las facturas.
+#   sales_daily_rollup = invoice_items ⋈ invoices (⟕ customers, ⟕ products) por día × país × categoría × moneda
+# Claves sin valor: country_code '' (cliente sin país) y category_id 0 (línea sin producto/categoría).
+# Las facturas canceladas (invoices.status = 'cancelled') no cuentan: cancelar/reabrir una factura resta/suma sus líneas.
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from semantic_layer import derived_index
+
+ROLLUP_TABLE = "sales_daily_rollup"
+SOURCE_TABLES = ('invoice_items', 'invoices', 'customers', 'products')
+_TRIGGER_PREFIX = "_ru_sales_daily_"
+
+# Descripción para la capa semántica y el prompt de text2sql.
+ROLLUP_HINT = {
+    'table': ROLLUP_TABLE,
+    'replaces': ['invoices', 'invoice_items'],
+    'grain': 'day × country_code × category_id × currency',
+    'measures': {'lines': 'nº de líneas de factura', 'quantity': 'unidades', 'net_amount': 'importe neto (line_total)'},
+    'notes': "day = invoices.invoice_date; country_code = customers.country_code ('' = sin país); "
+             "category_id = products.category_id (0 = sin categoría). Para meses: strftime('%Y-%m', day). "
+             "Excluye las facturas canceladas (status = 'cancelled'); para incluirlas hay que ir a invoices. "
+             "Suma las medidas (SUM) al agrupar por menos dimensiones.",
+}
+
+_DDL = f"""
+CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+    day             DATE NOT NULL,
+    country_code    TEXT NOT NULL DEFAULT '',
+    category_id     INTEGER NOT NULL DEFAULT 0,
+    currency        TEXT NOT NULL,
+    lines           INTEGER NOT NULL DEFAULT 0,
+    quantity        NUMERIC NOT NULL DEFAULT 0,
+    net_amount      NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, country_code, category_id, currency)
+) WITHOUT ROWID
+"""
+
+# Índices que usan los triggers para localizar las líneas afectadas por un cambio de cabecera/dimensión,
+# y un índice parcial para borrar las claves que se quedan a cero sin recorrer la tabla resumen.
+_INDEXES = (
+    f"CREATE INDEX IF NOT EXISTS idx_{ROLLUP_TABLE}_empty ON {ROLLUP_TABLE}(lines) WHERE lines = 0",
+    "CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice ON invoice_items(invoice_id)",
+    "CREATE INDEX IF NOT EXISTS idx_invoice_items_product ON invoice_items(product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_invoices_customer ON invoices(customer_id)",
+)
+
+_LIVE = "{inv}.status IS NOT 'cancelled'"
+_AMOUNT = "COALESCE({it}.line_total, {it}.quantity * {it}.unit_price * (1 - COALESCE({it}.discount_percent, 0) / 100.0))"
+
+_UPSERT = f"""INSERT INTO {ROLLUP_TABLE} (day, country_code, category_id, currency, lines, quantity, net_amount)
+SELECT {{day}}, COALESCE({{country}}, ''), COALESCE({{category}}, 0), {{currency}},
+       {{sign}}COUNT(*), {{sign}}SUM({{it}}.quantity), {{sign}}SUM({_AMOUNT})
+{{source}}
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (day, country_code, category_id, currency) DO UPDATE SET
+    lines = lines + excluded.lines, quantity = quantity + excluded.quantity, net_amount = net_amount + excluded.net_amount;"""
+
+def _delta(table: str, image: str, sign: str, key: str = '', value: str = '') -> str:
+    """
+    Aportación de las líneas que dependen de la fila `image` (OLD/NEW) de `table`, con signo.
+    Para customers/products, `key` localiza las líneas y `value` es el país/categoría de la imagen
+    (NULL si la imagen no existe: INSERT para OLD, DELETE para NEW).
+    """
+    it, day, currency = 'it', 'i.invoice_date', 'i.currency'
+    country, category = 'c.country_code', 'p.category_id'
+    if table == 'invoice_items':
+        it = image
+        source = (f"FROM invoices i LEFT JOIN customers c ON c.id = i.customer_id "
+                  f"LEFT JOIN products p ON p.id = {image}.product_id WHERE i.id = {image}.invoice_id AND {_LIVE.format(inv='i')}")
+    elif table == 'invoices':
+        day, currency = f"{image}.invoice_date", f"{image}.currency"
+        source = (f"FROM invoice_items it LEFT JOIN customers c ON c.id = {image}.customer_id "
+                  f"LEFT JOIN products p ON p.id = it.product_id WHERE it.invoice_id = {image}.id AND {_LIVE.format(inv=image)}")
+    elif table == 'customers':
+        country = value
+        source = (f"FROM invoices i JOIN invoice_items it ON it.invoice_id = i.id "
+                  f"LEFT JOIN products p ON p.id = it.product_id WHERE i.customer_id = {key} AND {_LIVE.format(inv='i')}")
+    else:
+        category = value
+        source = (f"FROM invoice_items it JOIN invoices i ON i.id = it.invoice_id "
+                  f"LEFT JOIN customers c ON c.id = i.customer_id WHERE it.product_id = {key} AND {_LIVE.format(inv='i')}")
+    return _UPSERT.format(day=day, country=country, category=category, currency=currency, sign=sign, it=it, source=source)
+
+def _trigger_body(table: str, op: str) -> str:
+    steps: List[str] = []
+    if table in ('invoice_items', 'invoices'):
+        if op != 'INSERT':
+            steps.append(_delta(table, 'OLD', '-'))
+        if op != 'DELETE':
+            steps.append(_delta(table, 'NEW', ''))
+    else:
+        col = 'country_code' if table == 'customers' else 'category_id'
+        old_key, new_key = ('NEW.id', 'NEW.id') if op == 'INSERT' else ('OLD.id', 'OLD.id' if op == 'DELETE' else 'NEW.id')
+        steps.append(_delta(table, 'OLD', '-', old_key, 'NULL' if op == 'INSERT' else f"OLD.{col}"))
+        steps.append(_delta(table, 'NEW', '', new_key, 'NULL' if op == 'DELETE' else f"NEW.{col}"))
+    steps.append(f"DELETE FROM {ROLLUP_TABLE} WHERE lines = 0;")
+    return '\n'.join(steps)
+
+# Solo los cambios que mueven una línea de clave disparan el trigger en las tablas de dimensión.
+_WATCHED = {
+    'invoice_items': 'invoice_id, product_id, quantity, unit_price, discount_percent, line_total',
+    'invoices': 'id, invoice_date, customer_id, currency, status',
+    'customers': 'id, country_code',
+    'products': 'id, category_id',
+}
+
+def trigger_ddl() -> List[Tuple[str, str]]:
+    """[(nombre, CREATE TRIGGER ...)] para las tablas de origen."""
+    out = []
+    for table in SOURCE_TABLES:
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            name = f"{_TRIGGER_PREFIX}{table}_{op.lower()}"
+            event = f"UPDATE OF {_WATCHED[table]}" if op == 'UPDATE' else op
+            out.append((name, f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN\n{_trigger_body(table, op)}\nEND"))
+    return out
+
+def rebuild_sql() -> str:
+    """Agregado completo desde las tablas de origen (carga inicial y verificación)."""
+    return (f"SELECT i.invoice_date, COALESCE(c.country_code, ''), COALESCE(p.category_id, 0), i.currency, "
+            f"COUNT(*), SUM(it.quantity), SUM({_AMOUNT.format(it='it')}) "
+            "FROM invoice_items it JOIN invoices i ON i.id = it.invoice_id "
+            "LEFT JOIN customers c ON c.id = i.customer_id LEFT JOIN products p ON p.id = it.product_id "
+            f"WHERE {_LIVE.format(inv='i')} GROUP BY 1, 2, 3, 4")
+
+def _existing(conn: sqlite3.Connection, type_: str) -> set:
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (type_,))}
+
+def install(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """
+    Crea la tabla resumen, sus índices y triggers (idempotente) y la carga desde cero si es nueva.
+    Los triggers de una versión anterior (otro cuerpo) se sustituyen y la tabla se recarga.
+    Sin las tablas de origen no hace nada. La transacción la cierra quien llama.
+    """
+    tables = _existing(conn, 'table')
+    missing = [t for t in SOURCE_TABLES if t not in tables]
+    if missing:
+        return {'installed': False, 'missing': missing}
+    created = ROLLUP_TABLE not in tables
+    conn.execute(_DDL)
+    for ddl in _INDEXES:
+        conn.execute(ddl)
+    existing = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall())
+    new_triggers, replaced = 0, False
+    for name, ddl in trigger_ddl():
+        if name in existing and existing[name] == ddl.replace(" IF NOT EXISTS", "", 1):
+            continue
+        if name in existing:
+            conn.execute(f"DROP TRIGGER {name}")
+            replaced = True
+        conn.execute(ddl)
+        new_triggers += 1
+    if created or replaced:
+        rebuild(conn)
+    return {'installed': True, 'created': created, 'new_triggers': new_triggers}
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    conn.execute(f"DELETE FROM {ROLLUP_TABLE}")
+    cur = conn.execute(f"INSERT INTO {ROLLUP_TABLE} (day, country_code, category_id, currency, lines, quantity, net_amount) "
+                       f"{rebuild_sql()}")
+    return cur.rowcount
+
+def verify(conn: sqlite3.Connection, tolerance: float = 1e-6) -> Dict[str, Any]:
+    """Compara la tabla resumen con el agregado completo: claves que sobran/faltan y medidas que difieren."""
+    fresh = {tuple(r[:4]): r[4:] for r in conn.execute(rebuild_sql())}
+    stored = {tuple(r[:4]): r[4:] for r in conn.execute(
+        f"SELECT day, country_code, category_id, currency, lines, quantity, net_amount FROM {ROLLUP_TABLE}")}
+    drift = [list(k) for k in fresh.keys() & stored.keys()
+             if any(abs((a or 0) - (b or 0)) > tolerance for a, b in zip(fresh[k], stored[k]))]
+    return {
+        'keys': len(stored),
+        'missing': [list(k) for k in sorted(fresh.keys() - stored.keys())][:20],
+        'extra': [list(k) for k in sorted(stored.keys() - fresh.keys())][:20],
+        'drift': drift[:20],
+        'ok': fresh.keys() == stored.keys() and not drift,
+    }
+
+def rollup_hints(layer: Dict[str, Any], tables: List[str]) -> List[Dict[str, Any]]:
+    """Tablas resumen presentes en la capa cuyas tablas de origen están entre las seleccionadas."""
+    present = derived_index(layer, 'rollups', lambda l: [ROLLUP_HINT] if ROLLUP_TABLE in l['schema']['tables'] else [])
+    return [h for h in present if any(t in tables for t in h['replaces'])]
+
+def info(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+    if ROLLUP_TABLE not in _existing(conn, 'table'):
+        return None
+    keys, days = conn.execute(f"SELECT COUNT(*), COUNT(DISTINCT day) FROM {ROLLUP_TABLE}").fetchone()
+    triggers = sum(1 for t in _existing(conn, 'trigger') if t.startswith(_TRIGGER_PREFIX))
+    return {**ROLLUP_HINT, 'keys': keys, 'days': days, 'triggers': triggers}
@@ -0,0 +1,192 @@
+# run_aggregates.py
+# daily_run_aggregates incremental: cada pasada lee solo las filas nuevas de llm_runs y hallucination_evaluations
+# (marca de agua por id) y actualiza las claves (día, experiment_variant_id, model_id) que tocan.
+# Las medias no se pueden combinar sin sus pesos: sumas y contadores van en _daily_run_sums (interna, con
+# 0 en lugar de NULL en la clave para poder usar PRIMARY KEY) y daily_run_aggregates se deriva de ellas.
+# llm_runs es un log de solo inserción: los borrados no se descuentan.
+# Solo cuentan las llamadas al LLM: las ejecuciones de SQL (stage = 'query_exec') también van a llm_runs, pero ni
+# son runs del modelo ni deben mezclar su latencia con la suya.
+import argparse, sqlite3, time
+from typing import Any, Dict, List, Optional, Tuple
+
+from run_traces import stage_expr
+
+AGG_TABLE = "daily_run_aggregates"
+SUMS_TABLE = "_daily_run_sums"
+STATE_TABLE = "_daily_run_watermarks"
+BATCH_ROWS = 50000  # filas nuevas por fuente y pasada: el backfill de un histórico grande avanza por tramos
+
+# Igual que en seed.sql (sección 2.7); aquí para BDs creadas antes del agregador.
+_DDL = (
+    f"""CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+        source      TEXT PRIMARY KEY,
+        last_id     INTEGER NOT NULL DEFAULT 0,
+        updated_at  DATETIME
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS {SUMS_TABLE} (
+        day                     DATE NOT NULL,
+        experiment_variant_id   INTEGER NOT NULL,
+        model_id                INTEGER NOT NULL,
+        total_runs              INTEGER NOT NULL DEFAULT 0,
+        latency_n               INTEGER NOT NULL DEFAULT 0,
+        latency_sum             REAL NOT NULL DEFAULT 0,
+        cost_sum                REAL,
+        evaluations             INTEGER NOT NULL DEFAULT 0,
+        hallucinations          INTEGER NOT NULL DEFAULT 0,
+        score_n                 INTEGER NOT NULL DEFAULT 0,
+        score_sum               REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, experiment_variant_id, model_id)
+    ) WITHOUT ROWID""",
+)
+
+_RUNS_DELTA = """
+SELECT date(created_at), IFNULL(experiment_variant_id, 0), IFNULL(model_id, 0),
+       COUNT(*), COUNT(elapsed_seconds), IFNULL(SUM(elapsed_seconds), 0), SUM(cost_usd)
+FROM (SELECT * FROM llm_runs WHERE id > ? ORDER BY id LIMIT ?)
+WHERE {stage} IS NOT 'query_exec'
+GROUP BY 1, 2, 3
+"""
+_RUNS_UPSERT = f"""
+INSERT INTO {SUMS_TABLE} (day, experiment_variant_id, model_id, total_runs, latency_n, latency_sum, cost_sum)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, experiment_variant_id, model_id) DO UPDATE SET
+    total_runs = total_runs + excluded.total_runs, latency_n = latency_n + excluded.latency_n,
+    latency_sum = latency_sum + excluded.latency_sum,
+    cost_sum = CASE WHEN excluded.cost_sum IS NULL THEN cost_sum ELSE IFNULL(cost_sum, 0) + excluded.cost_sum END
+"""
+# Las evaluaciones pueden llegar después que su run: cuentan en el día/clave del run.
+_EVALS_DELTA = """
+SELECT date(r.created_at), IFNULL(r.experiment_variant_id, 0), IFNULL(r.model_id, 0),
+       COUNT(*), IFNULL(SUM(h.is_hallucination = 1), 0), COUNT(h.score), IFNULL(SUM(h.score), 0)
+FROM (SELECT * FROM hallucination_evaluations WHERE id > ? ORDER BY id LIMIT ?) h
+JOIN llm_runs r ON r.id = h.llm_run_id
+GROUP BY 1, 2, 3
+"""
+_EVALS_UPSERT = f"""
+INSERT INTO {SUMS_TABLE} (day, experiment_variant_id, model_id, evaluations, hallucinations, score_n, score_sum)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, experiment_variant_id, model_id) DO UPDATE SET
+    evaluations = evaluations + excluded.evaluations, hallucinations = hallucinations + excluded.hallucinations,
+    score_n = score_n + excluded.score_n, score_sum = score_sum + excluded.score_sum
+"""
+
+def _tables(conn: sqlite3.Connection) -> set:
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def watermarks(conn: sqlite3.Connection) -> Dict[str, int]:
+    try:
+        return dict(conn.execute(f"SELECT source, last_id FROM {STATE_TABLE}").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+def _advance(conn: sqlite3.Connection, sql: str, upsert: str, source: str, last_id: int, limit: int,
+             touched: set) -> Tuple[int, int]:
+    """
+    Aplica el delta de una fuente. -> (filas leídas, nueva marca de agua).
+    El tramo se mide aparte: las evaluaciones sin run no salen en el JOIN pero la marca debe pasarlas.
+    """
+    n, new_last = conn.execute(f"SELECT COUNT(*), MAX(id) FROM (SELECT id FROM {source} WHERE id > ? ORDER BY id LIMIT ?)",
+                               (last_id, limit)).fetchone()
+    if not n:
+        return 0, last_id
+    rows = conn.execute(sql, (last_id, limit)).fetchall()
+    conn.executemany(upsert, rows)
+    touched.update(r[:3] for r in rows)
+    conn.execute(
+        f"INSERT INTO {STATE_TABLE} (source, last_id, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+        "ON CONFLICT (source) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at",
+        (source, new_last),
+    )
+    return n, new_last
+
+def _publish(conn: sqlite3.Connection, keys: List[Tuple[str, int, int]]) -> None:
+    """
+    Reescribe daily_run_aggregates para las claves tocadas. Su índice único incluye columnas que pueden ser NULL
+    (dos NULL no chocan), así que no sirve ON CONFLICT: UPDATE con IS y, si no había fila, INSERT.
+    """
+    for day, variant, model in keys:
+        s = conn.execute(
+            f"SELECT total_runs, hallucinations, score_n, score_sum, cost_sum, latency_n, latency_sum FROM {SUMS_TABLE} "
+            "WHERE day = ? AND experiment_variant_id = ? AND model_id = ?", (day, variant, model)
+        ).fetchone()
+        runs, hallucinations, score_n, score_sum, cost, latency_n, latency_sum = s
+        values = (runs, hallucinations, score_sum / score_n if score_n else None, cost,
+                  latency_sum / latency_n if latency_n else None)
+        key = (day, variant or None, model or None)
+        cur = conn.execute(
+            f"UPDATE {AGG_TABLE} SET total_runs = ?, total_hallucinations = ?, avg_hallucination_score = ?, "
+            "total_cost_usd = ?, avg_latency_seconds = ? "
+            "WHERE day = ? AND experiment_variant_id IS ? AND model_id IS ?", (*values, *key)
+        )
+        if not cur.rowcount:
+            conn.execute(
+                f"INSERT INTO {AGG_TABLE} (day, experiment_variant_id, model_id, total_runs, total_hallucinations, "
+                "avg_hallucination_score, total_cost_usd, avg_latency_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, *values),
+            )
+
+def refresh(conn: sqlite3.Connection, batch_rows: int = BATCH_ROWS) -> Optional[Dict[str, Any]]:
+    """
+    Una pasada incremental dentro de la transacción de quien llama (no hace commit).
+    None si la BD no tiene las tablas de observabilidad.
+    """
+    if not {AGG_TABLE, 'llm_runs', 'hallucination_evaluations'} <= _tables(conn):
+        return None
+    for ddl in _DDL:
+        conn.execute(ddl)
+    marks = watermarks(conn)
+    touched: set = set()
+    runs, runs_last = _advance(conn, _RUNS_DELTA.format(stage=stage_expr(conn)), _RUNS_UPSERT, 'llm_runs', marks.get('llm_runs', 0), batch_rows, touched)
+    evals, evals_last = _advance(conn, _EVALS_DELTA, _EVALS_UPSERT, 'hallucination_evaluations',
+                                 marks.get('hallucination_evaluations', 0), batch_rows, touched)
+    _publish(conn, sorted(touched))
+    return {'runs': runs, 'evaluations': evals, 'keys': len(touched),
+            'watermarks': {'llm_runs': runs_last, 'hallucination_evaluations': evals_last},
+            'caught_up': runs < batch_rows and evals < batch_rows}
+
+def lag(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Filas aún sin agregar por fuente (MAX(id) sale del final del B-tree, no recorre la tabla)."""
+    marks = watermarks(conn)
+    out = {}
+    for source in ('llm_runs', 'hallucination_evaluations'):
+        top = conn.execute(f"SELECT IFNULL(MAX(id), 0) FROM {source}").fetchone()[0]
+        out[source] = max(0, top - marks.get(source, 0))
+    return out
+
+def read_daily(conn: sqlite3.Connection, date_from: Optional[str] = None, date_to: Optional[str] = None,
+               experiment_variant_id: Optional[int] = None, model_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    where, params = [], []
+    for cond, value in (("day >= ?", date_from), ("day <= ?", date_to),
+                        ("experiment_variant_id = ?", experiment_variant_id), ("model_id = ?", model_id)):
+        if value is not None:
+            where.append(cond)
+            params.append(value)
+    cur = conn.execute(
+        f"SELECT day, experiment_variant_id, model_id, total_runs, total_hallucinations, avg_hallucination_score, "
+        f"total_cost_usd, avg_latency_seconds FROM {AGG_TABLE}"
+        + (f" WHERE {' AND '.join(where)}" if where else "")
+        + " ORDER BY day, experiment_variant_id, model_id", params,
+    )
+    columns = [d[0] for d in cur.description]
+    return [dict(zip(columns, r)) for r in cur.fetchall()]
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Backfill/refresco de daily_run_aggregates desde la marca de agua.")
+    ap.add_argument("--db", required=True)
+    ap.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    args = ap.parse_args()
+    conn = sqlite3.connect(args.db)
+    t0 = time.perf_counter()
+    while True:
+        res = refresh(conn, args.batch_rows)
+        conn.commit()
+        if res is None:
+            raise SystemExit("La BD no tiene las tablas de observabilidad (seed.sql, sección 2)")
+        print(f"runs={res['runs']} evaluations={res['evaluations']} keys={res['keys']} watermarks={res['watermarks']}")
+        if res['caught_up']:
+            break
+    print(f"listo en {time.perf_counter() - t0:.2f}s")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# run_traces.py
+# parent_run_uuid y stage como columnas generadas (VIRTUAL) de llm_runs sobre context_json, con índice:
+# una traza completa (text2sql -> query -> ...) sale de una búsqueda por índice, sin json_extract fila a fila.
+# VIRTUAL no ocupa espacio en la tabla y ALTER TABLE la admite, así que las filas existentes quedan cubiertas
+# sin reescribirlas; el índice se rellena al crearlo.
+import json, sqlite3
+from typing import Any, Dict, List, Optional
+
+TRACE_COLUMNS = {
+    'parent_run_uuid': "json_extract(context_json, '$.parent_run_uuid')",
+    'stage': "json_extract(context_json, '$.stage')",
+}
+_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_llm_runs_parent_run_uuid ON llm_runs(parent_run_uuid)",
+    "CREATE INDEX IF NOT EXISTS idx_llm_runs_stage ON llm_runs(stage)",
+)
+
+def _columns(conn: sqlite3.Connection) -> set:
+    # table_xinfo: table_info no lista las columnas generadas.
+    return {r[1] for r in conn.execute("SELECT * FROM pragma_table_xinfo('llm_runs')")}
+
+def is_migrated(conn: sqlite3.Connection) -> bool:
+    return TRACE_COLUMNS.keys() <= _columns(conn)
+
+def migrate(conn: sqlite3.Connection) -> List[str]:
+    """Añade las columnas que falten y sus índices (idempotente; no hace commit). -> columnas añadidas."""
+    existing = _columns(conn)
+    if not existing:
+        return []
+    added = []
+    for name, expr in TRACE_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE llm_runs ADD COLUMN {name} TEXT GENERATED ALWAYS AS ({expr}) VIRTUAL")
+            added.append(name)
+    for ddl in _INDEXES:
+        conn.execute(ddl)
+    return added
+
+def stage_expr(conn: sqlite3.Connection) -> str:
+    """`stage` si la BD está migrada (usa el índice); si no, la expresión JSON equivalente."""
+    return 'stage' if 'stage' in _columns(conn) else TRACE_COLUMNS['stage']
+
+def load_trace(conn: sqlite3.Connection, parent_run_uuid: str) -> Optional[Dict[str, Any]]:
+    """
+    Runs con ese parent_run_uuid (orden de inserción) + sus métricas de calidad y tiempos por etapa.
+    None si no hay ninguno.
+    """
+    rows = conn.execute(
+        """
+        SELECT id, run_uuid, stage, question, answer, elapsed_seconds, created_at, context_json
+        FROM llm_runs WHERE parent_run_uuid = ? ORDER BY id
+        """,
+        (parent_run_uuid,),
+    ).fetchall()
+    if not rows:
+        return None
+    ids = [r[0] for r in rows]
+    metrics: Dict[int, Dict[str, float]] = {}
+    for run_id, name, value in conn.execute(
+        f"SELECT llm_run_id, metric_name, metric_value FROM quality_metrics "
+        f"WHERE llm_run_id IN ({', '.join('?' * len(ids))}) ORDER BY id", ids
+    ):
+        metrics.setdefault(run_id, {})[name] = value
+    runs: List[Dict[str, Any]] = []
+    stages: Dict[str, Dict[str, Any]] = {}
+    for run_id, run_uuid, stage, question, answer, elapsed, created_at, context_json in rows:
+        try:
+            ctx = json.loads(context_json or '{}')
+        except ValueError:
+            ctx = {}
+        runs.append({
+            'run_uuid': run_uuid, 'stage': stage, 'endpoint': ctx.get('endpoint'), 'question': question,
+            'answer': answer, 'elapsed_seconds': elapsed, 'created_at': created_at,
+            'sql': ctx.get('sql'), 'metrics': metrics.get(run_id, {}),
+        })
+        s = stages.setdefault(stage or 'unknown', {'runs': 0, 'elapsed_seconds': 0.0})
+        s['runs'] += 1
+        s['elapsed_seconds'] += float(elapsed or 0.0)
+    return {
+        'parent_run_uuid': parent_run_uuid,
+        'runs': runs,
+        'stages': stages,
+        'total_elapsed_seconds': sum(s['elapsed_seconds'] for s in stages.values()),
+        'started_at': runs[0]['created_at'],
+        'finished_at': runs[-1]['created_at'],
+    }
@@ -0,0 +1,136 @@
+# schema_retrieval.py
+# Selección de tablas relevantes para una pregunta (BM25 léxico, offline, sin embeddings).
+import math, re, unicodedata
+from collections import Counter
+from typing import Any, Dict, List
+
+from semantic_layer import derived_index, semantic_summary
+
+# Sinónimos ES/EN -> tokens que aparecen en nombres de tablas/columnas.
+# "ventas" = facturación (invoices) en este modelo; los pedidos son sales_orders.
+SYNONYMS: Dict[str, List[str]] = {
+    'venta': ['invoice', 'sale'], 'ventas': ['invoice', 'sale'], 'sales': ['invoice', 'sale'],
+    'factura': ['invoice'], 'facturacion': ['invoice'], 'ingreso': ['invoice', 'total'], 'revenue': ['invoice', 'total'],
+    'cliente': ['customer'], 'client': ['customer'],
+    'pais': ['country'], 'paises': ['country'], 'nation': ['country'],
+    'producto': ['product'], 'articulo': ['product'], 'item': ['product', 'item'], 'sku': ['product', 'sku'],
+    'categoria': ['category'], 'familia': ['category'],
+    'pedido': ['order', 'sale'], 'orden': ['order'],
+    'linea': ['item'], 'detalle': ['item'],
+    'almacen': ['warehouse'], 'stock': ['inventory', 'balance'], 'inventario': ['inventory'], 'existencia': ['inventory', 'balance'],
+    'movimiento': ['movement'],
+    'proveedor': ['supplier'], 'vendor': ['supplier'], 'compra': ['purchase'],
+    'pago': ['payment'], 'cobro': ['payment'],
+    'devolucion': ['return'], 'entrega': ['delivery'], 'envio': ['delivery', 'ship'], 'transportista': ['carrier'],
+    'precio': ['price'], 'tarifa': ['price'],
+    'direccion': ['address'], 'ciudad': ['city', 'address'],
+    'fecha': ['date'], 'dia': ['date', 'day'], 'mes': ['date'], 'month': ['date'], 'anio': ['date'], 'year': ['date'],
+    'importe': ['total', 'amount'], 'total': ['total', 'amount'], 'cantidad': ['quantity', 'qty'], 'unidades': ['quantity', 'qty'],
+    'estado': ['status'], 'moneda': ['currency'], 'impuesto': ['tax'], 'descuento': ['discount'],
+    'usuario': ['user'], 'equipo': ['team'], 'modelo': ['model'], 'proveedor_llm': ['provider'],
+    'experimento': ['experiment'], 'variante': ['variant'], 'prompt': ['prompt'],
+    'alucinacion': ['hallucination'], 'coste': ['cost'], 'costo': ['cost'], 'latencia': ['elapsed', 'latency'],
+    'token': ['token'], 'metrica': ['metric'], 'calidad': ['quality', 'metric'], 'etiqueta': ['tag'],
+}
+
+TABLE_NAME_WEIGHT = 3  # los tokens del nombre de tabla cuentan como 3 apariciones
+FULL_NAME_BOOST = 1.5  # la pregunta cubre todos los tokens del nombre de la tabla
+BM25_K1, BM25_B = 1.2, 0.75
+
+def _strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith('ies'): return token[:-3] + 'y'
+    if len(token) > 4 and token.endswith('es') and token[-3] in 'rnlsd': return token[:-2]
+    if len(token) > 3 and token.endswith('s'): return token[:-1]
+    return token
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(t) for t in re.split(r'[^a-z0-9]+', _strip_accents(text.lower())) if len(t) > 1]
+
+def _query_terms(question: str) -> List[str]:
+    terms: List[str] = []
+    for raw in re.split(r'[^a-z0-9]+', _strip_accents(question.lower())):
+        if len(raw) <= 1:
+            continue
+        terms.append(_stem(raw))
+        for syn in SYNONYMS.get(raw, SYNONYMS.get(_stem(raw), [])):
+            terms.append(_stem(syn))
+    return terms
+
+def build_schema_index(layer: Dict[str, Any]) -> Dict[str, Any]:
+    """Índice BM25 invertido (serializable a JSON): un documento por tabla con su nombre y sus columnas."""
+    schema = layer['schema']
+    postings: Dict[str, Dict[str, int]] = {}
+    lengths: Dict[str, int] = {}
+    for t in schema['tables']:
+        tf = Counter(tokenize(t) * TABLE_NAME_WEIGHT)
+        for c in schema['columns'].get(t, []):
+            tf.update(tokenize(c['name']))
+        lengths[t] = sum(tf.values())
+        for term, f in tf.items():
+            postings.setdefault(term, {})[t] = f
+    return {
+        'postings': postings,
+        'lengths': lengths,
+        'avgdl': (sum(lengths.values()) / len(lengths)) if lengths else 0.0,
+        'n_docs': len(lengths),
+    }
+
+def score_tables(index: Dict[str, Any], question: str) -> Dict[str, float]:
+    n, avgdl = index['n_docs'], index['avgdl'] or 1.0
+    terms = Counter(_query_terms(question))
+    scores: Dict[str, float] = {}
+    for term, qtf in terms.items():
+        docs = index['postings'].get(term)
+        if not docs:
+            continue
+        idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+        for t, f in docs.items():
+            norm = f * (BM25_K1 + 1) / (f + BM25_K1 * (1 - BM25_B + BM25_B * index['lengths'][t] / avgdl))
+            scores[t] = scores.get(t, 0.0) + qtf * idf * norm
+    for t in scores:
+        if all(tok in terms for tok in tokenize(t)):
+            scores[t] *= FULL_NAME_BOOST
+    return scores
+
+def select_schema_context(layer: Dict[str, Any], question: str, k: int = 5, max_tables: int = 12) -> Dict[str, Any]:
+    """
+    Top-k tablas para la pregunta + las tablas a las que referencian (aristas salientes del grafo),
+    con un resumen semántico restringido a ellas. Si nada puntúa, se usa la capa completa.
+    """
+    index = derived_index(layer, 'schema_bm25', build_schema_index)
+    scores = score_tables(index, question)
+    tables = layer['schema']['tables']
+    if not scores:
+        return {'tables': list(tables), 'scores': {}, 'summary': layer['summary'], 'fallback': True}
+
+    ranked = sorted(scores, key=lambda t: (-scores[t], t))[:k]
+    selected = list(ranked)
+    graph = layer['relationships'].get('graph', {})
+    for t in ranked:
+        for edge in graph.get(t, []):
+            if len(selected) >= max_tables:
+                break
+            if edge['direction'] == 'out' and edge['table'] not in selected:
+                selected.append(edge['table'])
+    return {
+        'tables': selected,
+        'scores': {t: round(scores[t], 3) for t in ranked},
+        'summary': focused_summary(layer, selected),
+        'fallback': False,
+    }
+
+def focused_summary(layer: Dict[str, Any], tables: List[str]) -> str:
+    keep = set(tables)
+    schema = layer['schema']
+    sub_schema = {'tables': [t for t in schema['tables'] if t in keep], 'columns': schema['columns']}
+    rels = []
+    for r in layer['relationships']['relationships']:
+        if r.get('type') == 'bridge_hint':
+            if r['bridge_table'] in keep:
+                rels.append(r)
+        elif r['from_table'] in keep and r['to_table'] in keep:
+            rels.append(r)
+    return semantic_summary(sub_schema, {'relationships': rels})
@@ -536,6 +536,9 @@ CREATE TABLE IF NOT EXISTS llm_runs (
     country_code            TEXT,
     context_json            TEXT,
     created_at              DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- Columnas generadas (run_traces.py): traza por parent_run_uuid y filtro por etapa sin json_extract por fila
+    parent_run_uuid         TEXT GENERATED ALWAYS AS (json_extract(context_json, '$.parent_run_uuid')) VIRTUAL,
+    stage                   TEXT GENERATED ALWAYS AS (json_extract(context_json, '$.stage')) VIRTUAL,
     FOREIGN KEY (experiment_variant_id) REFERENCES experiment_variants(id),
     FOREIGN KEY (prompt_id)               REFERENCES prompts(id),
     FOREIGN KEY (dataset_item_id)         REFERENCES dataset_items(id),
@@ -553,6 +556,12 @@ CREATE INDEX IF NOT EXISTS idx_llm_runs_experiment_variant
 CREATE INDEX IF NOT EXISTS idx_llm_runs_dataset_item
     ON llm_runs(dataset_item_id);
 
+CREATE INDEX IF NOT EXISTS idx_llm_runs_parent_run_uuid
+    ON llm_runs(parent_run_uuid);
+
+CREATE INDEX IF NOT EXISTS idx_llm_runs_stage
+    ON llm_runs(stage);
+
 ------------------------------------------------------------
 -- 2.6 Evaluaciones de alucinación y otras métricas
 ------------------------------------------------------------
@@ -626,6 +635,29 @@ CREATE TABLE IF NOT EXISTS daily_run_aggregates (
 CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_agg_unique
     ON daily_run_aggregates(day, experiment_variant_id, model_id);
 
+-- Estado interno del agregador incremental (run_aggregates.py): marcas de agua por tabla de origen
+-- y sumas/contadores por clave (0 = NULL en experiment_variant_id/model_id) para poder combinar medias.
+CREATE TABLE IF NOT EXISTS _daily_run_watermarks (
+    source      TEXT PRIMARY KEY,
+    last_id     INTEGER NOT NULL DEFAULT 0,
+    updated_at  DATETIME
+);
+
+CREATE TABLE IF NOT EXISTS _daily_run_sums (
+    day                     DATE NOT NULL,
+    experiment_variant_id   INTEGER NOT NULL,
+    model_id                INTEGER NOT NULL,
+    total_runs              INTEGER NOT NULL DEFAULT 0,
+    latency_n               INTEGER NOT NULL DEFAULT 0,
+    latency_sum             REAL NOT NULL DEFAULT 0,
+    cost_sum                REAL,
+    evaluations             INTEGER NOT NULL DEFAULT 0,
+    hallucinations          INTEGER NOT NULL DEFAULT 0,
+    score_n                 INTEGER NOT NULL DEFAULT 0,
+    score_sum               REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, experiment_variant_id, model_id)
+) WITHOUT ROWID;
+
 PRAGMA foreign_keys = ON;
 
 -- =========================================================
@@ -1,5 +1,5 @@
-import json, sqlite3
-from typing import Dict, List, Any
+import hashlib, json, os, sqlite3, threading
+from typing import Any, Callable, Dict, List, Tuple
 
 def _pluralize(name: str) -> str:
     if name.endswith('y'): return name[:-1] + 'ies'
@@ -11,45 +11,131 @@ def _singularize(name: str) -> str:
     if name.endswith('s'): return name[:-1]
     return name
 
+# Una sola sentencia: columnas (tablas y vistas), FKs e índices vía funciones PRAGMA tabla-valor.
+# Columnas genéricas c1..c8 para poder unir las tres formas. Cada función PRAGMA devuelve sus filas
+# contiguas y en orden natural (cid, id/seq, seq/seqno), así que basta ordenar los nombres en Python.
+# Las tablas con prefijo '_' son internas (p. ej. _table_versions de result_cache.py) y no forman parte de la capa.
+# {only} acota a un objeto (m.name = :name) cuando hay que introspeccionar de uno en uno.
+_INTROSPECTION_SQL = """
+SELECT m.type AS obj_type, m.name AS tbl, 'column' AS kind,
+       p.cid AS c1, p.name AS c2, p.type AS c3, p."notnull" AS c4, p.dflt_value AS c5, p.pk AS c6, NULL AS c7, NULL AS c8
+FROM sqlite_master m JOIN pragma_table_info(m.name) p
+WHERE m.type IN ('table', 'view') AND m.name NOT LIKE 'sqlite_%' AND m.name NOT LIKE '\\_%' ESCAPE '\\'{only}
+UNION ALL
+SELECT m.type, m.name, 'fk', f.id, f.seq, f."table", f."from", f."to", f.on_update, f.on_delete, f."match"
+FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND m.name NOT LIKE '\\_%' ESCAPE '\\'{only}
+UNION ALL
+SELECT m.type, m.name, 'index', il.seq, ii.seqno, il.name, il."unique", il.origin, il.partial, ii.name, NULL
+FROM sqlite_master m JOIN pragma_index_list(m.name) il JOIN pragma_index_info(il.name) ii
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND m.name NOT LIKE '\\_%' ESCAPE '\\'{only}
+"""
+_OBJECTS_SQL = ("SELECT type, name FROM sqlite_master WHERE type IN ('table', 'view') "
+                "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\' ORDER BY name")
+
+def _introspection_rows(conn: sqlite3.Connection) -> Tuple[List[Tuple[Any, ...]], List[Dict[str, str]]]:
+    """
+    (filas, objetos inválidos). Una vista rota (tabla o columna borrada) hace fallar pragma_table_info y con él
+    la sentencia entera: en ese caso se repite objeto a objeto y las que fallan se omiten y se informan.
+    """
+    try:
+        return conn.execute(_INTROSPECTION_SQL.format(only='')).fetchall(), []
+    except sqlite3.OperationalError:
+        pass
+    one = _INTROSPECTION_SQL.format(only=' AND m.name = :name')
+    rows: List[Tuple[Any, ...]] = []
+    invalid: List[Dict[str, str]] = []
+    for obj_type, name in conn.execute(_OBJECTS_SQL).fetchall():
+        try:
+            rows.extend(conn.execute(one, {'name': name}).fetchall())
+        except sqlite3.OperationalError as e:
+            invalid.append({'name': name, 'type': obj_type, 'error': str(e)})
+    return rows, invalid
+
 def inspect_schema(db_path: str) -> Dict[str, Any]:
-    conn = sqlite3.connect(db_path); conn.row_factory = sqlite3.Row; cur = conn.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
-    tables = [r['name'] for r in cur.fetchall()]
-    columns = {}; fks = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        rows, invalid = _introspection_rows(conn)
+    finally:
+        conn.close()
+    tables: List[str] = []; views: List[str] = []
+    columns: Dict[str, List[Dict[str, Any]]] = {}; fks: Dict[str, List[Dict[str, Any]]] = {}
+    indexes: Dict[str, List[Dict[str, Any]]] = {}
+    for obj_type, t, kind, c1, c2, c3, c4, c5, c6, c7, c8 in rows:
+        if t not in columns:
+            tables.append(t); columns[t] = []; fks[t] = []; indexes[t] = []
+            if obj_type == 'view': views.append(t)
+        if kind == 'column':
+            columns[t].append({'cid': c1, 'name': c2, 'type': c3, 'notnull': c4, 'dflt_value': c5, 'pk': c6})
+        elif kind == 'fk':
+            fks[t].append({'id': c1, 'seq': c2, 'table': c3, 'from': c4, 'to': c5, 'on_update': c6, 'on_delete': c7, 'match': c8})
+        elif not indexes[t] or indexes[t][-1]['name'] != c3:
+            indexes[t].append({'name': c3, 'unique': c4, 'origin': c5, 'partial': c6, 'columns': [c7]})
+        else:
+            indexes[t][-1]['columns'].append(c7)
+    tables.sort(); views.sort()
+    schema = {'tables': tables, 'views': views, 'columns': columns, 'foreign_keys': fks, 'indexes': indexes}
+    if invalid:
+        schema['invalid'] = invalid
+    return schema
+
+def _table_lookup(tables: List[str]) -> Dict[str, List[str]]:
+    """Índice forma (tal cual / plural / singular) -> tablas, para resolver `*_id` sin recorrer todo el esquema."""
+    lookup: Dict[str, List[str]] = {}
     for t in tables:
-        cur.execute(f"PRAGMA table_info('{t}')"); columns[t] = [dict(r) for r in cur.fetchall()]
-        cur.execute(f"PRAGMA foreign_key_list('{t}')"); fks[t] = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return {'tables': tables, 'columns': columns, 'foreign_keys': fks}
+        for key in {t, _pluralize(t), _singularize(t)}:
+            lookup.setdefault(key, []).append(t)
+    return lookup
+
+def relationship_graph(tables: List[str], relationships: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Grafo de adyacencia no dirigido: tabla -> [{table, column, ref_column, type, direction}].
+    Cada arista se lee como `JOIN <table> ON <origen>.<column> = <table>.<ref_column>`.
+    """
+    graph: Dict[str, List[Dict[str, Any]]] = {t: [] for t in tables}
+    for r in relationships:
+        if r.get('type') == 'bridge_hint':
+            continue
+        src, dst = r['from_table'], r['to_table']
+        graph.setdefault(src, []).append({'table': dst, 'column': r['from_column'], 'ref_column': r['to_column'], 'type': r['type'], 'direction': 'out'})
+        graph.setdefault(dst, []).append({'table': src, 'column': r['to_column'], 'ref_column': r['from_column'], 'type': r['type'], 'direction': 'in'})
+    return graph
 
 def infer_relationships(schema: Dict[str, Any]) -> Dict[str, Any]:
     tables, columns, fks = schema['tables'], schema['columns'], schema['foreign_keys']
     relationships: List[Dict[str, Any]] = []
+    seen = set()
     for src, fk_list in fks.items():
         for fk in fk_list:
             dst = fk.get('table'); frm = fk.get('from'); to = fk.get('to') or 'id'
-            if dst: relationships.append({'type':'fk','from_table':src,'from_column':frm,'to_table':dst,'to_column':to})
+            if dst:
+                relationships.append({'type':'fk','from_table':src,'from_column':frm,'to_table':dst,'to_column':to})
+                seen.add((src, frm, dst))
+    lookup = _table_lookup(tables)
+    position = {t: i for i, t in enumerate(tables)}
     for t in tables:
         for col in columns[t]:
             name = col['name']
             if name.endswith('_id') and name != 'id':
                 cand = name[:-3]
-                cands = {cand, _pluralize(cand), _singularize(cand)}
-                for other in tables:
-                    if other in cands or _singularize(other) in cands or _pluralize(other) in cands:
-                        if not any(r for r in relationships if r['from_table']==t and r['to_table']==other and r['from_column']==name):
-                            relationships.append({'type':'heuristic_id','from_table':t,'from_column':name,'to_table':other,'to_column':'id'})
+                matches = {other for c in {cand, _pluralize(cand), _singularize(cand)} for other in lookup.get(c, ())}
+                for other in sorted(matches, key=position.__getitem__):
+                    if (t, name, other) not in seen:
+                        seen.add((t, name, other))
+                        relationships.append({'type':'heuristic_id','from_table':t,'from_column':name,'to_table':other,'to_column':'id'})
     for t in tables:
         targets = {r['table'] for r in fks.get(t, [])}
         if len(targets) >= 2 and all(c['name'].endswith('_id') for c in columns[t] if c['name'].endswith('_id')):
-            relationships.append({'type':'bridge_hint','bridge_table':t,'connects':list(targets)[:2]})
-    return {'relationships': relationships}
+            relationships.append({'type':'bridge_hint','bridge_table':t,'connects':sorted(targets)[:2]})
+    return {'relationships': relationships, 'graph': relationship_graph(tables, relationships)}
 
 def semantic_summary(schema: Dict[str, Any], rels: Dict[str, Any]) -> str:
     lines = ['Tablas: ' + ', '.join(schema['tables'])]
+    views = set(schema.get('views', ()))
     for t in schema['tables']:
         cols = [c['name'] for c in schema['columns'][t]]
-        lines.append(f" - {t}: columnas = {', '.join(cols)}")
+        kind = ' (vista)' if t in views else ''
+        lines.append(f" - {t}{kind}: columnas = {', '.join(cols)}")
     if rels['relationships']:
         lines.append('Relaciones inferidas:')
         for r in rels['relationships']:
@@ -62,3 +148,190 @@ def semantic_summary(schema: Dict[str, Any], rels: Dict[str, Any]) -> str:
 def build_semantic_layer(db_path: str) -> Dict[str, Any]:
     schema = inspect_schema(db_path); rels = infer_relationships(schema); summary = semantic_summary(schema, rels)
     return {'schema': schema, 'relationships': rels, 'summary': summary}
+
+
+# -------------------------
+# Caché de proceso por huella de esquema
+# -------------------------
+_CACHE_LOCK = threading.Lock()
+_LAYER_CACHE: Dict[str, Dict[str, Any]] = {}
+# ruta -> {'conn', 'stat': (inodo, dispositivo), 'version', 'fingerprint', 'lock'}
+_FINGERPRINT_CONNS: Dict[str, Dict[str, Any]] = {}
+_CACHE_STATS = {'hits': 0, 'misses': 0, 'rebuilds': 0, 'snapshot_loads': 0, 'snapshot_saves': 0}
+
+# Snapshot en disco junto a la BD (<db>.semantic.json) para arrancar en frío sin introspección.
+SNAPSHOT_FORMAT = 2  # 2: la huella incluye el hash del DDL
+SNAPSHOTS_ENABLED = os.getenv('SEMANTIC_SNAPSHOTS', '1') != '0'
+SNAPSHOT_INDEXES = ('schema_bm25',)  # índices derivados (JSON) que se persisten con la capa
+
+def _file_stat(path: str) -> Any:
+    """
+    Identidad del fichero (inodo, dispositivo). Sin mtime: cambia con cada escritura o checkpoint del WAL.
+    Mientras la conexión cacheada tenga abierto el fichero viejo, su inodo no se reutiliza.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_dev)
+
+def _ddl_hash(conn: sqlite3.Connection) -> str:
+    ddl = conn.execute(
+        "SELECT group_concat(type || ' ' || name || ' ' || IFNULL(sql, ''), char(10)) "
+        "FROM (SELECT type, name, sql FROM sqlite_master ORDER BY type, name)"
+    ).fetchone()[0]
+    return hashlib.sha1((ddl or '').encode('utf-8')).hexdigest()[:16]
+
+def _close_fingerprint_conn(entry: Dict[str, Any]) -> None:
+    with entry['lock']:
+        if entry['conn'] is not None:
+            entry['conn'].close()
+            entry['conn'] = None
+
+def schema_fingerprint(db_path: str) -> str:
+    """
+    Huella del esquema: ruta absoluta + PRAGMA schema_version + hash del DDL (sqlite_master).
+    schema_version solo cuenta DDLs: una BD recreada con otro esquema y el mismo número de DDLs repetiría huella.
+    El hash se recalcula solo si cambia schema_version (DDL) o el fichero se reemplaza (os.stat: inodo); en ese caso
+    también se reabre la conexión, que si no seguiría leyendo el fichero viejo. Las escrituras de datos no cambian nada.
+    _CACHE_LOCK solo protege el diccionario; la consulta va bajo el lock de su ruta.
+    """
+    path = os.path.abspath(db_path)
+    stat = _file_stat(path)
+    with _CACHE_LOCK:
+        entry = _FINGERPRINT_CONNS.get(path)
+        if entry is not None and entry['stat'] != stat:
+            del _FINGERPRINT_CONNS[path]
+            _close_fingerprint_conn(entry)
+            entry = None
+        if entry is None:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            entry = _FINGERPRINT_CONNS[path] = {'conn': conn, 'stat': stat, 'version': None, 'fingerprint': None,
+                                                'lock': threading.Lock()}
+    with entry['lock']:
+        if entry['conn'] is None:  # otro hilo vio el fichero reemplazado y la cerró
+            return schema_fingerprint(db_path)
+        version = entry['conn'].execute('PRAGMA schema_version').fetchone()[0]
+        if version != entry['version']:
+            entry['version'] = version
+            entry['fingerprint'] = f"{path}@{version}.{_ddl_hash(entry['conn'])}"
+        return entry['fingerprint']
+
+def snapshot_path(db_path: str) -> str:
+    return os.path.abspath(db_path) + '.semantic.json'
+
+def load_snapshot(db_path: str) -> bool:
+    """
+    Carga el snapshot en la caché sin tocar la BD. La validación es perezosa: la primera llamada a
+    get_semantic_layer compara su huella (schema_version + hash del DDL) con la actual y lo descarta si no coincide.
+    """
+    path = os.path.abspath(db_path)
+    if not SNAPSHOTS_ENABLED:
+        return False
+    try:
+        with open(snapshot_path(path), encoding='utf-8') as f:
+            snap = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(snap, dict) or snap.get('format') != SNAPSHOT_FORMAT:
+        return False
+    fingerprint = snap.get('fingerprint')
+    if not isinstance(fingerprint, str) or fingerprint.rsplit('@', 1)[0] != path:
+        return False
+    # Snapshot truncado o ajeno (de otra versión o editado a mano): se trata como si no hubiera snapshot.
+    layer, derived = snap.get('layer'), snap.get('derived') or {}
+    if not isinstance(layer, dict) or not isinstance(layer.get('schema'), dict) or not isinstance(derived, dict):
+        return False
+    layer['fingerprint'] = fingerprint
+    with _CACHE_LOCK:
+        if path in _LAYER_CACHE:
+            return False
+        _LAYER_CACHE[path] = {'fingerprint': fingerprint, 'layer': layer, 'derived': dict(derived)}
+        _CACHE_STATS['snapshot_loads'] += 1
+    return True
+
+def save_snapshot(db_path: str) -> bool:
+    """Escribe (de forma atómica) la capa cacheada y sus índices persistibles; best-effort."""
+    path = os.path.abspath(db_path)
+    if not SNAPSHOTS_ENABLED:
+        return False
+    with _CACHE_LOCK:
+        entry = _LAYER_CACHE.get(path)
+        if entry is None:
+            return False
+        snap = {
+            'format': SNAPSHOT_FORMAT,
+            'fingerprint': entry['fingerprint'],
+            'layer': {k: v for k, v in entry['layer'].items() if k != 'fingerprint'},
+            'derived': {k: v for k, v in entry['derived'].items() if k in SNAPSHOT_INDEXES},
+        }
+    target = snapshot_path(path)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(snap, f, ensure_ascii=False)
+        os.replace(tmp, target)
+    except (OSError, TypeError, ValueError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    with _CACHE_LOCK:
+        _CACHE_STATS['snapshot_saves'] += 1
+    return True
+
+def get_semantic_layer(db_path: str) -> Dict[str, Any]:
+    """
+    Devuelve la capa semántica cacheada para db_path; solo se reconstruye si cambia el DDL.
+    El dict devuelto es compartido entre peticiones: tratarlo como solo lectura.
+    """
+    path = os.path.abspath(db_path)
+    fingerprint = schema_fingerprint(path)
+    if path not in _LAYER_CACHE:
+        load_snapshot(path)
+    with _CACHE_LOCK:
+        entry = _LAYER_CACHE.get(path)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            _CACHE_STATS['hits'] += 1
+            return entry['layer']
+        _CACHE_STATS['rebuilds' if entry is not None else 'misses'] += 1
+    layer = build_semantic_layer(path)
+    layer['fingerprint'] = fingerprint
+    with _CACHE_LOCK:
+        _LAYER_CACHE[path] = {'fingerprint': fingerprint, 'layer': layer, 'derived': {}}
+    save_snapshot(path)
+    return layer
+
+def derived_index(layer: Dict[str, Any], name: str, builder: Callable[[Dict[str, Any]], Any]) -> Any:
+    """
+    Estructura derivada de la capa (índice de búsqueda, rutas de join...) cacheada junto a ella;
+    se descarta automáticamente cuando la capa se reconstruye.
+    """
+    fingerprint = layer.get('fingerprint')
+    with _CACHE_LOCK:
+        entry = _LAYER_CACHE.get(fingerprint.rsplit('@', 1)[0]) if fingerprint else None
+        if entry is None or entry['fingerprint'] != fingerprint:
+            entry = None
+        elif name in entry['derived']:
+            return entry['derived'][name]
+    value = builder(layer)
+    if entry is not None:
+        with _CACHE_LOCK:
+            entry['derived'][name] = value
+        if name in SNAPSHOT_INDEXES:
+            save_snapshot(fingerprint.rsplit('@', 1)[0])
+    return value
+
+def semantic_cache_stats() -> Dict[str, Any]:
+    with _CACHE_LOCK:
+        return {**_CACHE_STATS, 'entries': {p: e['fingerprint'] for p, e in _LAYER_CACHE.items()}}
+
+def clear_semantic_cache() -> None:
+    with _CACHE_LOCK:
+        _LAYER_CACHE.clear()
+        for entry in _FINGERPRINT_CONNS.values():
+            _close_fingerprint_conn(entry)
+        _FINGERPRINT_CONNS.clear()
+        for k in _CACHE_STATS:
+            _CACHE_STATS[k] = 0
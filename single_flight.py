@@ -0,0 +1,31 @@
+# single_flight.py
+# Coalescencia de llamadas idénticas en vuelo: la primera petición ejecuta, las demás esperan el mismo resultado.
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+class SingleFlight:
+    """
+    Una tarea por clave mientras está en vuelo. Los que llegan después esperan esa misma tarea
+    (con shield: si un cliente se desconecta no se cancela la llamada compartida).
+    Al terminar la clave se libera, así que no es una caché: solo deduplica lo simultáneo.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.stats = {'leaders': 0, 'followers': 0}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(resultado, compartido). compartido=True si se reutilizó una llamada ya en vuelo."""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key) if self._inflight.get(key) is t else None)
+            self.stats['leaders'] += 1
+        else:
+            self.stats['followers'] += 1
+        return await asyncio.shield(task), shared
+
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, 'inflight': len(self._inflight)}
@@ -0,0 +1,139 @@
+# sql_guard.py
+# Validación de SQL de solo lectura con el propio SQLite, sin listas de palabras:
+#   1) sqlite3.complete_statement separa sentencias (los ';' dentro de literales o comentarios no cuentan);
+#   2) EXPLAIN <sql> prepara la sentencia sin ejecutarla, con un authorizer que solo permite leer.
+# `SELECT created_at, updated_at ...` o `WHERE notes = 'drop; delete'` pasan; `WITH x AS (...) DELETE ...` no.
+# Los veredictos se memorizan por (texto SQL, huella de esquema).
+import re, sqlite3, threading
+from collections import OrderedDict
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+# Acciones del authorizer permitidas en una consulta de lectura.
+_ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+_DENIED_FUNCTIONS = {'load_extension', 'readfile', 'writefile', 'edit', 'fts3_tokenizer'}
+_ACTION_NAMES = {
+    getattr(sqlite3, n): n[len('SQLITE_'):].lower()
+    for n in ('SQLITE_INSERT', 'SQLITE_UPDATE', 'SQLITE_DELETE', 'SQLITE_CREATE_TABLE', 'SQLITE_CREATE_INDEX',
+              'SQLITE_CREATE_VIEW', 'SQLITE_CREATE_TRIGGER', 'SQLITE_CREATE_TEMP_TABLE', 'SQLITE_CREATE_TEMP_INDEX',
+              'SQLITE_CREATE_TEMP_VIEW', 'SQLITE_CREATE_TEMP_TRIGGER', 'SQLITE_CREATE_VTABLE', 'SQLITE_DROP_TABLE',
+              'SQLITE_DROP_INDEX', 'SQLITE_DROP_VIEW', 'SQLITE_DROP_TRIGGER', 'SQLITE_DROP_TEMP_TABLE',
+              'SQLITE_DROP_TEMP_INDEX', 'SQLITE_DROP_TEMP_VIEW', 'SQLITE_DROP_TEMP_TRIGGER', 'SQLITE_DROP_VTABLE',
+              'SQLITE_ALTER_TABLE', 'SQLITE_PRAGMA', 'SQLITE_ATTACH', 'SQLITE_DETACH', 'SQLITE_TRANSACTION',
+              'SQLITE_SAVEPOINT', 'SQLITE_ANALYZE', 'SQLITE_REINDEX', 'SQLITE_FUNCTION')
+    if hasattr(sqlite3, n)
+}
+_STRIP_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\])|--[^\n]*|/\*.*?(?:\*/|$)", re.DOTALL)
+
+class SQLRejected(ValueError):
+    """reason: empty | multiple_statements | not_read_only | invalid_sql."""
+
+    def __init__(self, reason: str, detail: str):
+        super().__init__(detail)
+        self.reason = reason
+        self.detail = detail
+
+class NullParams(dict):
+    """Los params que falten se enlazan como NULL: para preparar/planificar no hacen falta valores reales."""
+
+    def __missing__(self, key):
+        return None
+
+def _is_blank(fragment: str) -> bool:
+    """Solo espacios, comentarios o ';' (los literales se conservan, así que no cuentan como vacío)."""
+    return not _STRIP_RE.sub(lambda m: m.group(1) or '', fragment).strip().strip(';').strip()
+
+def split_statements(sql: str) -> List[str]:
+    """Sentencias de `sql` según sqlite3.complete_statement, sin las vacías ni el ';' final."""
+    statements: List[str] = []
+    start = 0
+    for i, ch in enumerate(sql):
+        if ch == ';' and sqlite3.complete_statement(sql[start:i + 1]):
+            statements.append(sql[start:i])
+            start = i + 1
+    statements.append(sql[start:])
+    return [s.strip() for s in statements if not _is_blank(s)]
+
+def validate(conn: sqlite3.Connection, sql: str) -> Dict[str, Any]:
+    """
+    Prepara `EXPLAIN <sql>` con un authorizer de solo lectura (no ejecuta la consulta).
+    Devuelve {'tables': [...], 'functions': [...]} o lanza SQLRejected.
+    """
+    statements = split_statements(sql or '')
+    if not statements:
+        raise SQLRejected('empty', "SQL vacío")
+    if len(statements) > 1:
+        raise SQLRejected('multiple_statements', "Múltiples sentencias (bloqueado)")
+    denied: List[str] = []
+    tables: set = set()
+    functions: set = set()
+    selects = [0]
+
+    def authorizer(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_FUNCTION:
+            name = (arg2 or '').lower()
+            functions.add(name)
+            if name in _DENIED_FUNCTIONS:
+                denied.append(f"function:{name}")
+                return sqlite3.SQLITE_DENY
+            return sqlite3.SQLITE_OK
+        if action in _ALLOWED_ACTIONS:
+            if action == sqlite3.SQLITE_READ and arg1:
+                tables.add(arg1)
+            elif action == sqlite3.SQLITE_SELECT:
+                selects[0] += 1
+            return sqlite3.SQLITE_OK
+        denied.append(_ACTION_NAMES.get(action, str(action)) + (f":{arg1}" if arg1 else ''))
+        return sqlite3.SQLITE_DENY
+
+    conn.set_authorizer(authorizer)
+    try:
+        conn.execute(f"EXPLAIN {statements[0]}", NullParams())
+    except sqlite3.Error as e:
+        if denied:
+            raise SQLRejected('not_read_only', f"Solo lectura: {', '.join(sorted(set(denied)))} (bloqueado)")
+        raise SQLRejected('invalid_sql', f"SQL inválido: {e}")
+    finally:
+        conn.set_authorizer(None)
+    if not selects[0]:  # VACUUM y similares no pasan por el authorizer
+        raise SQLRejected('not_read_only', "Solo SELECT/CTE")
+    return {'tables': sorted(tables), 'functions': sorted(functions)}
+
+class SQLGuard:
+    """
+    Veredictos LRU (aceptados y rechazados) por (texto SQL, huella de esquema); la conexión solo se pide en un fallo.
+    La clave es el texto exacto: normalizar espacios uniría `-- x\n; DROP ...` con `-- x ; DROP ...`.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Optional[Dict[str, Any]], Optional[SQLRejected]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'rejected': 0}
+
+    def check(self, sql: str, fingerprint: str, connect: Callable[[], ContextManager[sqlite3.Connection]]) -> Dict[str, Any]:
+        key = ((sql or '').strip(), fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+        if entry is None:
+            try:
+                with connect() as conn:
+                    entry = (validate(conn, sql), None)
+            except SQLRejected as e:
+                entry = (None, e)
+            with self._lock:
+                self.stats['misses'] += 1
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        if entry[1] is not None:
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise SQLRejected(entry[1].reason, entry[1].detail)
+        return entry[0]
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'entries': len(self._entries), 'max_entries': self.max_entries}
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plantillas SQL parametrizadas para preguntas que solo cambian en un literal
+("ventas en ES en marzo de 2025" / "ventas en FR en abril de 2025").
+
+Se extraen slots (país, fecha, mes, año, estado) de la pregunta, se sustituyen los literales
+correspondientes del SQL por parámetros con nombre y se guarda el esqueleto de la pregunta.
+Una pregunta nueva con el mismo esqueleto (solo pueden cambiar palabras vacías: artículos, "de", "en"...)
+reutiliza el SQL sin llamar al LLM. Un esqueleto "parecido" no basta: "ventas no en {country}" o
+"ventas medias en {country}" piden otro SQL.
+
+    python sql_templates.py --db db.sqlite          # bootstrap desde llm_runs
+"""
+
+import argparse, json, re, sqlite3, threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from run_traces import stage_expr
+from text2sql_cache import normalize_question
+
+COUNTRY_CODES = {
+    'ES', 'FR', 'DE', 'IT', 'PT', 'GB', 'US', 'NL', 'BE', 'IE', 'AT', 'CH', 'SE', 'NO', 'DK', 'FI', 'PL',
+    'MX', 'AR', 'CL', 'CO', 'PE', 'BR', 'CA',
+}
+COUNTRY_NAMES = {
+    'espana': 'ES', 'spain': 'ES', 'francia': 'FR', 'france': 'FR', 'alemania': 'DE', 'germany': 'DE',
+    'italia': 'IT', 'italy': 'IT', 'portugal': 'PT', 'reino unido': 'GB', 'united kingdom': 'GB', 'uk': 'GB',
+    'estados unidos': 'US', 'united states': 'US', 'eeuu': 'US', 'usa': 'US', 'holanda': 'NL', 'paises bajos': 'NL',
+    'netherlands': 'NL', 'belgica': 'BE', 'belgium': 'BE', 'irlanda': 'IE', 'ireland': 'IE', 'mexico': 'MX',
+}
+MONTHS = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
+    'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7, 'august': 8,
+    'september': 9, 'october': 10, 'november': 11, 'december': 12,
+}
+STATUSES = {
+    'abierto': 'open', 'abiertos': 'open', 'abierta': 'open', 'abiertas': 'open', 'open': 'open',
+    'pagada': 'paid', 'pagadas': 'paid', 'pagado': 'paid', 'pagados': 'paid', 'paid': 'paid',
+    'cancelado': 'cancelled', 'cancelados': 'cancelled', 'cancelada': 'cancelled', 'canceladas': 'cancelled', 'cancelled': 'cancelled',
+    'parcial': 'partial', 'parciales': 'partial', 'partial': 'partial',
+    'enviado': 'shipped', 'enviados': 'shipped', 'shipped': 'shipped',
+    'entregado': 'delivered', 'entregados': 'delivered', 'delivered': 'delivered',
+}
+
+_SENTINEL_RE = re.compile(r"__(country|date|month|monthnum|year|status)_([a-z0-9]+)__")
+
+def _alternation(words) -> str:
+    return '|'.join(sorted((re.escape(w) for w in words), key=len, reverse=True))
+
+# Palabras que pueden diferir entre dos preguntas con la misma plantilla.
+STOPWORDS = frozenset({'de', 'del', 'el', 'la', 'los', 'las', 'en', 'a', 'al', 'the', 'of', 'in', 'for', 'para'})
+
+# Código de país: dos mayúsculas sueltas (no dentro de 'SO-ES-1'), y solo si la pregunta no está toda en
+# mayúsculas ("VENTAS DE ES": 'DE' es la preposición, no Alemania).
+_COUNTRY_CODE_RE = re.compile(r"(?<![\w-])([A-Z]{2})(?![\w-])")
+_COUNTRY_NAME_RE = re.compile(rf"\b({_alternation(COUNTRY_NAMES)})\b")
+_MONTH_RE = re.compile(rf"\b({_alternation(MONTHS)})(?:\s+(?:de|del|of))?(?:\s+((?:19|20)\d{{2}}))?\b")
+_YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+_STATUS_RE = re.compile(rf"\b({_alternation(STATUSES)})\b")
+# Meses que también son palabras comunes: solo cuentan junto a un año o un día ("may 2025", "5 may").
+_AMBIGUOUS_MONTHS = {'may'}
+_DAY_BEFORE_RE = re.compile(r"\b(?:[12]?\d|3[01])(?:\s+(?:de|of))?\s+$")
+_DAY_AFTER_RE = re.compile(r"^\s+(?:[12]?\d|3[01])\b")
+
+def _month_slot(m: re.Match) -> str:
+    if m[2]:
+        return f"__month_{m[2]}{MONTHS[m[1]]:02d}__"
+    if m[1] in _AMBIGUOUS_MONTHS and not (_DAY_BEFORE_RE.search(m.string[:m.start()]) or _DAY_AFTER_RE.match(m.string[m.end():])):
+        return m[0]
+    return f"__monthnum_{MONTHS[m[1]]:02d}__"
+
+def extract_slots(question: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    -> (esqueleto, [(slot, valor)]). Ej.: 'Ventas en ES en marzo de 2025' ->
+       ('ventas en {country} en {month}', [('country', 'ES'), ('month', '2025-03')]).
+    Slots repetidos se numeran: country, country_2...
+    """
+    text = question or ''
+    # Fase 1 (texto original): fechas ISO y códigos de país en mayúsculas
+    text = re.sub(r"\b(\d{4})-(\d{2})-(\d{2})\b", lambda m: f" __date_{m[1]}{m[2]}{m[3]}__ ", text)
+    text = re.sub(r"\b(\d{4})-(\d{2})\b", lambda m: f" __month_{m[1]}{m[2]}__ ", text)
+    if re.search(r"[a-z]", text):
+        text = _COUNTRY_CODE_RE.sub(lambda m: f" __country_{m[1].lower()}__ " if m[1] in COUNTRY_CODES else m[0], text)
+    # Fase 2 (normalizado): nombres de país, meses, años y estados
+    text = normalize_question(text)
+    text = _COUNTRY_NAME_RE.sub(lambda m: f"__country_{COUNTRY_NAMES[m[1]].lower()}__", text)
+    text = _MONTH_RE.sub(_month_slot, text)
+    text = _YEAR_RE.sub(lambda m: f"__year_{m[1]}__", text)
+    text = _STATUS_RE.sub(lambda m: f"__status_{STATUSES[m[1]]}__", text)
+
+    slots: List[Tuple[str, str]] = []
+    counts: Dict[str, int] = {}
+
+    def _slot(m: re.Match) -> str:
+        kind, raw = m[1], m[2]
+        counts[kind] = counts.get(kind, 0) + 1
+        name = kind if counts[kind] == 1 else f"{kind}_{counts[kind]}"
+        if kind == 'country':
+            value = raw.upper()
+        elif kind == 'date':
+            value = f"{raw[:4]}-{raw[4:6]}-{raw[6:]}"
+        elif kind == 'month':
+            value = f"{raw[:4]}-{raw[4:]}"
+        else:
+            value = raw
+        slots.append((name, value))
+        return '{' + name + '}'
+
+    skeleton = re.sub(r"\s+", " ", _SENTINEL_RE.sub(_slot, text)).strip()
+    return skeleton, slots
+
+def parameterize(sql: str, params: Dict[str, Any], slots: List[Tuple[str, str]]) -> Optional[Tuple[str, Dict[str, Any], Dict[str, str]]]:
+    """
+    Sustituye en el SQL el literal de cada slot por `:slot` (o reutiliza el parámetro que ya lo lleva).
+    -> (sql, params fijos, slot -> nombre de parámetro), o None si algún slot no se localiza sin ambigüedad.
+    """
+    fixed = dict(params or {})
+    mapping: Dict[str, str] = {}
+    for name, value in slots:
+        bound = [k for k, v in fixed.items() if isinstance(v, str) and v == value]
+        literal = f"'{value}'"
+        n_literals = sql.count(literal)
+        if len(bound) == 1 and n_literals == 0:
+            mapping[name] = bound[0]
+            fixed.pop(bound[0])
+        elif not bound and n_literals == 1 and name not in fixed:
+            sql = sql.replace(literal, f":{name}")
+            mapping[name] = name
+        else:
+            return None
+    return sql, fixed, mapping
+
+def _tokens(skeleton: str) -> frozenset:
+    return frozenset(skeleton.split())
+
+def core_skeleton(skeleton: str) -> str:
+    """Esqueleto sin palabras vacías, en orden: dos preguntas usan la misma plantilla solo si coincide."""
+    return ' '.join(t for t in skeleton.split() if t not in STOPWORDS)
+
+class TemplateStore:
+    """
+    Plantillas persistidas en SQLite + índice en memoria (esqueleto sin palabras vacías) por huella de esquema.
+    Al ver una huella nueva se borran las plantillas de las demás (como la poda de Text2SQLCache): su SQL es de un
+    esquema que ya no existe y nunca volverían a casar.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded: Dict[str, Dict[str, Any]] = {}
+        self._pruned_for: Optional[str] = None
+        self.stats = {'matches': 0, 'misses': 0, 'learned': 0, 'pruned': 0}
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sql_templates (
+                id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                fingerprint     TEXT NOT NULL,
+                skeleton        TEXT NOT NULL,
+                slots           TEXT NOT NULL,
+                sql             TEXT NOT NULL,
+                params          TEXT NOT NULL,
+                param_map       TEXT NOT NULL,
+                notes           TEXT,
+                source_run_uuid TEXT,
+                uses            INTEGER NOT NULL DEFAULT 0,
+                created_at      DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (fingerprint, skeleton)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _index(self, fingerprint: str) -> Dict[str, Any]:
+        if fingerprint != self._pruned_for:
+            self._prune(fingerprint)
+            self._conn.commit()
+        idx = self._loaded.get(fingerprint)
+        if idx is None:
+            idx = {'templates': {}, 'by_core': {}}
+            rows = self._conn.execute(
+                "SELECT id, skeleton, slots, sql, params, param_map, notes FROM sql_templates WHERE fingerprint=?",
+                (fingerprint,),
+            ).fetchall()
+            for row in rows:
+                self._add_to_index(idx, {
+                    'id': row[0], 'skeleton': row[1], 'slots': json.loads(row[2]), 'sql': row[3],
+                    'params': json.loads(row[4]), 'param_map': json.loads(row[5]), 'notes': row[6] or '',
+                })
+            self._loaded[fingerprint] = idx
+        return idx
+
+    @staticmethod
+    def _add_to_index(idx: Dict[str, Any], tpl: Dict[str, Any]) -> None:
+        tpl['tokens'] = _tokens(tpl['skeleton'])
+        idx['templates'][tpl['skeleton']] = tpl
+        idx['by_core'].setdefault(core_skeleton(tpl['skeleton']), []).append(tpl)
+
+    def learn(self, question: str, sql: str, params: Dict[str, Any], notes: str, fingerprint: str,
+              run_uuid: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        skeleton, slots = extract_slots(question)
+        if not slots:
+            return None
+        parameterized = parameterize(sql, params, slots)
+        if parameterized is None:
+            return None
+        tpl_sql, fixed, mapping = parameterized
+        names = [n for n, _ in slots]
+        with self._lock:
+            if fingerprint != self._pruned_for:
+                self._prune(fingerprint)
+            cur = self._conn.execute(
+                """
+                INSERT INTO sql_templates (fingerprint, skeleton, slots, sql, params, param_map, notes, source_run_uuid)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(fingerprint, skeleton) DO NOTHING
+                """,
+                (fingerprint, skeleton, json.dumps(names), tpl_sql, json.dumps(fixed, ensure_ascii=False),
+                 json.dumps(mapping), notes, run_uuid),
+            )
+            self._conn.commit()
+            if not cur.rowcount:
+                return None
+            tpl = {'id': cur.lastrowid, 'skeleton': skeleton, 'slots': names, 'sql': tpl_sql,
+                   'params': fixed, 'param_map': mapping, 'notes': notes}
+            if fingerprint in self._loaded:
+                self._add_to_index(self._loaded[fingerprint], tpl)
+            self.stats['learned'] += 1
+        return tpl
+
+    def match(self, question: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Plantilla con los mismos slots y el mismo esqueleto salvo palabras vacías, ya rellenada.
+        similarity (Jaccard del esqueleto completo) es informativa: desempata entre variantes de palabras vacías.
+        """
+        skeleton, slots = extract_slots(question)
+        if not slots:
+            return None
+        names = [n for n, _ in slots]
+        tokens = _tokens(skeleton)
+        best, best_sim = None, 0.0
+        with self._lock:
+            idx = self._index(fingerprint)
+            for tpl in idx['by_core'].get(core_skeleton(skeleton), ()):
+                if tpl['slots'] != names:
+                    continue
+                sim = len(tokens & tpl['tokens']) / len(tokens | tpl['tokens'])
+                if best is None or sim > best_sim:
+                    best, best_sim = tpl, sim
+            if best is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['matches'] += 1
+            self._conn.execute("UPDATE sql_templates SET uses = uses + 1 WHERE id=?", (best['id'],))
+            self._conn.commit()
+        params = dict(best['params'])
+        for name, value in slots:
+            params[best['param_map'][name]] = value
+        return {'template_id': best['id'], 'skeleton': best['skeleton'], 'similarity': round(best_sim, 3),
+                'sql': best['sql'], 'params': params, 'notes': best['notes']}
+
+    def prune(self, fingerprint: str) -> int:
+        """Borra las plantillas de otras huellas ahora (además de la poda automática). -> filas eliminadas."""
+        with self._lock:
+            before = self.stats['pruned']
+            self._prune(fingerprint)
+            self._conn.commit()
+            return self.stats['pruned'] - before
+
+    def _prune(self, fingerprint: str) -> None:
+        """Con el lock tomado; commit lo hace quien llama."""
+        self.stats['pruned'] += self._conn.execute("DELETE FROM sql_templates WHERE fingerprint != ?", (fingerprint,)).rowcount
+        for other in [f for f in self._loaded if f != fingerprint]:
+            del self._loaded[other]
+        self._pruned_for = fingerprint
+
+    def bootstrap_from_runs(self, db_conn: sqlite3.Connection, fingerprint: str) -> int:
+        """Aprende de los SQL ya ejecutados con éxito (llm_runs stage=query_exec) y de /text2sql."""
+        rows = db_conn.execute(
+            f"""
+            SELECT run_uuid, question, answer, context_json FROM llm_runs
+            WHERE {stage_expr(db_conn)} IN ('query_exec', 'text2sql')
+              AND answer NOT LIKE 'ERROR:%'
+            ORDER BY id
+            """
+        ).fetchall()
+        learned = 0
+        for run_uuid, question, answer, context_json in rows:
+            try:
+                ctx = json.loads(context_json or '{}')
+            except ValueError:
+                continue
+            sql = ctx.get('sql') if ctx.get('stage') == 'query_exec' else answer
+            if not sql or sql == '(empty sql)':
+                continue
+            params = ctx.get('params') if isinstance(ctx.get('params'), dict) else {}
+            if self.learn(question, sql, params, ctx.get('notes') or '', fingerprint, run_uuid):
+                learned += 1
+        return learned
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self._conn.execute("SELECT COUNT(*) FROM sql_templates").fetchone()[0]
+            return {**self.stats, 'templates': n, 'path': self.path}
+
+def main() -> None:
+    import os
+    from semantic_layer import schema_fingerprint
+
+    ap = argparse.ArgumentParser(description="Bootstrap de plantillas SQL desde llm_runs")
+    ap.add_argument("--db", default=os.getenv("DB_PATH", "db.sqlite"))
+    ap.add_argument("--store", default=None, help="por defecto <db>.text2sql-cache.sqlite")
+    args = ap.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    store = TemplateStore(args.store or f"{db_path}.text2sql-cache.sqlite")
+    conn = sqlite3.connect(db_path)
+    try:
+        learned = store.bootstrap_from_runs(conn, schema_fingerprint(db_path))
+    finally:
+        conn.close()
+    print(json.dumps({'learned': learned, **store.info()}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -30,8 +30,9 @@ def backend_text2sql(question: str) -> dict:
     return r.json()
 
 def run_governed_query(question: str, sql: str, params: dict | None = None):
+    # Formato columnar en matriz: nombres de columna una vez, filas como listas -> DataFrame directo
     payload = {"question": question, "sql": sql, "params": params or {}}
-    r = requests.post(f"{FASTAPI_URL}/query", json=payload, timeout=60)
+    r = requests.post(f"{FASTAPI_URL}/query", params={"format": "columnar", "orient": "rows"}, json=payload, timeout=60)
     r.raise_for_status()
     return r.json()
 
@@ -187,8 +188,7 @@ if user_input:
     # 2) Ejecutar SQL por FastAPI /query
     try:
         api_res = run_governed_query(question=user_input, sql=sql, params=params)
-        rows = api_res.get("rows", [])
-        df = pd.DataFrame(rows)
+        df = pd.DataFrame(api_res.get("data", []), columns=api_res.get("columns", []))
     except Exception as e:
         err = f"Error ejecutando /query: {e}"
         with st.chat_message("assistant"):
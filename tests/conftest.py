@@ -1,9 +1,11 @@
 import os
+import asyncio
 import sys
 import sqlite3
 import pytest
 import importlib.util
 from pathlib import Path
+from types import SimpleNamespace
 from fastapi.testclient import TestClient
 
 
@@ -79,10 +81,34 @@ def db_conn(seed_db):
 
 
 @pytest.fixture()
-def client(seed_db, project_root):
+def semantic_layer_mod(project_root):
+    if str(project_root) not in sys.path:
+        sys.path.insert(0, str(project_root))
+    import semantic_layer
+
+    semantic_layer.clear_semantic_cache()
+    yield semantic_layer
+    semantic_layer.clear_semantic_cache()
+
+
+@pytest.fixture()
+def obs_db(seed_db, project_root):
+    """Añade a la BD de test las tablas oficiales de observabilidad (sección 2 de seed.sql)."""
+    sql = (project_root / "seed.sql").read_text(encoding="utf-8")
+    conn = sqlite3.connect(seed_db)
+    conn.executescript(sql[sql.index("-- 2) OBSERVABILIDAD"):])
+    conn.commit()
+    conn.close()
+    return seed_db
+
+
+@pytest.fixture()
+def app_module(seed_db, project_root, monkeypatch):
     # Asegura que el root del proyecto está en el path
     if str(project_root) not in sys.path:
         sys.path.insert(0, str(project_root))
+    if not os.getenv("OPENAI_API_KEY"):
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
 
     # Busca tu archivo FastAPI (ajusta la lista si tu archivo se llama diferente)
     candidates = [
@@ -105,13 +131,45 @@ def client(seed_db, project_root):
             "Crea fastapi_app.py o añade su nombre a candidates en tests/conftest.py."
         )
 
-    mod = _load_module_from_path("app_under_test", api_file)
+    return _load_module_from_path("app_under_test", api_file)
+
 
+@pytest.fixture()
+def client(app_module):
     # Tu objeto FastAPI puede llamarse api/app
-    api_obj = getattr(mod, "api", None) or getattr(mod, "app", None)
+    api_obj = getattr(app_module, "api", None) or getattr(app_module, "app", None)
     if api_obj is None:
         raise RuntimeError(
-            f"Encontré {api_file.name} pero no exporta un objeto FastAPI llamado `api` o `app`."
+            f"Encontré {app_module.__file__} pero no exporta un objeto FastAPI llamado `api` o `app`."
         )
 
     return TestClient(api_obj)
+
+
+class FakeLLM:
+    """Sustituto de AsyncOpenAI().chat.completions: devuelve las respuestas en orden y registra las llamadas."""
+
+    def __init__(self, replies, delay=0.0):
+        self.replies = list(replies)
+        self.delays = list(delay) if isinstance(delay, (list, tuple)) else [delay]
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        delay = self.delays.pop(0) if len(self.delays) > 1 else self.delays[0]
+        if delay:
+            await asyncio.sleep(delay)
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+@pytest.fixture()
+def fake_llm(app_module, monkeypatch):
+    def install(*replies, delay=0.0):
+        llm = FakeLLM(replies, delay=delay)
+        monkeypatch.setattr(app_module, "client", llm)
+        return llm
+
+    return install
@@ -0,0 +1,74 @@
+import json
+import sqlite3
+
+SALES_SQL = (
+    "SELECT so.order_number, c.country_code FROM sales_orders so "
+    "JOIN customers c ON c.id = so.customer_id ORDER BY so.order_number -- generado"
+)
+
+
+def _query(client, **extra):
+    return client.post("/query", json={"question": "ventas", "sql": SALES_SQL, **extra})
+
+
+def test_allowed_countries_and_limit_are_applied_in_sql(obs_db, client, app_module):
+    r = _query(client, allowed_countries=["es", "PT"], limit=5)
+    assert r.status_code == 200
+    body = r.json()
+    assert [row["country_code"] for row in body["rows"]] == ["ES"]
+    assert body["access_filter_applied"] is True
+    assert body["access_note"] == "filtered_by=country_code allowed=['ES', 'PT']"
+    assert body["sql"] == SALES_SQL
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    (ctx,) = [json.loads(c) for (c,) in conn.execute("SELECT context_json FROM llm_runs")]
+    conn.close()
+    assert ctx["sql"] == SALES_SQL
+    assert "IN (:_acl_country_0, :_acl_country_1)" in ctx["executed_sql"]
+    assert ctx["executed_params"] == {"_acl_country_0": "ES", "_acl_country_1": "PT", "_acl_limit": 5}
+
+
+def test_limit_without_country_filter_and_missing_country_column(obs_db, client):
+    body = _query(client, limit=1).json()
+    assert body["rowcount"] == 1 and body["access_note"] == "GLOBAL_USER"
+
+    body = client.post(
+        "/query", json={"question": "pedidos", "sql": "SELECT order_number FROM sales_orders", "allowed_countries": ["ES"]}
+    ).json()
+    assert body["rowcount"] == 2
+    assert body["access_filter_applied"] is False and body["access_note"] == "NO_COUNTRY_COLUMN"
+
+
+def test_empty_allowed_list_sees_nothing_and_columnar_reports_access(obs_db, client):
+    r = client.post("/query", params={"format": "columnar"}, json={"question": "ventas", "sql": SALES_SQL, "allowed_countries": []})
+    body = r.json()
+    assert body["rowcount"] == 0 and body["access_filter_applied"] is True
+
+
+def test_stream_applies_the_same_scope(obs_db, client):
+    r = client.post("/query/stream", json={"question": "ventas", "sql": SALES_SQL, "allowed_countries": ["FR"]})
+    lines = [json.loads(l) for l in r.text.splitlines()]
+    assert lines == [{"order_number": "SO-FR-1", "country_code": "FR"}]
+    assert r.headers["x-access-filter"].startswith("filtered_by=country_code")
+
+
+def test_country_filter_ignores_case_and_column_probe_is_governed(obs_db, client, app_module, monkeypatch):
+    conn = sqlite3.connect(obs_db)
+    conn.execute("INSERT INTO customers (name, country_code) VALUES ('Minúsculas', 'es')")
+    conn.commit()
+    conn.close()
+    r = client.post("/query", json={"question": "clientes", "sql": "SELECT name, country_code FROM customers ORDER BY id",
+                                    "allowed_countries": ["ES"]})
+    assert [row["name"] for row in r.json()["rows"]] == ["Iberia Retail", "Minúsculas"]
+
+    guarded = []
+    real_guard = app_module.governor.guard
+    monkeypatch.setattr(app_module.governor, "guard", lambda conn, sql, *a, **k: guarded.append(sql) or real_guard(conn, sql, *a, **k))
+    assert _query(client, allowed_countries=["FR"]).status_code == 200
+    assert guarded[0] == SALES_SQL and "_acl_country_0" in guarded[1]
+
+    monkeypatch.setattr(app_module.qg, "GOVERNOR_MAX_PLAN_ROWS", 0.5)
+    r = _query(client, allowed_countries=["FR"])
+    assert r.status_code == 400 and r.json()["governor"]["reason"] == "plan_too_expensive"
+    assert guarded[-1] == SALES_SQL  # se corta en la sonda, antes de ejecutar la consulta
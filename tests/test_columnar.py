@@ -0,0 +1,64 @@
+SQL = "SELECT id, name, country_code FROM customers ORDER BY id"
+
+
+def test_query_columnar_column_arrays(obs_db, client):
+    r = client.post("/query?format=columnar", json={"question": "clientes", "sql": SQL})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["columns"] == ["id", "name", "country_code"]
+    assert body["types"] == ["integer", "text", "text"]
+    assert body["orient"] == "columns"
+    assert body["data"] == [[1, 2], ["Iberia Retail", "Paris Dist"], ["ES", "FR"]]
+    assert body["rowcount"] == 2 and "rows" not in body
+
+
+def test_query_columnar_matrix_round_trips_to_rows(obs_db, client, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from columnar import rows_from_columnar
+
+    payload = {"question": "clientes", "sql": SQL}
+    rows = client.post("/query", json=payload).json()
+    matrix = client.post("/query?format=columnar&orient=rows", json=payload)
+    assert matrix.json()["data"] == [[1, "Iberia Retail", "ES"], [2, "Paris Dist", "FR"]]
+    assert rows_from_columnar(matrix.json()) == rows["rows"]
+
+
+def test_query_columnar_payload_is_smaller_for_wide_results(obs_db, client):
+    sql = """
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n LIMIT 500)
+        SELECT i AS invoice_item_id, i * 2 AS invoice_id, 'SKU-' || i AS product_sku, i % 7 AS quantity_ordered
+        FROM n
+    """
+    payload = {"question": "lineas", "sql": sql}
+    as_rows = client.post("/query", json=payload).content
+    as_columns = client.post("/query?format=columnar", json=payload).content
+    assert len(as_columns) * 2 < len(as_rows)
+
+
+def test_column_types_skip_nulls_and_empty_results(project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from columnar import to_columnar
+
+    out = to_columnar(["a", "b", "c"], [(None, 1.5, None), (3, None, None)])
+    assert out["types"] == ["integer", "real", "null"]
+    assert to_columnar(["a"], [])["data"] == [[]]
+
+
+def test_columnar_types_are_declared_types_with_inference_for_expressions(obs_db, client):
+    sql = """
+        SELECT c.id, so.order_date, so.customer_id * 1.5 AS score, upper(c.country_code) AS cc
+        FROM customers c LEFT JOIN sales_orders so ON so.customer_id = c.id AND so.order_number = :missing
+        ORDER BY c.id
+    """
+    r = client.post("/query?format=columnar", json={"question": "tipos", "sql": sql, "params": {"missing": "nope"}})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    # order_date es NULL en todas las filas y sigue siendo DATE; las expresiones se infieren de los valores
+    assert body["types"] == ["integer", "date", "null", "text"]
+    assert body["data"][1] == [None, None]
+
+    batch = client.post("/query/batch?format=columnar", json={"items": [{"question": "tipos", "sql": sql,
+                                                                          "params": {"missing": "nope"}}]})
+    assert batch.json()["results"][0]["types"] == body["types"]
@@ -0,0 +1,59 @@
+import sqlite3
+import threading
+
+import pytest
+
+
+def test_sql_reuses_pooled_read_connection(client):
+    for _ in range(3):
+        assert client.post("/sql", json={"sql": "SELECT COUNT(*) AS n FROM customers"}).status_code == 200
+
+    stats = client.get("/db/pool").json()
+    assert stats["read"]["opened"] == 1
+    # 3 ejecuciones + 1 validación del SQL (el veredicto queda memorizado tras la primera)
+    assert stats["read"]["checkouts"] == 4
+    assert stats["read"]["in_use"] == 0
+
+
+def test_read_pool_rejects_writes(seed_db, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from db_pool import SQLitePool
+
+    pool = SQLitePool(str(seed_db), size=1, read_only=True)
+    with pool.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM customers")
+    pool.close()
+
+
+def test_pool_waits_and_times_out_when_exhausted(seed_db, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from db_pool import PoolTimeout, SQLitePool
+
+    pool = SQLitePool(str(seed_db), size=1, read_only=True, timeout=0.05)
+    with pool.connection():
+        with pytest.raises(PoolTimeout):
+            with pool.connection():
+                pass
+
+    released = threading.Event()
+
+    def hold():
+        with pool.connection():
+            released.wait(1)
+
+    t = threading.Thread(target=hold)
+    t.start()
+    pool.timeout = 2
+    threading.Timer(0.05, released.set).start()
+    while pool.info()["in_use"] == 0:
+        pass
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0] == 2
+    t.join()
+
+    info = pool.info()
+    assert info["timeouts"] == 1 and info["waits"] == 1 and info["opened"] == 1
+    pool.close()
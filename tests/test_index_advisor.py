@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+ORDERS_SQL = (
+    "SELECT c.name, so.order_number FROM sales_orders so JOIN customers c ON c.id = so.customer_id "
+    "WHERE so.order_date >= :d ORDER BY so.order_date"
+)
+
+
+@pytest.fixture()
+def advisor(project_root):
+    import sys
+    if str(project_root) not in sys.path:
+        sys.path.insert(0, str(project_root))
+    import index_advisor
+
+    return index_advisor
+
+
+def _run_workload(client, app_module):
+    for _ in range(3):
+        assert client.post("/query", json={"question": "pedidos", "sql": ORDERS_SQL, "params": {"d": "2025-12-01"}}).status_code == 200
+    assert client.post("/query", json={"question": "es", "sql": "SELECT * FROM customers WHERE country_code = 'ES'"}).status_code == 200
+    app_module.flush_observability()
+
+
+def test_index_advice_ranks_candidates_from_logged_sql(obs_db, client, app_module):
+    _run_workload(client, app_module)
+    body = client.get("/db/index-advice").json()
+    assert body["workload_queries"] == 2 and body["workload_executions"] == 4
+
+    top = body["recommendations"][0]
+    assert (top["table"], top["columns"]) == ("sales_orders", ["order_date"])
+    assert top["queries"][0]["executions"] == 3
+    assert top["queries"][0]["plan_before"]["scans"] == ["sales_orders"]
+    assert top["queries"][0]["plan_after"]["scans"] == [] and top["queries"][0]["plan_after"]["temp_btrees"] == 0
+    assert ("customers", ["country_code"]) in [(r["table"], r["columns"]) for r in body["recommendations"]]
+
+    # Solo recomienda: la BD real sigue sin índices nuevos.
+    conn = sqlite3.connect(obs_db)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'idx_advisor_%'").fetchone()[0] == 0
+    conn.close()
+
+
+def test_existing_index_is_not_recommended_again(obs_db, client, app_module):
+    conn = sqlite3.connect(obs_db)
+    conn.execute("CREATE INDEX idx_sales_orders_date ON sales_orders(order_date)")
+    conn.commit()
+    conn.close()
+    _run_workload(client, app_module)
+    tables = [r["table"] for r in client.get("/db/index-advice").json()["recommendations"]]
+    assert "sales_orders" not in tables
+
+
+def test_apply_on_copy_times_workload_without_touching_the_db(obs_db, client, app_module, advisor):
+    _run_workload(client, app_module)
+    conn = sqlite3.connect(obs_db)
+    workload = advisor.load_workload(conn)
+    report = advisor.advise(conn, workload, top=1)
+    conn.close()
+
+    validation = advisor.apply_on_copy(str(obs_db), report["recommendations"], workload, repeats=1)
+    assert validation["indexes"] == [report["recommendations"][0]["ddl"]]
+    assert validation["copy_path"] is None
+    assert all("before_seconds" in q and "after_seconds" in q for q in validation["queries"])
+
+    conn = sqlite3.connect(obs_db)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'idx_advisor_%'").fetchone()[0] == 0
+    conn.close()
+
+
+def test_workload_reads_only_the_most_recent_runs(obs_db, client, app_module, advisor):
+    _run_workload(client, app_module)
+    body = client.get("/db/index-advice", params={"runs": 1}).json()
+    assert body["workload_queries"] == 1 and body["workload_executions"] == 1
+
+    conn = sqlite3.connect(obs_db)
+    app_module.run_traces.migrate(conn)
+    conn.commit()
+    assert [w["executions"] for w in advisor.load_workload(conn, max_runs=3)] == [2, 1]
+    assert sum(w["executions"] for w in advisor.load_workload(conn, max_runs=None)) == 4
+    plan = " ".join(r[3] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT context_json FROM llm_runs WHERE stage = 'query_exec' ORDER BY id DESC LIMIT 2"))
+    conn.close()
+    assert "idx_llm_runs_stage" in plan
@@ -0,0 +1,34 @@
+def _layer(tables, rels, semantic_layer_mod):
+    schema = {"tables": tables, "columns": {t: [] for t in tables}, "foreign_keys": {}}
+    return {"schema": schema, "relationships": {"relationships": rels, "graph": semantic_layer_mod.relationship_graph(tables, rels)}}
+
+
+def _fk(src, col, dst):
+    return {"type": "fk", "from_table": src, "from_column": col, "to_table": dst, "to_column": "id"}
+
+
+def test_find_join_path_multi_hop(semantic_layer_mod):
+    import join_planner
+
+    layer = _layer(
+        ["customers", "invoices", "invoice_items", "products"],
+        [_fk("invoices", "customer_id", "customers"), _fk("invoice_items", "invoice_id", "invoices"),
+         _fk("invoice_items", "product_id", "products")],
+        semantic_layer_mod,
+    )
+    path = join_planner.find_join_path(layer, "customers", "products")
+    assert [h["to_table"] for h in path["hops"]] == ["invoices", "invoice_items", "products"]
+    assert path["join_sql"].splitlines() == [
+        "FROM customers",
+        "JOIN invoices ON invoices.customer_id = customers.id",
+        "JOIN invoice_items ON invoice_items.invoice_id = invoices.id",
+        "JOIN products ON products.id = invoice_items.product_id",
+    ]
+    assert join_planner.join_hints(layer, ["customers", "invoices", "products"]) == [path["join_sql"]]
+
+
+def test_find_join_path_unreachable(semantic_layer_mod):
+    import join_planner
+
+    layer = _layer(["a", "b"], [], semantic_layer_mod)
+    assert join_planner.find_join_path(layer, "a", "b") is None
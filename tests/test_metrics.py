@@ -0,0 +1,78 @@
+import json
+import re
+import time
+
+_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def parse(text):
+    """{(nombre, frozenset(etiquetas)): valor} a partir del formato de texto de Prometheus."""
+    out = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        m = _LINE.match(line)
+        assert m, line
+        labels = frozenset(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', m.group(2) or ""))
+        out[(m.group(1), labels)] = float(m.group(3))
+    return out
+
+
+def sample(samples, name, **labels):
+    return samples.get((name, frozenset((k, str(v)) for k, v in labels.items())), 0.0)
+
+
+def test_registry_renders_cumulative_buckets_and_escapes_labels(project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    import metrics
+
+    reg = metrics.Registry()
+    h = reg.histogram("t_seconds", "test", ("stage",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v, stage='a"b')
+    reg.counter("t_events", "test", ("kind",)).inc(kind="x")
+    text = reg.render()
+
+    assert '# TYPE t_seconds histogram' in text and '# TYPE t_events counter' in text
+    s = parse(text)
+    assert [sample(s, "t_seconds_bucket", stage='a\\"b', le=le) for le in ("0.1", "1", "+Inf")] == [2, 3, 4]
+    assert sample(s, "t_seconds_count", stage='a\\"b') == 4
+    assert abs(sample(s, "t_seconds_sum", stage='a\\"b') - 3.65) < 1e-9
+    assert sample(s, "t_events_total", kind="x") == 1
+
+    # Registrar debe costar microsegundos: es el camino de cada petición.
+    t0 = time.perf_counter()
+    for _ in range(20000):
+        h.observe(0.2, stage="hot")
+    assert (time.perf_counter() - t0) / 20000 < 50e-6
+
+
+def test_metrics_endpoint_exposes_endpoint_stage_cache_and_guardrail_series(obs_db, client, app_module, fake_llm):
+    before = parse(client.get("/metrics").text)
+    fake_llm(json.dumps({"sql": "SELECT id FROM customers", "params": {}, "notes": "ok"}))
+    client.post("/text2sql", json={"question": "ids de clientes metricas"})
+    client.post("/text2sql", json={"question": "ids de clientes metricas"})
+    client.post("/query", json={"question": "ids", "sql": "SELECT id FROM customers"})
+    assert client.post("/query", json={"question": "x", "sql": "DELETE FROM customers"}).status_code == 400
+    app_module.flush_observability()
+
+    r = client.get("/metrics")
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = parse(r.text)
+
+    def delta(name, **labels):
+        return sample(after, name, **labels) - sample(before, name, **labels)
+
+    assert delta("http_request_duration_seconds_count", method="POST", route="/text2sql", status=200) == 2
+    assert delta("http_request_duration_seconds_count", method="POST", route="/query", status=400) == 1
+    for stage in ("semantic_build", "llm_call", "json_parse", "sql_execute", "serialize", "obs_write"):
+        assert delta("stage_duration_seconds_count", stage=stage) >= 1, stage
+    assert delta("llm_attempts_total", attempt="primary", outcome="ok") == 1
+    assert delta("cache_requests_total", cache="text2sql", result="miss") == 1
+    assert delta("cache_requests_total", cache="text2sql", result="hit") == 1
+    assert delta("guardrail_rejections_total", reason="not_read_only") == 1
+    assert sample(after, "obs_queue_depth", db=str(obs_db)) == 0
+    assert (("obs_rows_dropped_total", frozenset({("db", str(obs_db))})) in after
+            and ("obs_rows_dropped", frozenset({("db", str(obs_db))})) not in after)
+    assert "# TYPE obs_rows_dropped counter" in r.text and "# TYPE obs_queue_depth gauge" in r.text
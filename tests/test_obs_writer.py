@@ -0,0 +1,86 @@
+import sqlite3
+
+
+def _writer(obs_db, project_root, **kw):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from obs_writer import ObservabilityWriter
+
+    return ObservabilityWriter(str(obs_db), **kw)
+
+
+def test_writer_batches_runs_and_metrics_in_one_transaction(obs_db, project_root):
+    writer = _writer(obs_db, project_root, flush_interval=0.2)
+    for i in range(20):
+        writer.run({"run_uuid": f"run-{i}", "question": "q", "answer": "a", "elapsed_seconds": 0.1, "context_json": "{}"})
+        writer.metric(f"run-{i}", "latency_seconds", 0.1, "{}")
+    writer.flush()
+
+    info = writer.info()
+    assert info["written"] == 40 and info["batches"] == 1 and info["failed"] == 0
+
+    conn = sqlite3.connect(obs_db)
+    orphans = conn.execute(
+        "SELECT COUNT(*) FROM quality_metrics qm LEFT JOIN llm_runs r ON r.id = qm.llm_run_id WHERE r.run_uuid IS NULL"
+    ).fetchone()[0]
+    conn.close()
+    assert orphans == 0
+    writer.close()
+
+
+def test_writer_resolves_runs_from_earlier_batches_and_drains_on_close(obs_db, project_root):
+    writer = _writer(obs_db, project_root, flush_interval=0.01)
+    writer.run({"run_uuid": "run-a", "question": "q", "answer": "a", "elapsed_seconds": 0.1, "context_json": "{}"})
+    writer.flush()
+    writer.metric("run-a", "sql_valid", 1, "{}")
+    writer.hallucination("run-a", "judge", 0.9, 0, "llm", "ok", "{}")
+    writer.close()
+    assert not writer.info()["alive"]
+
+    conn = sqlite3.connect(obs_db)
+    run_id = conn.execute("SELECT id FROM llm_runs WHERE run_uuid='run-a'").fetchone()[0]
+    assert conn.execute("SELECT llm_run_id FROM quality_metrics").fetchall() == [(run_id,)]
+    assert conn.execute("SELECT llm_run_id FROM hallucination_evaluations").fetchall() == [(run_id,)]
+    conn.close()
+
+
+def test_writer_applies_backpressure_then_drops_when_queue_stays_full(obs_db, project_root):
+    import threading
+
+    writer = _writer(obs_db, project_root, max_queue=1, flush_interval=0.0, enqueue_timeout=0.05)
+    release = threading.Event()
+    write = writer._write
+    writer._write = lambda batch: (release.wait(2), write(batch))
+
+    run = {"run_uuid": "run-x", "question": "q", "answer": "a", "elapsed_seconds": 0.1, "context_json": "{}"}
+    assert writer.run(run)                             # el hilo lo toma y se queda bloqueado escribiendo
+    while writer._q.qsize():
+        pass
+    assert writer.metric("run-x", "m", 2.0, "{}")      # ocupa la única plaza de la cola
+    assert not writer.metric("run-x", "m", 3.0, "{}")  # espera enqueue_timeout y se descarta
+    release.set()
+    writer.close()
+
+    info = writer.info()
+    assert info["dropped"] == 1 and info["backpressure_waits"] == 1 and info["written"] == 2
+
+
+def test_writer_skips_metrics_of_dropped_runs_without_losing_the_batch(obs_db, project_root):
+    writer = _writer(obs_db, project_root, flush_interval=0.2)
+    # run-lost se descartó en el productor (contrapresión), pero su métrica sí llegó a la cola.
+    writer.metric("run-lost", "latency_seconds", 0.1, "{}")
+    writer.hallucination("run-lost", "judge", 0.5, 0, "llm", "x", "{}")
+    writer.run({"run_uuid": "run-ok", "question": "q", "answer": "a", "elapsed_seconds": 0.1, "context_json": "{}"})
+    writer.metric("run-ok", "latency_seconds", 0.1, "{}")
+    writer.flush()
+    writer.metric("run-lost", "sql_valid", 1, "{}")  # el lote siguiente tampoco se pierde en cascada
+    writer.metric("run-ok", "sql_valid", 1, "{}")
+    writer.close()
+
+    info = writer.info()
+    assert info["failed"] == 0 and info["orphaned"] == 3 and info["written"] == 3
+
+    conn = sqlite3.connect(obs_db)
+    assert conn.execute("SELECT COUNT(*) FROM llm_runs WHERE run_uuid = 'run-ok'").fetchone()[0] == 1
+    assert conn.execute("SELECT metric_name FROM quality_metrics ORDER BY id").fetchall() == [("latency_seconds",), ("sql_valid",)]
+    conn.close()
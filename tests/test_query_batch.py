@@ -0,0 +1,63 @@
+import json
+import sqlite3
+import time
+
+
+def test_batch_returns_per_item_results_and_logs_one_group(obs_db, client, app_module):
+    r = client.post("/query/batch", json={
+        "parent_run_uuid": "page-1",
+        "items": [
+            {"question": "clientes", "sql": "SELECT id, name FROM customers ORDER BY id"},
+            {"question": "pedidos ES", "allowed_countries": ["ES"],
+             "sql": "SELECT so.order_number, c.country_code FROM sales_orders so JOIN customers c ON c.id = so.customer_id"},
+            {"question": "borrar", "sql": "DELETE FROM customers"},
+            {"question": "roto", "sql": "SELECT nope FROM customers"},
+        ],
+    })
+    assert r.status_code == 200, r.text
+    body = r.json()
+    res = body["results"]
+    assert [x["status"] for x in res] == [200, 200, 400, 400]
+    assert [row["id"] for row in res[0]["rows"]] == [1, 2]
+    assert res[1]["rows"] == [{"order_number": "SO-ES-1", "country_code": "ES"}]
+    assert res[1]["access_filter_applied"] is True
+    assert not res[2]["ok"] and res[2]["run_uuid"] is None and "Solo lectura" in res[2]["error"]
+    assert "SQL inválido" in res[3]["error"]
+    assert body["slowest_seconds"] <= body["sum_seconds"]
+
+    app_module.flush_observability()
+    assert app_module.get_obs_writer().info()["groups"] == 1
+    conn = sqlite3.connect(obs_db)
+    contexts = [json.loads(c) for (c,) in conn.execute("SELECT context_json FROM llm_runs ORDER BY id")]
+    conn.close()
+    assert [c["endpoint"] for c in contexts] == ["/query/batch", "/query/batch"]
+    assert {c["parent_run_uuid"] for c in contexts} == {"page-1"}
+    assert {c["batch"]["batch_uuid"] for c in contexts} == {body["batch_uuid"]}
+    assert [c["batch"]["index"] for c in contexts] == [0, 1]
+
+
+def test_batch_runs_statements_concurrently(obs_db, client, app_module, monkeypatch):
+    real = app_module.fetch_table_cached
+
+    def slow(sql, params):
+        time.sleep(0.2)
+        return real(sql, params)
+
+    monkeypatch.setattr(app_module, "fetch_table_cached", slow)
+    items = [{"question": f"q{i}", "sql": f"SELECT {i} AS n"} for i in range(4)]
+    t0 = time.perf_counter()
+    r = client.post("/query/batch", json={"items": items})
+    wall = time.perf_counter() - t0
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert [x["rows"] for x in body["results"]] == [[{"n": i}] for i in range(4)]
+    assert body["sum_seconds"] >= 0.8
+    assert wall < 0.6
+
+
+def test_batch_columnar_and_item_limits(obs_db, client):
+    r = client.post("/query/batch?format=columnar", json={"items": [{"question": "c", "sql": "SELECT id FROM customers"}]})
+    assert r.status_code == 200
+    assert r.json()["results"][0]["columns"] == ["id"]
+    assert r.json()["results"][0]["data"] == [[1, 2]]
+    assert client.post("/query/batch", json={"items": []}).status_code == 422
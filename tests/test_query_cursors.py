@@ -0,0 +1,98 @@
+import json
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture()
+def customers_db(obs_db):
+    conn = sqlite3.connect(obs_db)
+    conn.executemany(
+        "INSERT INTO customers (name, country_code) VALUES (?, ?)",
+        [(f"Cliente {i}", "ES" if i % 2 else "FR") for i in range(3, 8)],
+    )
+    conn.commit()
+    conn.close()
+    return obs_db
+
+
+def _pages(client, first):
+    r = client.post("/query", json=first)
+    assert r.status_code == 200, r.text
+    pages = [r.json()]
+    while pages[-1]["next_cursor"]:
+        r = client.post("/query/next", json={"cursor": pages[-1]["next_cursor"]})
+        assert r.status_code == 200, r.text
+        pages.append(r.json())
+    return pages
+
+
+def test_keyset_pages_follow_the_primary_key(customers_db, client, app_module):
+    pages = _pages(client, {"question": "clientes", "sql": "SELECT id, name FROM customers", "page_size": 3})
+    assert [p["cursor_mode"] for p in pages] == ["keyset"] * 3
+    assert [[row["id"] for row in p["rows"]] for p in pages] == [[1, 2, 3], [4, 5, 6], [7]]
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(customers_db)
+    contexts = [json.loads(c) for (c,) in conn.execute("SELECT context_json FROM llm_runs ORDER BY id")]
+    conn.close()
+    assert [c["endpoint"] for c in contexts] == ["/query", "/query/next", "/query/next"]
+    assert 'WHERE _k."id" > :_cursor_after' in contexts[1]["executed_sql"]
+    assert contexts[1]["executed_params"]["_cursor_after"] == 3
+    assert [c["cursor"]["has_more"] for c in contexts] == [True, True, False]
+
+
+def test_keyset_respects_descending_order_and_access_filter(customers_db, client):
+    pages = _pages(client, {
+        "question": "clientes", "sql": "SELECT id, country_code FROM customers ORDER BY id DESC",
+        "allowed_countries": ["ES"], "page_size": 2,
+    })
+    assert pages[0]["cursor_mode"] == "keyset"
+    assert [row["id"] for p in pages for row in p["rows"]] == [7, 5, 3, 1]
+    assert all(row["country_code"] == "ES" for p in pages for row in p["rows"])
+
+
+def test_joins_and_foreign_order_fall_back_to_materialized_snapshot(customers_db, client):
+    sql = "SELECT c.name, so.order_number FROM sales_orders so JOIN customers c ON c.id = so.customer_id"
+    r = client.post("/query", json={"question": "pedidos", "sql": sql, "page_size": 1})
+    first = r.json()
+    assert first["cursor_mode"] == "materialized" and first["rowcount"] == 1
+
+    conn = sqlite3.connect(customers_db)
+    conn.execute("INSERT INTO sales_orders (customer_id, order_number, order_date) VALUES (3, 'SO-NEW', '2025-12-20')")
+    conn.commit()
+    conn.close()
+    second = client.post("/query/next", json={"cursor": first["next_cursor"]}).json()
+    assert second["next_cursor"] is None and second["rowcount"] == 1  # la foto no cambia con escrituras posteriores
+
+    ordered = client.post("/query", json={"question": "c", "sql": "SELECT id, name FROM customers ORDER BY name", "page_size": 2})
+    assert ordered.json()["cursor_mode"] == "materialized"
+
+
+def test_small_results_do_not_open_a_cursor(obs_db, client):
+    body = client.post("/query", json={"question": "c", "sql": "SELECT id FROM customers", "page_size": 10}).json()
+    assert body["rowcount"] == 2 and body["next_cursor"] is None
+    assert client.get("/query/cursors").json()["open"] == 0
+
+
+def test_tampered_and_expired_cursors_are_rejected(customers_db, client, app_module):
+    first = client.post("/query", json={"question": "c", "sql": "SELECT id FROM customers", "page_size": 2}).json()
+    payload, sig = first["next_cursor"].split(".")
+    forged = client.post("/query/next", json={"cursor": f"{payload}.{'0' * len(sig)}"})
+    assert forged.status_code == 400
+
+    app_module.get_cursor_store().ttl_seconds = -1
+    client.post("/query/next", json={"cursor": first["next_cursor"]})  # renueva a "ya caducado"
+    r = client.post("/query/next", json={"cursor": first["next_cursor"]})
+    assert r.status_code == 410
+
+
+def test_materialized_rows_keep_blobs_as_bytes(tmp_path, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from cursors import CursorStore
+
+    store = CursorStore(str(tmp_path / "cursors.sqlite"))
+    rows = [(1, b"\x00\xffPNG", "b'x'"), (2, None, "texto")]
+    cursor = store.open("materialized", "q", "SELECT 1", "SELECT 1", {}, 1, ["id", "img", "note"], "fp", rows=rows)
+    assert store.rows(cursor["cursor_id"], 0, 10) == rows
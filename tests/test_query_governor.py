@@ -0,0 +1,60 @@
+import json
+import sqlite3
+
+import pytest
+
+JOIN_SQL = "SELECT c.name, so.order_number FROM sales_orders so JOIN customers c ON c.id = so.customer_id"
+
+
+@pytest.fixture()
+def qg(app_module):
+    return app_module.qg
+
+
+def _governor_metrics(app_module, db):
+    app_module.flush_observability()
+    conn = sqlite3.connect(db)
+    rows = conn.execute("SELECT metric_value, metric_json FROM quality_metrics WHERE metric_name='governor' ORDER BY id").fetchall()
+    conn.close()
+    return [(v, json.loads(j)) for v, j in rows]
+
+
+def test_cross_join_over_plan_budget_is_killed_and_logged(obs_db, client, app_module, qg, monkeypatch):
+    monkeypatch.setattr(qg, "GOVERNOR_MAX_PLAN_ROWS", 3)
+    r = client.post("/query", json={"question": "todo", "sql": "SELECT * FROM customers, sales_orders"})
+    assert r.status_code == 400
+    assert r.json()["governor"]["reason"] == "plan_too_expensive"
+    assert r.headers["x-governor"] == "killed"
+
+    ((value, info),) = _governor_metrics(app_module, obs_db)
+    assert value == 2 and info["outcome"] == "killed" and info["estimated_rows"] == 4
+
+
+def test_runaway_query_is_interrupted_by_time_budget(obs_db, client, qg, monkeypatch):
+    monkeypatch.setattr(qg, "GOVERNOR_TIME_BUDGET_SECONDS", 0.05)
+    sql = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+    r = client.post("/sql", json={"sql": sql})
+    assert r.status_code == 400
+    assert r.json()["governor"]["reason"] == "time_budget_exceeded"
+    assert client.get("/db/pool").json()["read"]["in_use"] == 0
+
+
+def test_row_cap_truncates_and_throttles(obs_db, client, app_module, qg, monkeypatch):
+    monkeypatch.setattr(qg, "GOVERNOR_MAX_ROWS", 1)
+    r = client.post("/query", json={"question": "clientes", "sql": "SELECT * FROM customers"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["rowcount"] == 1 and body["truncated"] is True
+    assert r.headers["x-governor"] == "throttled" and r.headers["x-cache"] == "BYPASS"
+    ((value, info),) = _governor_metrics(app_module, obs_db)
+    assert value == 1 and info["truncated"] is True
+
+
+def test_large_scan_is_flagged_with_aliases_resolved(obs_db, client, app_module, qg, monkeypatch):
+    monkeypatch.setattr(qg, "GOVERNOR_LARGE_TABLE_ROWS", 2)
+    r = client.post("/query", json={"question": "pedidos", "sql": JOIN_SQL})
+    assert r.status_code == 200 and r.headers["x-governor"] == "throttled"
+    ((_, info),) = _governor_metrics(app_module, obs_db)
+    assert info["flagged"] is True
+    assert info["large_scans"] == ["sales_orders(2)"]
+    assert client.get("/query/governor").json()["throttled"] == 1
@@ -0,0 +1,118 @@
+import asyncio
+import csv
+import io
+import json
+import sqlite3
+
+
+SQL = "SELECT id, name, country_code FROM customers ORDER BY id"
+
+
+def _runs(app_module, obs_db):
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    rows = [json.loads(c) for (c,) in conn.execute("SELECT context_json FROM llm_runs ORDER BY id")]
+    conn.close()
+    return rows
+
+
+def test_query_stream_ndjson_pages_and_logs_run(obs_db, client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "STREAM_FETCH_SIZE", 1)
+    with client.stream("POST", "/query/stream", json={"question": "clientes", "sql": SQL}) as r:
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in r.iter_lines() if line]
+    assert [row["country_code"] for row in lines] == ["ES", "FR"]
+
+    (ctx,) = _runs(app_module, obs_db)
+    assert ctx["endpoint"] == "/query/stream"
+    assert ctx["rowcount"] == 2 and ctx["status"] == "completed"
+    assert client.get("/db/pool").json()["read"]["in_use"] == 0
+
+
+def test_query_stream_csv_has_header(obs_db, client):
+    r = client.post("/query/stream", json={"question": "clientes", "sql": SQL, "format": "csv"})
+    assert r.status_code == 200
+    rows = list(csv.reader(io.StringIO(r.text)))
+    assert rows[0] == ["id", "name", "country_code"]
+    assert rows[1] == ["1", "Iberia Retail", "ES"]
+
+
+def test_query_stream_rejects_unsafe_sql_before_streaming(client):
+    r = client.post("/query/stream", json={"question": "x", "sql": "DELETE FROM customers"})
+    assert r.status_code == 400
+
+
+def test_query_stream_stops_and_logs_on_client_disconnect(obs_db, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "STREAM_FETCH_SIZE", 1)
+
+    class DisconnectsAfterFirstPage:
+        checks = 0
+
+        async def is_disconnected(self):
+            self.checks += 1
+            return self.checks > 1
+
+    async def consume():
+        req = app_module.QueryStreamRequest(question="clientes", sql=SQL)
+        resp = await app_module.query_stream(req, DisconnectsAfterFirstPage())
+        return [chunk async for chunk in resp.body_iterator]
+
+    chunks = asyncio.run(consume())
+    assert len(chunks) == 1
+
+    (ctx,) = _runs(app_module, obs_db)
+    assert ctx["status"] == "client_disconnected" and ctx["rowcount"] == 1
+    assert app_module.pool_stats(str(obs_db))["read"]["in_use"] == 0
+
+
+RUNAWAY = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT {select} FROM n"
+
+
+def test_query_stream_runaway_is_killed_by_governor(obs_db, client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module.qg, "GOVERNOR_TIME_BUDGET_SECONDS", 0.05)
+    r = client.post("/query/stream", json={"question": "todo", "sql": RUNAWAY.format(select="COUNT(*)")})
+    assert r.status_code == 400
+    assert r.json()["governor"]["reason"] == "time_budget_exceeded"
+    assert client.get("/db/pool").json()["read"]["in_use"] == 0
+
+    # Una consulta que sí produce filas: el cliente sigue leyendo, pero el presupuesto se agota igualmente.
+    monkeypatch.setattr(app_module, "STREAM_FETCH_SIZE", 5000)
+    rows = 0
+    try:
+        with client.stream("POST", "/query/stream", json={"question": "todo", "sql": RUNAWAY.format(select="i")}) as s:
+            assert s.status_code == 200 and s.headers["x-governor"] == "allowed"
+            rows = sum(1 for line in s.iter_lines() if line)
+    except Exception:
+        pass  # el stream se corta: el cliente no debe tomarlo por completo
+    assert client.get("/db/pool").json()["read"]["in_use"] == 0
+
+    ctx = _runs(app_module, obs_db)
+    assert ctx[0]["governor"]["reason"] == "time_budget_exceeded"
+    assert ctx[1]["status"] == "killed" and ctx[1]["governor"]["reason"] == "time_budget_exceeded"
+    assert 0 < ctx[1]["rowcount"] and rows <= ctx[1]["rowcount"]
+
+
+def test_query_stream_keeps_guardrails_and_logging_off_the_event_loop(obs_db, app_module, monkeypatch):
+    import threading
+
+    threads = {}
+    for name in ("check_sql", "insert_llm_run"):
+        original = getattr(app_module, name)
+        monkeypatch.setattr(app_module, name, lambda *a, _f=original, _n=name, **kw: (threads.setdefault(_n, threading.get_ident()), _f(*a, **kw))[1])
+
+    class Connected:
+        async def is_disconnected(self):
+            return False
+
+    async def consume():
+        loop_thread = threading.get_ident()
+        req = app_module.QueryStreamRequest(question="clientes", sql=SQL)
+        resp = await app_module.query_stream(req, Connected())
+        chunks = [chunk async for chunk in resp.body_iterator]
+        return loop_thread, chunks
+
+    loop_thread, chunks = asyncio.run(consume())
+    assert len(chunks) == 1
+    assert set(threads) == {"check_sql", "insert_llm_run"}
+    assert loop_thread not in threads.values()
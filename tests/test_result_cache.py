@@ -0,0 +1,116 @@
+import json
+import sqlite3
+
+import pytest
+
+SQL = "SELECT country_code, COUNT(*) AS n FROM customers GROUP BY country_code ORDER BY country_code"
+
+
+def _post(client, sql=SQL):
+    return client.post("/query", json={"question": "clientes por pais", "sql": sql})
+
+
+@pytest.fixture()
+def versioned(obs_db, app_module):
+    """Triggers de versión instalados como en el arranque (el TestClient no ejecuta el lifespan)."""
+    app_module.install_result_cache_triggers()
+    return obs_db
+
+
+def test_query_result_cache_hit_survives_observability_writes(obs_db, versioned, client, app_module):
+    r1 = _post(client)
+    app_module.flush_observability()  # los inserts en llm_runs no deben invalidar consultas sobre customers
+    r2 = _post(client, "  " + SQL.replace(" FROM", "\n   FROM") + ";")
+    assert r1.headers["x-cache"] == "MISS" and r2.headers["x-cache"] == "HIT"
+    assert r2.json()["rows"] == r1.json()["rows"]
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    contexts = [json.loads(c) for (c,) in conn.execute("SELECT context_json FROM llm_runs ORDER BY id")]
+    conn.close()
+    assert [c["result_cache"] for c in contexts] == ["miss", "hit"]
+
+
+def test_query_result_cache_invalidated_by_write_to_read_table(obs_db, versioned, client):
+    assert _post(client).headers["x-cache"] == "MISS"
+    conn = sqlite3.connect(obs_db)
+    conn.execute("INSERT INTO customers (name, country_code) VALUES ('Lisboa Shop', 'PT')")
+    conn.commit()
+    conn.close()
+
+    r = _post(client)
+    assert r.headers["x-cache"] == "MISS"
+    assert {row["country_code"] for row in r.json()["rows"]} == {"ES", "FR", "PT"}
+    assert client.get("/query/cache").json()["stale"] == 1
+
+
+def test_query_result_cache_bypasses_large_results(obs_db, versioned, client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "RESULT_CACHE_MAX_ROWS", 1)
+    r = _post(client, "SELECT id FROM customers")
+    assert r.headers["x-cache"] == "BYPASS"
+    assert _post(client, "SELECT id FROM customers").headers["x-cache"] == "BYPASS"
+
+
+def test_result_cache_is_shared_between_instances_and_evicts_lru(tmp_path, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from result_cache import ResultCache, normalize_sql
+
+    path = str(tmp_path / "rc.sqlite")
+    a = ResultCache(path, max_bytes=120)
+    b = ResultCache(path, max_bytes=120)
+    same = lambda tables: {t: 0 for t in tables}
+    a.put("k1", "SELECT 1", ["x"], [(1,)], {"t": 0})
+    a.put("k2", "SELECT 2", ["x"], [(2,)], {"t": 0})
+    assert b.get("k1", same)["rows"] == [(1,)]  # k1 pasa a ser el más reciente
+
+    a.put("k3", "SELECT 3", ["x"], [("y" * 40,)], {"t": 0})
+    assert b.get("k2", same) is None and b.get("k1", same) is not None
+
+    assert normalize_sql("SELECT  'a  b'\n FROM t ;") == "SELECT 'a  b' FROM t"
+
+
+def test_version_table_is_hidden_from_semantic_layer(obs_db, versioned, client):
+    _post(client)
+    assert "_table_versions" not in client.get("/semantic").json()["schema"]["tables"]
+
+
+def test_query_result_cache_bypasses_volatile_and_tableless_sql(obs_db, versioned, client, project_root):
+    for sql in ("SELECT date('now') AS d, COUNT(*) AS n FROM customers",
+                "SELECT COUNT(*) AS n FROM customers WHERE julianday(:d) > 0",
+                "SELECT CURRENT_TIMESTAMP AS t FROM customers",
+                "SELECT random() AS r, name FROM customers",
+                "SELECT 1 AS one"):
+        params = {"d": "now"} if ":d" in sql else {}
+        for _ in range(2):
+            r = client.post("/query", json={"question": "volatil", "sql": sql, "params": params})
+            assert r.status_code == 200, r.text
+            assert r.headers["x-cache"] == "BYPASS", sql
+
+    import sys
+    sys.path.insert(0, str(project_root))
+    from result_cache import is_volatile
+    assert not is_volatile("SELECT strftime('%Y', order_date) FROM sales_orders", {}, ["strftime"])
+    assert is_volatile("SELECT strftime('%Y') FROM sales_orders", {}, ["strftime"])
+
+
+def test_requests_never_install_version_triggers(obs_db, client, app_module, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from semantic_layer import schema_fingerprint
+
+    before = schema_fingerprint(str(obs_db))
+    assert _post(client).headers["x-cache"] == "BYPASS"  # sin triggers no hay versiones: no se cachea
+    assert client.get("/query/cache").status_code == 200
+    assert schema_fingerprint(str(obs_db)) == before
+
+    conn = sqlite3.connect(obs_db)
+    app_module.install_version_triggers(conn)  # instalación anterior: triggers también en observabilidad
+    conn.close()
+    assert "customers" in app_module.install_result_cache_triggers()
+    conn = sqlite3.connect(obs_db)
+    triggered = {t for (t,) in conn.execute("SELECT DISTINCT tbl_name FROM sqlite_master WHERE type='trigger' AND name LIKE '_tv_%'")}
+    conn.close()
+    assert {"customers", "sales_orders"} <= triggered
+    assert not triggered & {"llm_runs", "quality_metrics", "hallucination_evaluations"}
+    assert _post(client).headers["x-cache"] == "MISS" and _post(client).headers["x-cache"] == "HIT"
@@ -0,0 +1,121 @@
+import json
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture()
+def sales_db(obs_db):
+    """Tablas de facturación (como en seed.sql) + unas facturas sobre los clientes ES/FR del seed de test."""
+    conn = sqlite3.connect(obs_db)
+    conn.executescript(
+        """
+        CREATE TABLE product_categories (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL);
+        CREATE TABLE products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, sku TEXT NOT NULL UNIQUE, name TEXT NOT NULL, category_id INTEGER
+        );
+        CREATE TABLE invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, invoice_number TEXT NOT NULL UNIQUE, customer_id INTEGER NOT NULL,
+            invoice_date DATE NOT NULL, status TEXT NOT NULL DEFAULT 'open', currency TEXT NOT NULL DEFAULT 'EUR'
+        );
+        CREATE TABLE invoice_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, invoice_id INTEGER NOT NULL, product_id INTEGER,
+            description TEXT NOT NULL, quantity NUMERIC NOT NULL, unit_price NUMERIC NOT NULL,
+            discount_percent NUMERIC NOT NULL DEFAULT 0, line_total NUMERIC
+        );
+        INSERT INTO product_categories (name) VALUES ('Bebidas'), ('Snacks');
+        INSERT INTO products (sku, name, category_id) VALUES ('B1', 'Agua', 1), ('S1', 'Patatas', 2), ('X1', 'Suelto', NULL);
+        INSERT INTO invoices (invoice_number, customer_id, invoice_date, currency) VALUES
+        ('F-1', 1, '2025-12-05', 'EUR'), ('F-2', 2, '2025-12-05', 'EUR'), ('F-3', 1, '2025-12-20', 'EUR');
+        INSERT INTO invoice_items (invoice_id, product_id, description, quantity, unit_price, line_total) VALUES
+        (1, 1, 'agua', 10, 1.5, 15), (1, 2, 'patatas', 2, 2, 4), (2, 1, 'agua', 4, 1.5, 6), (3, 3, 'suelto', 1, 9, NULL);
+        """
+    )
+    conn.commit()
+    conn.close()
+    return obs_db
+
+
+MONTHLY_RAW = """
+SELECT strftime('%Y-%m', i.invoice_date) AS month, c.country_code, SUM(COALESCE(it.line_total, it.quantity * it.unit_price)) AS amount
+FROM invoice_items it JOIN invoices i ON i.id = it.invoice_id JOIN customers c ON c.id = i.customer_id
+WHERE i.status <> 'cancelled'
+GROUP BY 1, 2 ORDER BY 1, 2
+"""
+MONTHLY_ROLLUP = """
+SELECT strftime('%Y-%m', day) AS month, country_code, SUM(net_amount) AS amount
+FROM sales_daily_rollup GROUP BY 1, 2 ORDER BY 1, 2
+"""
+
+
+def test_triggers_keep_rollup_equal_to_full_aggregate(sales_db, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    import rollups
+
+    conn = sqlite3.connect(sales_db)
+    assert rollups.install(conn)["created"] is True
+    conn.commit()
+    assert rollups.install(conn) == {"installed": True, "created": False, "new_triggers": 0}
+    assert conn.execute(MONTHLY_ROLLUP).fetchall() == conn.execute(MONTHLY_RAW).fetchall()
+    assert conn.execute("SELECT lines, net_amount FROM sales_daily_rollup WHERE category_id = 0").fetchall() == [(1, 9)]
+
+    conn.execute("INSERT INTO invoice_items (invoice_id, product_id, description, quantity, unit_price, line_total) VALUES (2, 2, 'p', 1, 2, 2)")
+    conn.execute("UPDATE invoice_items SET quantity = 20, line_total = 30 WHERE id = 1")
+    conn.execute("UPDATE invoices SET invoice_date = '2026-01-02' WHERE id = 3")
+    conn.execute("UPDATE customers SET country_code = 'PT' WHERE id = 2")
+    conn.execute("UPDATE products SET category_id = 1 WHERE id = 3")
+    conn.execute("DELETE FROM invoice_items WHERE id = 2")
+    conn.commit()
+    check = rollups.verify(conn)
+    assert check["ok"], check
+    assert conn.execute(MONTHLY_ROLLUP).fetchall() == conn.execute(MONTHLY_RAW).fetchall()
+    assert conn.execute("SELECT COUNT(*) FROM sales_daily_rollup WHERE lines = 0").fetchone()[0] == 0
+    conn.close()
+
+
+def test_text2sql_steers_aggregates_to_rollup(sales_db, client, app_module, fake_llm):
+    # Los endpoints no instalan nada: sin arranque no hay tabla resumen.
+    assert client.get("/semantic").json()["preferred_sources"] == []
+    assert client.get("/db/rollups").json()["installed"] is False
+    app_module.prepare_database()
+    pack = json.dumps({"sql": "SELECT country_code, SUM(net_amount) FROM sales_daily_rollup GROUP BY 1", "params": {}, "notes": "ok"})
+    llm = fake_llm(pack)
+    r = client.post("/text2sql", json={"question": "ventas facturadas por país y mes"})
+    assert r.status_code == 200, r.text
+
+    context = json.loads(llm.calls[0]["messages"][1]["content"].split("SEMANTIC_MODEL:\n", 1)[1].split("\n\nQUESTION", 1)[0])
+    assert [s["table"] for s in context["preferred_sources"]] == ["sales_daily_rollup"]
+    assert "sales_daily_rollup" in context["tables"] and "sales_daily_rollup" in context["summary"]
+
+    info = client.get("/db/rollups?verify=true").json()
+    assert info["installed"] and info["triggers"] == 12 and info["verify"]["ok"]
+    assert client.get("/semantic").json()["preferred_sources"][0]["table"] == "sales_daily_rollup"
+
+
+def test_rollup_excludes_cancelled_invoices(sales_db, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    import rollups
+
+    conn = sqlite3.connect(sales_db)
+    conn.execute("UPDATE invoices SET status = 'cancelled' WHERE id = 2")
+    rollups.install(conn)
+    conn.commit()
+    assert conn.execute("SELECT SUM(net_amount) FROM sales_daily_rollup").fetchone()[0] == 28
+
+    conn.execute("UPDATE invoices SET status = 'cancelled' WHERE id = 1")
+    conn.execute("UPDATE invoices SET status = 'paid' WHERE id = 2")
+    conn.execute("INSERT INTO invoice_items (invoice_id, product_id, description, quantity, unit_price, line_total) VALUES (1, 1, 'a', 1, 1, 1)")
+    conn.execute("UPDATE customers SET country_code = 'PT' WHERE id = 1")
+    conn.commit()
+    assert rollups.verify(conn)["ok"]
+    assert conn.execute("SELECT SUM(net_amount) FROM sales_daily_rollup").fetchone()[0] == 15
+
+    # Triggers de una versión anterior: se sustituyen y la tabla se recarga.
+    conn.execute("DROP TRIGGER _ru_sales_daily_invoices_update")
+    conn.execute("CREATE TRIGGER _ru_sales_daily_invoices_update AFTER UPDATE OF id ON invoices BEGIN SELECT 1; END")
+    conn.execute("UPDATE sales_daily_rollup SET net_amount = 0")
+    assert rollups.install(conn)["new_triggers"] == 1
+    assert rollups.verify(conn)["ok"]
+    conn.close()
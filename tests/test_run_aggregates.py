@@ -0,0 +1,75 @@
+import json
+import sqlite3
+
+REFERENCE = """
+SELECT date(r.created_at), r.experiment_variant_id, r.model_id, COUNT(*),
+       (SELECT COUNT(*) FROM hallucination_evaluations h JOIN llm_runs x ON x.id = h.llm_run_id
+        WHERE h.is_hallucination = 1 AND date(x.created_at) = date(r.created_at)
+          AND x.experiment_variant_id IS r.experiment_variant_id AND x.model_id IS r.model_id),
+       SUM(r.cost_usd), AVG(r.elapsed_seconds)
+FROM llm_runs r WHERE r.stage IS NOT 'query_exec' GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+"""
+STORED = """
+SELECT day, experiment_variant_id, model_id, total_runs, total_hallucinations, total_cost_usd, avg_latency_seconds
+FROM daily_run_aggregates ORDER BY 1, 2, 3
+"""
+
+
+def _run(conn, uuid, day, variant=None, model=None, elapsed=1.0, cost=None, stage="text2sql"):
+    return conn.execute(
+        "INSERT INTO llm_runs (run_uuid, experiment_variant_id, model_id, question, answer, elapsed_seconds, cost_usd, "
+        "created_at, context_json) VALUES (?, ?, ?, 'q', 'a', ?, ?, ?, ?)",
+        (uuid, variant, model, elapsed, cost, f"{day} 10:00:00", json.dumps({"stage": stage})),
+    ).lastrowid
+
+
+def test_refresh_is_incremental_and_matches_full_scan(obs_db, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    import run_aggregates
+
+    conn = sqlite3.connect(obs_db)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    a = _run(conn, "a", "2025-12-01", elapsed=1.0, cost=0.5)
+    _run(conn, "b", "2025-12-01", elapsed=3.0)
+    _run(conn, "c", "2025-12-01", variant=1, model=2, elapsed=2.0, cost=0.25)
+    _run(conn, "d", "2025-12-02", elapsed=5.0)
+
+    first = run_aggregates.refresh(conn, batch_rows=3)
+    assert first["runs"] == 3 and not first["caught_up"]
+    second = run_aggregates.refresh(conn, batch_rows=3)
+    assert second["runs"] == 1 and second["caught_up"]
+    assert conn.execute(STORED).fetchall() == conn.execute(REFERENCE).fetchall()
+
+    # Evaluación tardía de un run ya agregado + una huérfana que solo mueve la marca de agua.
+    conn.execute("INSERT INTO hallucination_evaluations (llm_run_id, evaluator_name, score, is_hallucination) VALUES (?, 'j', 0.8, 1)", (a,))
+    conn.execute("INSERT INTO hallucination_evaluations (llm_run_id, evaluator_name, score, is_hallucination) VALUES (999, 'j', 0.1, 1)")
+    _run(conn, "e", "2025-12-01", elapsed=2.0, cost=1.0)
+    _run(conn, "f", "2025-12-01", elapsed=9.0, stage="query_exec")  # ejecución de SQL: no es un run del LLM
+    third = run_aggregates.refresh(conn)
+    assert third["runs"] == 2 and third["evaluations"] == 2 and third["keys"] == 1
+    assert conn.execute(STORED).fetchall() == conn.execute(REFERENCE).fetchall()
+    assert conn.execute(
+        "SELECT avg_hallucination_score FROM daily_run_aggregates WHERE day = '2025-12-01' AND model_id IS NULL"
+    ).fetchone()[0] == 0.8
+    assert run_aggregates.lag(conn) == {"llm_runs": 0, "hallucination_evaluations": 0}
+    assert run_aggregates.refresh(conn)["keys"] == 0
+    conn.close()
+
+
+def test_metrics_daily_reads_aggregates_written_with_each_batch(obs_db, client, app_module, fake_llm, monkeypatch):
+    monkeypatch.setattr(app_module, "TEXT2SQL_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_TEMPLATES_ENABLED", False)
+    pack = json.dumps({"sql": "SELECT id FROM customers", "params": {}, "notes": "ok"})
+    fake_llm(pack, pack)
+    for q in ("clientes", "ids de clientes"):
+        assert client.post("/text2sql", json={"question": q}).status_code == 200
+    for _ in range(3):
+        assert client.post("/query", json={"question": "clientes", "sql": "SELECT id FROM customers"}).status_code == 200
+    app_module.flush_observability()
+
+    body = client.get("/metrics/daily").json()
+    assert body["lag"] == {"llm_runs": 0, "hallucination_evaluations": 0}
+    assert [r["total_runs"] for r in body["rows"]] == [2]  # los /query no son runs del LLM
+    assert body["rows"][0]["avg_latency_seconds"] > 0
+    assert client.get("/metrics/daily?date_from=2999-01-01").json()["rows"] == []
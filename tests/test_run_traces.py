@@ -0,0 +1,67 @@
+import json
+import sqlite3
+
+
+def test_migration_adds_indexed_generated_columns_to_existing_rows(tmp_path, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    import run_traces
+
+    conn = sqlite3.connect(tmp_path / "legacy.sqlite")
+    conn.execute("CREATE TABLE llm_runs (id INTEGER PRIMARY KEY, run_uuid TEXT, context_json TEXT)")
+    conn.executemany("INSERT INTO llm_runs (run_uuid, context_json) VALUES (?, ?)", [
+        ("r1", json.dumps({"stage": "text2sql", "parent_run_uuid": "p-1"})),
+        ("r2", json.dumps({"stage": "query_exec", "parent_run_uuid": "p-1"})),
+        ("r3", json.dumps({"stage": "query_exec"})),
+    ])
+    assert not run_traces.is_migrated(conn)
+    assert run_traces.migrate(conn) == ["parent_run_uuid", "stage"]
+    assert run_traces.migrate(conn) == []
+
+    assert conn.execute("SELECT run_uuid, stage FROM llm_runs WHERE parent_run_uuid = 'p-1' ORDER BY id").fetchall() == [
+        ("r1", "text2sql"), ("r2", "query_exec")]
+    plan = " ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN SELECT * FROM llm_runs WHERE parent_run_uuid = 'p-1'"))
+    assert "USING INDEX idx_llm_runs_parent_run_uuid" in plan
+    assert run_traces.stage_expr(conn) == "stage"
+
+
+def test_runs_endpoint_returns_trace_with_stage_timings(obs_db, client, app_module, fake_llm):
+    fake_llm(json.dumps({"sql": "SELECT id FROM customers", "params": {}, "notes": "ok"}))
+    parent = "parent-trace-1"
+    gen = client.post("/text2sql", json={"question": "ids de clientes", "parent_run_uuid": parent}).json()
+    client.post("/query", json={"question": "ids de clientes", "sql": gen["sql"], "parent_run_uuid": parent})
+    client.post("/query", json={"question": "otra", "sql": "SELECT 1", "parent_run_uuid": "parent-other"})
+    app_module.flush_observability()
+
+    trace = client.get(f"/runs/{parent}").json()
+    assert [r["stage"] for r in trace["runs"]] == ["text2sql", "query_exec"]
+    assert trace["runs"][0]["run_uuid"] == gen["run_uuid"]
+    assert trace["runs"][1]["metrics"]["rows_returned"] == 2
+    assert set(trace["stages"]) == {"text2sql", "query_exec"}
+    assert abs(trace["total_elapsed_seconds"] - sum(r["elapsed_seconds"] for r in trace["runs"])) < 1e-9
+    assert client.get("/runs/parent-missing").status_code == 404
+
+
+def test_trace_columns_are_migrated_at_startup_not_per_batch(obs_db, client, app_module, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    import run_traces
+
+    conn = sqlite3.connect(obs_db)  # llm_runs de antes de la migración
+    for sql in ("DROP INDEX idx_llm_runs_parent_run_uuid", "DROP INDEX idx_llm_runs_stage",
+                "ALTER TABLE llm_runs DROP COLUMN parent_run_uuid", "ALTER TABLE llm_runs DROP COLUMN stage"):
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+    client.post("/query", json={"question": "ids", "sql": "SELECT id FROM customers", "parent_run_uuid": "p-start"})
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    assert not run_traces.is_migrated(conn)  # los lotes del escritor no ejecutan DDL
+    conn.close()
+
+    app_module.prepare_database()
+    conn = sqlite3.connect(obs_db)
+    assert run_traces.is_migrated(conn)
+    conn.close()
+    assert str(obs_db) in app_module._traced_dbs
+    assert [r["stage"] for r in client.get("/runs/p-start").json()["runs"]] == ["query_exec"]
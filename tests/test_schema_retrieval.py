@@ -0,0 +1,29 @@
+
+def test_select_schema_context_picks_relevant_tables(seed_db, semantic_layer_mod):
+    import schema_retrieval
+
+    layer = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    sel = schema_retrieval.select_schema_context(layer, "¿Pedidos por cliente?", k=1)
+
+    assert sel["fallback"] is False
+    assert sel["tables"][0] in ("sales_orders", "customers")
+    assert set(sel["tables"]) == {"sales_orders", "customers"}
+    assert "sales_orders.customer_id -> customers.id" in sel["summary"]
+
+
+def test_schema_index_is_cached_with_the_layer(seed_db, semantic_layer_mod):
+    import schema_retrieval
+
+    layer = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    idx1 = semantic_layer_mod.derived_index(layer, "schema_bm25", schema_retrieval.build_schema_index)
+    idx2 = semantic_layer_mod.derived_index(layer, "schema_bm25", schema_retrieval.build_schema_index)
+    assert idx1 is idx2
+
+
+def test_select_schema_context_falls_back_to_full_layer(seed_db, semantic_layer_mod):
+    import schema_retrieval
+
+    layer = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    sel = schema_retrieval.select_schema_context(layer, "hola")
+    assert sel["fallback"] is True
+    assert sel["summary"] == layer["summary"]
@@ -1,3 +1,8 @@
+import sqlite3
+
+import pytest
+
+
 def test_semantic_endpoint_returns_schema(client):
     r = client.get("/semantic")
     assert r.status_code == 200
@@ -11,3 +16,177 @@ def test_semantic_endpoint_returns_schema(client):
     assert "summary" in data
     assert isinstance(data["summary"], str)
 
+
+
+def test_semantic_cache_hits_until_ddl_changes(seed_db, semantic_layer_mod):
+    first = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    second = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    assert second is first
+    stats = semantic_layer_mod.semantic_cache_stats()
+    assert (stats["misses"], stats["hits"], stats["rebuilds"]) == (1, 1, 0)
+
+    conn = sqlite3.connect(seed_db)
+    conn.execute("CREATE TABLE regions (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.commit()
+    conn.close()
+
+    third = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    assert "regions" in third["schema"]["tables"]
+    assert third["fingerprint"] != first["fingerprint"]
+    assert semantic_layer_mod.semantic_cache_stats()["rebuilds"] == 1
+
+
+def test_infer_relationships_dedupes_and_builds_graph(seed_db, semantic_layer_mod):
+    schema = semantic_layer_mod.inspect_schema(str(seed_db))
+    rels = semantic_layer_mod.infer_relationships(schema)
+
+    links = [r for r in rels["relationships"]
+             if r.get("from_table") == "sales_orders" and r.get("from_column") == "customer_id"]
+    assert [(r["to_table"], r["type"]) for r in links] == [("customers", "fk")]
+
+    graph = rels["graph"]
+    assert {"table": "customers", "column": "customer_id", "ref_column": "id", "type": "fk", "direction": "out"} in graph["sales_orders"]
+    assert any(e["table"] == "sales_orders" and e["direction"] == "in" for e in graph["customers"])
+
+
+def test_join_path_endpoint(client):
+    r = client.get("/semantic/join-path", params={"from": "customers", "to": "sales_orders"})
+    assert r.status_code == 200
+    data = r.json()
+    assert [(h["from_table"], h["to_table"]) for h in data["hops"]] == [("customers", "sales_orders")]
+    assert "JOIN sales_orders ON sales_orders.customer_id = customers.id" in data["join_sql"]
+
+    r = client.get("/semantic/join-path", params={"from": "customers", "to": "nope"})
+    assert r.status_code == 404
+
+
+def test_inspect_schema_includes_views_and_indexes(seed_db, semantic_layer_mod):
+    conn = sqlite3.connect(seed_db)
+    conn.execute("CREATE VIEW orders AS SELECT id, customer_id, order_date FROM sales_orders")
+    conn.execute("CREATE INDEX idx_sales_orders_date ON sales_orders(order_date, status)")
+    conn.commit()
+    conn.close()
+
+    schema = semantic_layer_mod.inspect_schema(str(seed_db))
+    assert schema["tables"] == ["customers", "orders", "sales_orders"]
+    assert schema["views"] == ["orders"]
+    assert [c["name"] for c in schema["columns"]["orders"]] == ["id", "customer_id", "order_date"]
+    assert schema["foreign_keys"]["sales_orders"][0]["table"] == "customers"
+
+    idx = {i["name"]: i for i in schema["indexes"]["sales_orders"]}
+    assert idx["idx_sales_orders_date"]["columns"] == ["order_date", "status"]
+    assert any(i["unique"] and i["columns"] == ["order_number"] for i in idx.values())
+
+
+def test_semantic_snapshot_cold_start(seed_db, semantic_layer_mod):
+    import schema_retrieval
+
+    layer = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    schema_retrieval.select_schema_context(layer, "pedidos por cliente")
+    assert semantic_layer_mod.semantic_cache_stats()["snapshot_saves"] == 2
+
+    # Proceso "nuevo": la capa y el índice BM25 salen del snapshot, sin reconstruir
+    semantic_layer_mod.clear_semantic_cache()
+    assert semantic_layer_mod.load_snapshot(str(seed_db)) is True
+    warm = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    assert warm["summary"] == layer["summary"]
+    idx = semantic_layer_mod.derived_index(warm, "schema_bm25", lambda _: pytest.fail("index rebuilt"))
+    assert "customer" in idx["postings"]
+    stats = semantic_layer_mod.semantic_cache_stats()
+    assert (stats["snapshot_loads"], stats["hits"], stats["misses"]) == (1, 1, 0)
+
+    # Un DDL posterior invalida el snapshot en la primera validación
+    conn = sqlite3.connect(seed_db)
+    conn.execute("CREATE TABLE regions (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    semantic_layer_mod.clear_semantic_cache()
+    fresh = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    assert "regions" in fresh["schema"]["tables"]
+    assert semantic_layer_mod.semantic_cache_stats()["rebuilds"] == 1
+
+
+def test_fingerprint_changes_when_db_is_recreated_with_same_ddl_count(tmp_path, semantic_layer_mod):
+    import os
+
+    db = tmp_path / "recreated.sqlite"
+
+    def create(ddl):
+        if db.exists():
+            os.remove(db)
+        conn = sqlite3.connect(db)
+        conn.execute(ddl)
+        conn.commit()
+        conn.close()
+
+    create("CREATE TABLE a (id INTEGER PRIMARY KEY, name TEXT)")
+    first = semantic_layer_mod.get_semantic_layer(str(db))
+    assert semantic_layer_mod.snapshot_path(str(db)).endswith(".semantic.json")
+
+    # Mismo número de DDLs (mismo schema_version), esquema distinto, fichero nuevo.
+    create("CREATE TABLE b (id INTEGER PRIMARY KEY, total REAL)")
+    fp = semantic_layer_mod.schema_fingerprint(str(db))
+    assert fp.split("@")[1].split(".")[0] == first["fingerprint"].split("@")[1].split(".")[0]
+    assert fp != first["fingerprint"]
+
+    # Proceso nuevo con el sidecar viejo: el snapshot se carga pero no se acepta.
+    semantic_layer_mod.clear_semantic_cache()
+    assert semantic_layer_mod.load_snapshot(str(db)) is True
+    layer = semantic_layer_mod.get_semantic_layer(str(db))
+    assert list(layer["schema"]["tables"]) == ["b"]
+    assert semantic_layer_mod.semantic_cache_stats()["rebuilds"] == 1
+
+
+def test_inspect_schema_skips_broken_views(seed_db, semantic_layer_mod):
+    conn = sqlite3.connect(seed_db)
+    conn.execute("CREATE TABLE tmp_orders (id INTEGER PRIMARY KEY, total NUMERIC)")
+    conn.execute("CREATE VIEW broken_orders AS SELECT id, total FROM tmp_orders")
+    conn.execute("CREATE VIEW orders AS SELECT id, customer_id FROM sales_orders")
+    conn.execute("DROP TABLE tmp_orders")
+    conn.commit()
+    conn.close()
+
+    schema = semantic_layer_mod.inspect_schema(str(seed_db))
+    assert schema["tables"] == ["customers", "orders", "sales_orders"]
+    assert schema["views"] == ["orders"]
+    assert schema["foreign_keys"]["sales_orders"][0]["table"] == "customers"
+    assert [(i["name"], i["type"]) for i in schema["invalid"]] == [("broken_orders", "view")]
+    assert "tmp_orders" in schema["invalid"][0]["error"]
+    assert "broken_orders" not in semantic_layer_mod.build_semantic_layer(str(seed_db))["summary"]
+
+
+def test_fingerprint_keeps_its_connection_across_data_writes(seed_db, semantic_layer_mod):
+    import os
+
+    path = os.path.abspath(seed_db)
+    fp = semantic_layer_mod.schema_fingerprint(str(seed_db))
+    conn_before = semantic_layer_mod._FINGERPRINT_CONNS[path]["conn"]
+    conn = sqlite3.connect(seed_db)
+    conn.execute("INSERT INTO customers (name, country_code) VALUES ('Nueva', 'PT')")
+    conn.commit()
+    os.utime(seed_db, ns=(1, 1))  # mtime distinto: no debe reabrir
+    assert semantic_layer_mod.schema_fingerprint(str(seed_db)) == fp
+    assert semantic_layer_mod._FINGERPRINT_CONNS[path]["conn"] is conn_before
+
+    conn.execute("CREATE TABLE regions (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    assert semantic_layer_mod.schema_fingerprint(str(seed_db)) != fp
+    assert semantic_layer_mod._FINGERPRINT_CONNS[path]["conn"] is conn_before
+
+
+def test_truncated_or_foreign_snapshot_is_ignored(seed_db, semantic_layer_mod):
+    import json
+
+    layer = semantic_layer_mod.get_semantic_layer(str(seed_db))
+    path = semantic_layer_mod.snapshot_path(str(seed_db))
+    with open(path, encoding="utf-8") as f:
+        snap = json.load(f)
+
+    for bad in ({k: v for k, v in snap.items() if k != "layer"}, {**snap, "layer": ["otra", "cosa"]},
+                {**snap, "derived": ["schema_bm25"]}):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(bad, f)
+        semantic_layer_mod.clear_semantic_cache()
+        assert semantic_layer_mod.load_snapshot(str(seed_db)) is False
+        assert semantic_layer_mod.get_semantic_layer(str(seed_db))["summary"] == layer["summary"]
@@ -13,3 +13,27 @@ def test_sql_allows_select(client):
     assert body["rowcount"] == 1
     assert "rows" in body
     assert body["rows"][0]["n"] == 2
+
+def test_sql_allows_columns_and_literals_that_look_like_keywords(obs_db, client):
+    sql = "SELECT created_at, order_number FROM sales_orders WHERE status <> 'drop; delete' -- update; insert"
+    r = client.post("/sql", json={"sql": sql})
+    assert r.status_code == 200
+    assert r.json()["rowcount"] == 2
+
+def test_sql_blocks_writes_hidden_behind_a_cte(client):
+    r = client.post("/sql", json={"sql": "WITH x AS (SELECT 1) DELETE FROM customers"})
+    assert r.status_code == 400
+    assert "delete:customers" in r.json()["detail"]
+
+def test_sql_blocks_pragma_and_reports_invalid_sql(client):
+    assert client.post("/sql", json={"sql": "PRAGMA table_info(customers)"}).status_code == 400
+    r = client.post("/sql", json={"sql": "SELECT nope FROM customers"})
+    assert r.status_code == 400
+    assert r.json()["detail"].startswith("SQL inválido")
+
+def test_sql_guard_memoizes_verdicts(client, app_module):
+    for _ in range(3):
+        client.post("/sql", json={"sql": "SELECT name FROM customers"})
+        client.post("/sql", json={"sql": "SELECT 1; SELECT 2"})
+    info = app_module.sql_guard.info()
+    assert info["misses"] == 2 and info["hits"] == 4 and info["rejected"] == 3
@@ -0,0 +1,283 @@
+import json
+import sqlite3
+
+
+SQL_PACK = json.dumps({"sql": "SELECT country_code, COUNT(*) AS n FROM customers GROUP BY country_code", "params": {}, "notes": "ok"})
+
+
+def test_text2sql_cache_skips_llm_for_normalized_repeat(obs_db, client, app_module, fake_llm):
+    llm = fake_llm(SQL_PACK)
+
+    r1 = client.post("/text2sql", json={"question": "¿Clientes por país?"})
+    r2 = client.post("/text2sql", json={"question": "  clientes POR pais "})
+    assert r1.status_code == 200 and r2.status_code == 200
+    assert r2.json()["sql"] == r1.json()["sql"]
+    assert len(llm.calls) == 1
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    contexts = [json.loads(c) for (c,) in conn.execute("SELECT context_json FROM llm_runs ORDER BY id")]
+    hit_metrics = conn.execute("SELECT COUNT(*) FROM quality_metrics WHERE metric_name='cache_hit'").fetchone()[0]
+    conn.close()
+    assert [c["cache"] for c in contexts] == ["miss", "hit"]
+    assert hit_metrics == 1
+
+    assert client.get("/text2sql/cache").json()["cache"]["memory_hits"] == 1
+
+
+def test_text2sql_cache_disk_level_survives_new_process(tmp_path, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from text2sql_cache import Text2SQLCache, normalize_question
+
+    assert normalize_question("¿Ventas  por País?") == "ventas por pais"
+
+    path = str(tmp_path / "cache.sqlite")
+    Text2SQLCache(path).put("Ventas por país", "m", "fp@1", "SELECT 1", {"x": 1}, "ok")
+    fresh = Text2SQLCache(path)
+    assert fresh.get("ventas por pais", "m", "fp@1") == {"sql": "SELECT 1", "params": {"x": 1}, "notes": "ok", "level": "disk"}
+    assert fresh.get("ventas por pais", "m", "fp@2") is None
+    assert fresh.get("ventas por pais", "m", "fp@1")["level"] == "memory"
+
+
+def test_text2sql_cache_keeps_operators_and_prunes_disk_level(tmp_path, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from text2sql_cache import Text2SQLCache, normalize_question
+
+    assert normalize_question("ventas > 100") != normalize_question("ventas < 100")
+    assert normalize_question("caída del -5%") == "caida del -5 %"
+    assert normalize_question("pedidos 2025-03") == "pedidos 2025 03"
+
+    path = str(tmp_path / "cache.sqlite")
+    cache = Text2SQLCache(path, max_rows=2)
+    cache.put("ventas > 100", "m", "fp@1", "SELECT 1", {}, "")
+    assert cache.get("ventas < 100", "m", "fp@1") is None
+    cache.put("vieja", "m", "fp@1", "SELECT 0", {}, "")
+    for i in range(4):
+        cache.put(f"pregunta {i}", "m", "fp@2", "SELECT 2", {}, "")  # la huella nueva purga fp@1
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE text2sql_cache SET created_at = datetime('now', '-90 days') WHERE question_norm = 'pregunta 3'")
+    conn.commit()
+    conn.close()
+    assert cache.prune("fp@2") == 2
+    conn = sqlite3.connect(path)
+    rows = sorted(r[0] for r in conn.execute("SELECT question_norm FROM text2sql_cache"))
+    conn.close()
+    assert rows == ["pregunta 1", "pregunta 2"]
+    assert cache.info()["evicted"] == 4
+
+
+def test_text2sql_template_reuse_for_other_literal(obs_db, client, fake_llm):
+    llm = fake_llm(json.dumps({
+        "sql": "SELECT COUNT(*) AS n FROM sales_orders so JOIN customers c ON c.id = so.customer_id "
+               "WHERE c.country_code = 'ES' AND strftime('%Y-%m', so.order_date) = '2025-12'",
+        "params": {},
+        "notes": "pedidos ES diciembre",
+    }))
+
+    r1 = client.post("/text2sql", json={"question": "Pedidos en ES en diciembre de 2025"})
+    assert r1.status_code == 200
+    r2 = client.post("/text2sql", json={"question": "pedidos en FR en diciembre 2025"})
+    assert r2.status_code == 200
+    assert len(llm.calls) == 1
+
+    body = r2.json()
+    assert ":country" in body["sql"] and ":month" in body["sql"]
+    assert body["params"] == {"country": "FR", "month": "2025-12"}
+
+    r3 = client.post("/query", json={"question": "pedidos FR", "sql": body["sql"], "params": body["params"]})
+    assert r3.status_code == 200
+    assert r3.json()["rows"] == [{"n": 1}]
+
+
+def test_template_bootstrap_from_logged_runs(obs_db, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from sql_templates import TemplateStore
+
+    conn = sqlite3.connect(obs_db)
+    conn.execute(
+        "INSERT INTO llm_runs (run_uuid, question, answer, context_json) VALUES (?, ?, ?, ?)",
+        ("run-1", "Clientes en ES", "OK: 1 filas",
+         json.dumps({"stage": "query_exec", "sql": "SELECT name FROM customers WHERE country_code = :cc", "params": {"cc": "ES"}})),
+    )
+    conn.commit()
+    store = TemplateStore(str(obs_db) + ".tpl.sqlite")
+    assert store.bootstrap_from_runs(conn, "fp@1") == 1
+    conn.close()
+
+    match = store.match("clientes en FR", "fp@1")
+    assert match["sql"] == "SELECT name FROM customers WHERE country_code = :cc"
+    assert match["params"] == {"cc": "FR"}
+    assert store.match("clientes en FR", "fp@2") is None
+
+
+def test_text2sql_coalesces_identical_inflight_questions(obs_db, app_module, fake_llm, monkeypatch):
+    import asyncio
+    import httpx
+
+    monkeypatch.setattr(app_module, "TEXT2SQL_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_TEMPLATES_ENABLED", False)
+    llm = fake_llm(SQL_PACK, delay=0.2)
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app_module.api)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            questions = ["¿Clientes por país?"] * 4 + ["clientes por PAIS"]
+            return await asyncio.gather(*(ac.post("/text2sql", json={"question": q}) for q in questions))
+
+    responses = asyncio.run(burst())
+    assert all(r.status_code == 200 for r in responses)
+    assert len(llm.calls) == 1
+    assert len({r.json()["run_uuid"] for r in responses}) == 5
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    rows = conn.execute("SELECT total_tokens, context_json FROM llm_runs ORDER BY id").fetchall()
+    conn.close()
+    coalesced = [json.loads(c)["coalesced"] for _, c in rows]
+    assert coalesced.count(False) == 1 and coalesced.count(True) == 4
+    assert sum(t or 0 for t, _ in rows) == 15
+
+
+def test_text2sql_hedge_wins_when_primary_is_slow(obs_db, client, app_module, fake_llm, monkeypatch):
+    monkeypatch.setattr(app_module, "TEXT2SQL_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_TEMPLATES_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_HEDGE_DEFAULT_SECONDS", 0.05)
+    hedge_sql = json.dumps({"sql": "SELECT 2", "params": {}, "notes": "hedge"})
+    llm = fake_llm(SQL_PACK, hedge_sql, delay=[1.0, 0.0])
+
+    samples = len(app_module._llm_latency)
+    r = client.post("/text2sql", json={"question": "clientes por pais"})
+    assert r.status_code == 200
+    assert r.json()["sql"] == "SELECT 2"
+    assert len(llm.calls) == 2
+    # El primario cancelado también entra en la ventana (si no, el percentil solo ve a los rápidos).
+    assert len(app_module._llm_latency) == samples + 2
+    assert app_module._llm_latency.percentile(1.0) >= 0.05
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    (ctx,) = conn.execute("SELECT context_json FROM llm_runs").fetchone()
+    conn.close()
+    attempts = {a["attempt"]: a for a in json.loads(ctx)["attempts"]}
+    assert attempts["primary"]["outcome"] == "cancelled"
+    assert attempts["retry"]["outcome"] == "ok"
+    assert attempts["retry"]["started_s"] >= 0.05
+
+
+def test_text2sql_invalid_json_falls_back_to_retry(obs_db, client, app_module, fake_llm, monkeypatch):
+    monkeypatch.setattr(app_module, "TEXT2SQL_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_HEDGE_ENABLED", False)
+    llm = fake_llm("no es json", SQL_PACK)
+
+    r = client.post("/text2sql", json={"question": "clientes por pais"})
+    assert r.status_code == 200
+    assert "ULTIMO AVISO" in llm.calls[1]["messages"][0]["content"]
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    (ctx, total_tokens) = conn.execute("SELECT context_json, total_tokens FROM llm_runs").fetchone()
+    conn.close()
+    assert [a["outcome"] for a in json.loads(ctx)["attempts"]] == ["rejected", "ok"]
+    assert total_tokens == 30  # también los tokens del intento rechazado
+
+
+def test_text2sql_accepts_columns_named_like_keywords_and_rejects_writes(obs_db, client, app_module, fake_llm, monkeypatch):
+    monkeypatch.setattr(app_module, "TEXT2SQL_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_TEMPLATES_ENABLED", False)
+    fake_llm(
+        json.dumps({"sql": "SELECT order_number, created_at FROM sales_orders", "params": {}, "notes": "ok"}),
+        json.dumps({"sql": "WITH x AS (SELECT 1) UPDATE customers SET name = 'x'", "params": {}, "notes": "mal"}),
+    )
+    assert client.post("/text2sql", json={"question": "fechas de alta de pedidos"}).status_code == 200
+    r = client.post("/text2sql", json={"question": "renombra clientes"})
+    assert r.status_code == 400 and "solo lectura" in r.json()["detail"]
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    reasons = [json.loads(j)["reason"] for (j,) in conn.execute("SELECT metric_json FROM quality_metrics WHERE metric_name='ok' AND metric_value=0")]
+    conn.close()
+    assert reasons == ["forbidden_sql"]
+
+
+def test_text2sql_empty_sql_is_not_a_guardrail_error(obs_db, client, app_module, fake_llm, monkeypatch):
+    monkeypatch.setattr(app_module, "TEXT2SQL_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_TEMPLATES_ENABLED", False)
+    fake_llm(json.dumps({"sql": "  ", "params": {}, "notes": "no hay datos para eso"}))
+    r = client.post("/text2sql", json={"question": "¿qué tiempo hace?"})
+    assert r.status_code == 200 and r.json()["sql"] == ""
+
+    app_module.flush_observability()
+    conn = sqlite3.connect(obs_db)
+    answers = [a for (a,) in conn.execute("SELECT answer FROM llm_runs")]
+    valid = conn.execute("SELECT metric_value FROM quality_metrics WHERE metric_name='sql_valid'").fetchall()
+    conn.close()
+    assert answers == ["(empty sql)"] and valid == [(0,)]
+
+
+def test_template_requires_same_skeleton_and_strict_slots(tmp_path, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from sql_templates import TemplateStore, extract_slots
+
+    store = TemplateStore(str(tmp_path / "tpl.sqlite"))
+    sql = "SELECT c.country_code, SUM(i.total) FROM invoices i JOIN customers c ON c.id = i.customer_id " \
+          "WHERE c.country_code = 'ES' AND strftime('%Y-%m', i.invoice_date) = '2025-03' GROUP BY 1"
+    assert store.learn("Ventas en ES en marzo de 2025", sql, {}, "", "fp@1")
+
+    assert store.match("ventas en FR en abril 2025", "fp@1")["params"] == {"country": "FR", "month": "2025-04"}
+    assert store.match("Ventas de FR en abril de 2025", "fp@1") is not None
+    for other in ("ventas no en FR en abril 2025", "ventas medias en FR en abril 2025",
+                  "top ventas en FR en abril 2025", "ventas en FR excepto abril 2025"):
+        assert store.match(other, "fp@1") is None, other
+
+    assert extract_slots("VENTAS DE ES EN 2025")[1] == [("year", "2025")]
+    assert extract_slots("pedido SO-ES-1 de Ventas")[1] == []
+    assert extract_slots("which customers may churn in ES")[1] == [("country", "ES")]
+    assert extract_slots("orders in May 2025 for ES")[1] == [("month", "2025-05"), ("country", "ES")]
+    assert extract_slots("orders on 5 may in ES")[1] == [("monthnum", "05"), ("country", "ES")]
+
+
+def test_text2sql_builds_schema_context_off_the_event_loop(obs_db, client, app_module, fake_llm, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(app_module, "TEXT2SQL_CACHE_ENABLED", False)
+    monkeypatch.setattr(app_module, "TEXT2SQL_TEMPLATES_ENABLED", False)
+    fake_llm(SQL_PACK)
+    on_loop = []
+
+    def spy(fn):
+        def wrapper(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(fn.__name__)
+            except RuntimeError:
+                pass
+            return fn(*args, **kwargs)
+        return wrapper
+
+    for name in ("select_schema_context", "join_hints", "focused_summary"):
+        monkeypatch.setattr(app_module, name, spy(getattr(app_module, name)))
+    monkeypatch.setattr(app_module.rollups, "rollup_hints", spy(app_module.rollups.rollup_hints))
+    assert client.post("/text2sql", json={"question": "clientes por pais"}).status_code == 200
+    assert on_loop == []
+
+
+def test_template_store_prunes_other_fingerprints(tmp_path, project_root):
+    import sys
+    sys.path.insert(0, str(project_root))
+    from sql_templates import TemplateStore
+
+    path = str(tmp_path / "tpl.sqlite")
+    store = TemplateStore(path)
+    sql = "SELECT name FROM customers WHERE country_code = 'ES'"
+    assert store.learn("clientes en ES", sql, {}, "", "fp@1")
+    assert store.learn("clientes de ES", sql, {}, "", "fp@2")  # huella nueva: se van las de fp@1
+    assert store.match("clientes en FR", "fp@1") is None
+    assert store.info()["pruned"] == 2 and store.info()["templates"] == 0
+
+    assert store.learn("clientes en ES", sql, {}, "", "fp@3")
+    assert TemplateStore(path).prune("fp@4") == 1  # otro proceso, huella nueva
+    assert TemplateStore(path).info()["templates"] == 0
@@ -0,0 +1,144 @@
+# text2sql_cache.py
+# Caché pregunta -> SQL delante del LLM: LRU en memoria + tabla SQLite persistente.
+import hashlib, json, os, re, sqlite3, threading, unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+TEXT2SQL_CACHE_MAX_ROWS = int(os.getenv("TEXT2SQL_CACHE_MAX_ROWS", "50000"))
+TEXT2SQL_CACHE_TTL_DAYS = float(os.getenv("TEXT2SQL_CACHE_TTL_DAYS", "30"))
+_PRUNE_EVERY = 100  # stores entre podas del nivel SQLite
+
+# Palabras, operadores de comparación, '%' y números con signo: "ventas > 100" y "ventas < 100" o "-5%" y "5%"
+# piden SQL distinto. El resto de la puntuación se descarta.
+_TOKEN_RE = re.compile(r"<=|>=|!=|<>|[<>=%]|(?<!\w)[+-]\d\w*|\w+", re.UNICODE)
+
+def normalize_question(question: str) -> str:
+    """'¿Ventas  por País > 100?' -> 'ventas por pais > 100' (minúsculas, sin acentos, sin puntuación salvo operadores)."""
+    text = unicodedata.normalize('NFKD', (question or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(_TOKEN_RE.findall(text))
+
+def cache_key(question: str, model: str, fingerprint: str) -> str:
+    raw = '\x1f'.join((normalize_question(question), model, fingerprint))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+class Text2SQLCache:
+    """
+    Dos niveles: L1 = OrderedDict LRU del proceso; L2 = SQLite compartido entre procesos.
+    La clave incluye modelo y huella de esquema, así que un DDL o un cambio de modelo no reutiliza SQL viejo.
+    L2 se poda al ver una huella nueva y cada _PRUNE_EVERY stores: fuera las filas de otras huellas (el fichero es
+    de una sola BD, así que son de un esquema que ya no existe), las que llevan ttl_days sin usarse y el exceso
+    sobre max_rows (las menos recientes).
+    """
+
+    def __init__(self, path: str, max_entries: int = 1024, max_rows: int = TEXT2SQL_CACHE_MAX_ROWS,
+                 ttl_days: float = TEXT2SQL_CACHE_TTL_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl_days = ttl_days
+        self._lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pruned_for: Optional[str] = None
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evicted': 0}
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS text2sql_cache (
+                cache_key       TEXT PRIMARY KEY,
+                question_norm   TEXT NOT NULL,
+                model           TEXT NOT NULL,
+                fingerprint     TEXT NOT NULL,
+                sql             TEXT NOT NULL,
+                params          TEXT NOT NULL,
+                notes           TEXT,
+                hits            INTEGER NOT NULL DEFAULT 0,
+                created_at      DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_hit_at     DATETIME
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _remember(self, key: str, value: Dict[str, Any]) -> None:
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, question: str, model: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """{'sql', 'params', 'notes', 'level'} o None."""
+        key = cache_key(question, model, fingerprint)
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None:
+                self._lru.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return {**hit, 'level': 'memory'}
+            row = self._conn.execute(
+                "SELECT sql, params, notes FROM text2sql_cache WHERE cache_key=?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute(
+                "UPDATE text2sql_cache SET hits = hits + 1, last_hit_at = CURRENT_TIMESTAMP WHERE cache_key=?", (key,)
+            )
+            self._conn.commit()
+            value = {'sql': row[0], 'params': json.loads(row[1]), 'notes': row[2] or ''}
+            self._remember(key, value)
+            self.stats['disk_hits'] += 1
+            return {**value, 'level': 'disk'}
+
+    def put(self, question: str, model: str, fingerprint: str, sql: str, params: Dict[str, Any], notes: str) -> None:
+        key = cache_key(question, model, fingerprint)
+        value = {'sql': sql, 'params': params, 'notes': notes}
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO text2sql_cache (cache_key, question_norm, model, fingerprint, sql, params, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET sql=excluded.sql, params=excluded.params, notes=excluded.notes
+                """,
+                (key, normalize_question(question), model, fingerprint, sql, json.dumps(params, ensure_ascii=False), notes),
+            )
+            self.stats['stores'] += 1
+            if fingerprint != self._pruned_for or self.stats['stores'] % _PRUNE_EVERY == 0:
+                self._prune(fingerprint)
+            self._conn.commit()
+            self._remember(key, value)
+
+    def prune(self, fingerprint: str) -> int:
+        """Poda L2 ahora (además de la automática en put). -> filas eliminadas."""
+        with self._lock:
+            before = self.stats['evicted']
+            self._prune(fingerprint)
+            self._conn.commit()
+            return self.stats['evicted'] - before
+
+    def _prune(self, fingerprint: str) -> None:
+        """Poda de L2 (con el lock tomado; commit lo hace quien llama)."""
+        evicted = self._conn.execute("DELETE FROM text2sql_cache WHERE fingerprint != ?", (fingerprint,)).rowcount
+        if self.ttl_days > 0:
+            evicted += self._conn.execute(
+                "DELETE FROM text2sql_cache WHERE COALESCE(last_hit_at, created_at) < datetime('now', ?)",
+                (f"-{self.ttl_days} days",),
+            ).rowcount
+        if self.max_rows > 0:
+            evicted += self._conn.execute(
+                """
+                DELETE FROM text2sql_cache WHERE cache_key IN (
+                    SELECT cache_key FROM text2sql_cache
+                    ORDER BY COALESCE(last_hit_at, created_at) DESC, rowid DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_rows,),
+            ).rowcount
+        self._pruned_for = fingerprint
+        self.stats['evicted'] += evicted
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'memory_entries': len(self._lru), 'path': self.path}